@@ -0,0 +1,78 @@
+"""
+Per-lookup cost of the redirect query: ORM path vs prepared asyncpg path.
+
+Needs a reachable database configured the same way as the app (POSTGRES_* env / .env).
+Run from the repository root:
+
+    python -m benchmarks.bench_lookup --iterations 5000
+"""
+
+import argparse
+import asyncio
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete
+
+from src.app.core.db.database import engine, SessionLocal
+from src.app.core.db.init_db import init_db
+from src.app.core.db import lookup
+from src.app.core.utils import get_password_hash
+from src.app.crud import operations
+from src.app.models.models import User, ShortURL, DEFAULT_DOMAIN_ID
+
+BENCH_CODE = "bench-lookup"
+
+
+async def _seed():
+    async with SessionLocal() as db:
+        await db.execute(delete(ShortURL).where(ShortURL.short_code == BENCH_CODE))
+        user = await operations.get_existing_user(db, "bench-user")
+        if user is None:
+            user = User(username="bench-user", fullname="bench", hasshed_password=get_password_hash("bench"))
+            db.add(user)
+            await db.commit()
+        await operations.create_short_link(
+            db, "https://example.com/bench", BENCH_CODE, user.id,
+            datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+
+
+async def _measure(name: str, lookup_once, iterations: int):
+    for _ in range(100):  # warm up pools and statement caches
+        await lookup_once()
+    cpu, wall = time.process_time(), time.perf_counter()
+    for _ in range(iterations):
+        await lookup_once()
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    print(f"{name:<10} cpu {cpu / iterations * 1e6:8.1f} us/lookup   wall {wall / iterations * 1e6:8.1f} us/lookup")
+    return cpu / iterations
+
+
+async def main(iterations: int):
+    await init_db()
+    await _seed()
+    await lookup.open_pool()
+
+    async def orm_lookup():
+        async with SessionLocal() as db:
+            await operations.get_link_by_code(db, DEFAULT_DOMAIN_ID, BENCH_CODE)
+
+    async def prepared_lookup():
+        await lookup.get_link(DEFAULT_DOMAIN_ID, BENCH_CODE)
+
+    orm_cpu = await _measure("orm", orm_lookup, iterations)
+    prepared_cpu = await _measure("prepared", prepared_lookup, iterations)
+    print(f"saved      cpu {(orm_cpu - prepared_cpu) * 1e6:8.1f} us/lookup ({prepared_cpu / orm_cpu:.0%} of ORM)")
+
+    await lookup.close_pool()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(main(args.iterations))
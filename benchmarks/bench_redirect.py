@@ -0,0 +1,100 @@
+"""
+Redirect latency through the whole app: PostgreSQL vs SQLite (WAL) backend.
+
+Every backend runs in its own process with DATABASE_BACKEND set. The PostgreSQL
+run needs a reachable database configured the same way as the app (POSTGRES_* env / .env),
+the SQLite one a throwaway file. The hot-link cache is kept out of the way, so every
+redirect reads the link and writes its click. Run from the repository root:
+
+    python -m benchmarks.bench_redirect --requests 2000
+    python -m benchmarks.bench_redirect --backends sqlite
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+BACKENDS = ("postgresql", "sqlite")
+BENCH_CODE = "bench-redirect"
+
+
+async def _seed():
+    from sqlalchemy import delete
+
+    from src.app.core.db.database import open_session
+    from src.app.core.utils import get_password_hash
+    from src.app.crud import operations
+    from src.app.models.models import User, ShortURL
+
+    async with open_session() as db:
+        await db.execute(delete(ShortURL).where(ShortURL.short_code == BENCH_CODE))
+        user = await operations.get_existing_user(db, "bench-user")
+        if user is None:
+            user = User(username="bench-user", fullname="bench", hasshed_password=get_password_hash("bench"))
+            db.add(user)
+            await db.commit()
+        await operations.create_short_link(
+            db, "https://example.com/bench", BENCH_CODE, user.id,
+            datetime.now(timezone.utc) + timedelta(hours=1),
+        )
+
+
+async def run(backend: str, requests: int):
+    import httpx
+    from src.app.main import app
+
+    logging.disable(logging.INFO)
+    async with app.router.lifespan_context(app):
+        await _seed()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for _ in range(100):  # warm up pools and statement caches
+                await client.get(f"/{BENCH_CODE}")
+            latencies = []
+            for _ in range(requests):
+                started = time.perf_counter()
+                response = await client.get(f"/{BENCH_CODE}")
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 307, response.text
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"{backend:<10} mean {statistics.fmean(latencies) * 1e6:8.1f} us   "
+          f"p50 {p50 * 1e6:8.1f} us   p99 {p99 * 1e6:8.1f} us   ({requests} redirects)")
+
+
+def main(backends: list[str], requests: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in backends:
+            env = dict(
+                os.environ,
+                DATABASE_BACKEND=backend,
+                SQLITE_PATH=os.path.join(tmp, "bench.db"),
+                LINK_SNAPSHOT_PATH=os.path.join(tmp, "link_snapshot.bin"),
+                # no link is ever hot enough to be cached
+                HOT_LINKS_MIN_CLICKS=str(2 ** 62),
+            )
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_redirect", "--run", backend, "--requests", str(requests)],
+                env=env, check=True,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--run", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        asyncio.run(run(args.run, args.requests))
+    else:
+        main(args.backends, args.requests)
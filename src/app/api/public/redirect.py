@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import RedirectResponse
 from typing import Annotated
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -7,6 +7,8 @@ import logging
 from src.app.core.db.database import get_db
 from src.app.core import exceptions
 from src.app.services.url_service import get_original_url, collect_statistic
+from src.app.services.click_events import click_events, build_event
+from src.app.services.domains import domains
 
 logger = logging.getLogger(__name__)
 
@@ -16,13 +18,17 @@ public_router = APIRouter()
 @public_router.get("/{short_code}", response_class=RedirectResponse, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
 async def redirect(
         short_code: str,
+        request: Request,
         db: Annotated[AsyncSession, Depends(get_db)]
 ):
     """
     Redirect to the original URL.
 
+    The short code is looked up under the domain of the Host header.
+
     Args:
         short_code: The short code to redirect.
+        request: Incoming request, source of the domain and the click event details.
         db: Active SQLAlchemy async session.
     Returns:
         A redirect response(307).
@@ -30,8 +36,10 @@ async def redirect(
         HTTPException(404) when URL is not found or is invalid.
         HTTPException(503) when other error occurs.
     """
+    domain_id = domains.resolve(request.headers.get("host"))
     try:
-        long_url: str = await get_original_url(short_code, db)
+        long_url: str = await get_original_url(domain_id, short_code)
+        await collect_statistic(db, domain_id, short_code)
     except exceptions.ShortUrlNotFound:
         logger.exception(f"Short code {short_code} not found")
         raise HTTPException(
@@ -45,6 +53,12 @@ async def redirect(
             detail="URL shortening service currently unavailable. Try again later"
         )
 
-    await collect_statistic(db, short_code)
+    click_events.enqueue(build_event(
+        domain_id,
+        short_code,
+        referrer=request.headers.get("referer"),
+        user_agent=request.headers.get("user-agent"),
+        client_host=request.client.host if request.client else None,
+    ))
 
     return long_url
@@ -0,0 +1,194 @@
+"""
+FastAPI endpoints for service administrators.
+
+Includes:
+- Listing the hottest short codes
+- Click event pipeline counters
+- Listing and adding short domains
+- Fetching request profiles
+"""
+
+from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, status
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
+
+from src.app.schemas import (UserResponse, HotLinksResponse, ClickEventCountersResponse,
+                             DomainRequest, DomainResponse, DomainsResponse,
+                             ProfilesResponse, ProfileDetailsResponse)
+from src.app.core.db.database import get_db
+from src.app.core.utils import get_current_admin
+from src.app.core import exceptions, profiling
+from src.app.services.hot_links import tracker
+from src.app.services.click_events import click_events
+from src.app.services import domains
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/v1/admin")
+
+ProfileId = Annotated[str, Path(pattern=r"^\d{8}T\d{12}-[0-9a-f]{8}$", description="Id of the profile")]
+
+
+@router.get("/hot-links", response_model=HotLinksResponse)
+async def hot_links(
+        _admin: Annotated[UserResponse, Depends(get_current_admin)],
+        limit: Annotated[int, Query(ge=1, le=1000)] = 20
+) -> HotLinksResponse:
+    """
+    List the hottest short codes seen by this worker.
+
+    Args:
+        _admin: Current admin user.
+        limit: Number of links to return.
+    Returns:
+        Hot links with estimated recent clicks and rates as a pydantic model.
+    Raises:
+        HTTPException(403) when user is not an admin.
+    """
+    return HotLinksResponse(links=tracker.top(limit))
+
+
+@router.get("/click-events", response_model=ClickEventCountersResponse)
+async def click_event_counters(
+        _admin: Annotated[UserResponse, Depends(get_current_admin)]
+) -> ClickEventCountersResponse:
+    """
+    Counters of this worker's click event pipeline.
+
+    Args:
+        _admin: Current admin user.
+    Returns:
+        Queue and write counters as a pydantic model.
+    Raises:
+        HTTPException(403) when user is not an admin.
+    """
+    return ClickEventCountersResponse(**click_events.counters())
+
+
+@router.get("/domains", response_model=DomainsResponse)
+async def list_domains(
+        _admin: Annotated[UserResponse, Depends(get_current_admin)]
+) -> DomainsResponse:
+    """
+    List the short domains as currently known to this worker.
+
+    Args:
+        _admin: Current admin user.
+    Returns:
+        Domains as a pydantic model.
+    Raises:
+        HTTPException(403) when user is not an admin.
+    """
+    return DomainsResponse(domains=domains.domains.all())
+
+
+@router.post("/domains", response_model=DomainResponse)
+async def add_domain(
+        data: DomainRequest,
+        admin: Annotated[UserResponse, Depends(get_current_admin)],
+        db: Annotated[AsyncSession, Depends(get_db)]
+) -> DomainResponse:
+    """
+    Add a short domain, links can be created under it right away.
+
+    Args:
+        data: Request body.
+        admin: Current admin user.
+        db: Active SQLAlchemy async session.
+    Returns:
+        Created domain as a pydantic model.
+    Raises:
+        HTTPException(403) when user is not an admin.
+        HTTPException(409) when the host is already a domain.
+        HTTPException(500) when any other error occurs.
+    """
+    base_url = str(data.base_url) if data.base_url else None
+    try:
+        domain: dict = await domains.create_domain(data.host, base_url, db)
+    except exceptions.DomainAlreadyExists:
+        logger.warning(f"Domain {data.host} already exists (user={admin.username})")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Domain already exists"
+        )
+    except exceptions.ShortUrlServiceUnavailable:
+        logger.error(f"Failed to add domain {data.host} (user={admin.username})")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unable to add the domain. Try again later."
+        )
+
+    return DomainResponse(**domain)
+
+
+@router.get("/profiles", response_model=ProfilesResponse)
+async def list_profiles(
+        _admin: Annotated[UserResponse, Depends(get_current_admin)],
+        limit: Annotated[int, Query(ge=1, le=1000)] = 20
+) -> ProfilesResponse:
+    """
+    List the newest request profiles, see PROFILING_ENABLED.
+
+    Args:
+        _admin: Current admin user.
+        limit: Number of profiles to return.
+    Returns:
+        Profiled requests, newest first, as a pydantic model.
+    Raises:
+        HTTPException(403) when user is not an admin.
+    """
+    return ProfilesResponse(profiles=profiling.recent_captures(limit))
+
+
+@router.get("/profiles/{profile_id}", response_model=ProfileDetailsResponse)
+async def get_profile(
+        profile_id: ProfileId,
+        _admin: Annotated[UserResponse, Depends(get_current_admin)]
+) -> ProfileDetailsResponse:
+    """
+    Get a request profile with its SQL statements.
+
+    Args:
+        profile_id: Id of the profile.
+        _admin: Current admin user.
+    Returns:
+        Profiled request and its SQL statements as a pydantic model.
+    Raises:
+        HTTPException(403) when user is not an admin.
+        HTTPException(404) when the profile doesn't exist (anymore).
+    """
+    details = profiling.load_capture(profile_id)
+    if details is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return ProfileDetailsResponse(**details)
+
+
+@router.get("/profiles/{profile_id}/folded", response_class=PlainTextResponse)
+async def get_profile_stacks(
+        profile_id: ProfileId,
+        _admin: Annotated[UserResponse, Depends(get_current_admin)]
+) -> PlainTextResponse:
+    """
+    Get the stack samples of a request profile, collapsed one stack per line for flame graphs.
+
+    Args:
+        profile_id: Id of the profile.
+        _admin: Current admin user.
+    Returns:
+        Collapsed stacks as plain text.
+    Raises:
+        HTTPException(403) when user is not an admin.
+        HTTPException(404) when the profile doesn't exist (anymore).
+    """
+    folded = profiling.load_folded(profile_id)
+    if folded is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return PlainTextResponse(folded)
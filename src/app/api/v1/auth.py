@@ -19,15 +19,13 @@ router = APIRouter(prefix="/api/v1")
 
 @router.post("/token", response_model=Token)
 async def login(
-        data: Annotated[OAuth2PasswordRequestForm, Depends()],
-        db: Annotated[AsyncSession, Depends(get_db)]
+        data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ) -> Token:
     """
     Generate a new token for registered user.
 
     Args:
         data: Password request form.
-        db: Active SQLAlchemy async session.
     Returns:
         Token Pydantic model.
     Raises:
@@ -36,7 +34,7 @@ async def login(
         HTTPException(500) when any other error occurs.
     """
     try:
-        token: dict = await login_user(data, db)
+        token: dict = await login_user(data)
     except exceptions.UserNotFoundError:
         logger.exception(f"Unable to find user (user={data.username})")
         raise HTTPException(
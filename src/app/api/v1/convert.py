@@ -4,30 +4,40 @@ FastAPI endpoints for URL shortening service.
 Includes:
 - Creating short links
 - Fetching statistics
+- Streaming live click counts
 - Listing user URLs
+- User links summary
+- Resolving short codes in bulk
 - Deleting short URLs
+- Deleting short URLs and updating their expiration in bulk
 """
 
-from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException, status
-from pydantic import HttpUrl
+from typing import Annotated, AsyncIterator
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+import orjson
+from sqlalchemy import Row
 from sqlalchemy.ext.asyncio import AsyncSession
-from os import getenv
 
-from src.app.models import ShortURL
-from src.app.schemas import (ShortenResponse, ShortenRequest, StatsResponse,
-                             ShortResponseList, UserResponse, LinkFilters)
+from src.app.schemas import (ShortenResponse, ShortenRequest, StatsResponse, ShortResponseList, UserResponse,
+                             LinkFilters, LinkSummaryResponse, ResolveRequest, ResolveResponse,
+                             BulkLinksRequest, BulkExpirationRequest, BulkLinksResponse)
 from src.app.core.db.database import get_db
 from src.app.core.utils import get_current_user
+from src.app.core.utils.msgpack import MsgPackResponse, msgpack
 from src.app.core import exceptions
-from src.app.services.url_service import create_short_url, get_statistic, get_short_links
-from src.app.crud.operations import delete_short_link
+from src.app.services.url_service import (create_short_url, get_statistic, watch_clicks, get_short_links,
+                                         get_link_summary, resolve_links, delete_link, delete_links,
+                                         set_links_expiration, domain_id_of)
+from src.app.services.domains import domains
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1")
 
+DomainQuery = Annotated[str | None, Query(description="Short domain (host) of the link, the main one if not set")]
+
 
 @router.post("/shorten", response_model=ShortenResponse)
 async def create_shortlink(
@@ -45,11 +55,18 @@ async def create_shortlink(
     Returns:
         Short URL pydantic model.
     Raises:
+        HTTPException(400) when the domain is unknown.
         HTTPException(409) when alias is already taken.
         HTTPException(500) when any other error occurs.
     """
     try:
         shorten_link: dict = await create_short_url(data, current_user, db)
+    except exceptions.DomainNotFound:
+        logger.warning(f"Unknown domain {data.domain} (user={current_user.username})")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown domain"
+        )
     except exceptions.CustomAliasAlreadyExists:
         logger.warning(f"Alias {data.custom_alias} already taken (user={current_user.username})")
         raise HTTPException(
@@ -76,7 +93,8 @@ async def create_shortlink(
 async def statistics(
         short_code: str,
         current_user: Annotated[UserResponse, Depends(get_current_user)],
-        db: Annotated[AsyncSession, Depends(get_db)]
+        db: Annotated[AsyncSession, Depends(get_db)],
+        domain: DomainQuery = None
 ) -> StatsResponse:
     """
     Get short URL statistics.
@@ -85,6 +103,7 @@ async def statistics(
          short_code: Short code.
          current_user: Current user object.
          db: Active SQLAlchemy async session.
+         domain: Short domain of the link.
     Returns:
         Statistics pydantic model.
     Raises:
@@ -92,8 +111,8 @@ async def statistics(
         HTTPException(403) when user does not have permission to access.
     """
     try:
-        statistic: dict = await get_statistic(short_code, current_user, db)
-    except exceptions.ShortUrlNotFound:
+        statistic: dict = await get_statistic(domain_id_of(domain), short_code, current_user, db)
+    except (exceptions.ShortUrlNotFound, exceptions.DomainNotFound):
         logger.error(f"Short URL not found for user={current_user.username}")
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -113,15 +132,75 @@ async def statistics(
     )
 
 
-@router.get("/my/urls", response_model=ShortResponseList)
+async def _click_events(short_code: str, counts: AsyncIterator[int | None]) -> AsyncIterator[bytes]:
+    async for clicks in counts:
+        if clicks is None:
+            yield b"event: deleted\ndata: " + orjson.dumps({"short_code": short_code}) + b"\n\n"
+            return
+        yield b"event: clicks\ndata: " + orjson.dumps({"short_code": short_code, "clicks": clicks}) + b"\n\n"
+
+
+@router.get("/stats/{short_code}/live", response_class=StreamingResponse, responses={
+    200: {"content": {"text/event-stream": {}}},
+})
+async def live_statistics(
+        short_code: str,
+        current_user: Annotated[UserResponse, Depends(get_current_user)],
+        domain: DomainQuery = None
+) -> StreamingResponse:
+    """
+    Stream the click count of a short URL (Server-Sent Events).
+
+    A `clicks` event is sent right away and then at most once per tick while the
+    count changes, a `deleted` event ends the stream when the link is deleted.
+    All the viewers of a link share one subscription, an open stream costs no
+    database queries.
+
+    Args:
+         short_code: Short code.
+         current_user: Current user object.
+         domain: Short domain of the link.
+    Returns:
+        A text/event-stream response.
+    Raises:
+        HTTPException(404) when short URL is not present.
+        HTTPException(403) when user does not have permission to access.
+    """
+    try:
+        counts = await watch_clicks(domain_id_of(domain), short_code, current_user)
+    except (exceptions.ShortUrlNotFound, exceptions.DomainNotFound):
+        logger.error(f"Short URL not found for user={current_user.username}")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Short URL not found"
+        )
+    except exceptions.PermessionDeniedError:
+        logger.error(f"Permission denied for user={current_user.username}")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Permission denied. Try logging in first"
+        )
+
+    return StreamingResponse(
+        _click_events(short_code, counts),
+        media_type="text/event-stream",
+        # proxies must pass the events on as they come
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/my/urls", response_model=ShortResponseList, response_class=ORJSONResponse)
 async def get_user_links(
         current_user: Annotated[UserResponse, Depends(get_current_user)],
         db: Annotated[AsyncSession, Depends(get_db)],
         filters: LinkFilters = Depends()
-) -> ShortResponseList:
+) -> ORJSONResponse:
     """
     List user short URLs.
 
+    Rows are serialized straight to JSON without building a pydantic model per link,
+    the response shape is still described by ShortResponseList.
+
     Args:
          current_user: Current user object.
          db: Active SQLAlchemy async session.
@@ -132,7 +211,7 @@ async def get_user_links(
         HTTPException(500) when unable to list user short URLs.
     """
     try:
-        urls: list[ShortURL] = await get_short_links(filters, db, current_user.id)
+        urls: list[Row] = await get_short_links(filters, db, current_user.id)
     except exceptions.ShortUrlServiceUnavailable:
         logger.error(f"Internal error occured while getting links for user={current_user.username}")
         raise HTTPException(
@@ -140,25 +219,103 @@ async def get_user_links(
             detail="Service is unavailable. Try again later"
         )
 
-    return ShortResponseList(
-        short_urls=[
-            ShortenResponse(
-                short_url=HttpUrl(f"{getenv('SERVICE_URL')}{url.short_code}"),
-                short_code=url.short_code,
-                created_at=url.created_at,
-                expiration_time=url.expiration_time,
-                created_by_user=current_user.username,
-            )
-            for url in urls
+    username = current_user.username
+
+    return ORJSONResponse({
+        "short_urls": [
+            {
+                "short_url": f"{domains.base_url(domain_id)}{short_code}",
+                "short_code": short_code,
+                "created_at": created_at,
+                "expiration_time": expiration_time,
+                "created_by_user": username,
+            }
+            for domain_id, short_code, created_at, expiration_time in urls
         ],
-    )
+    })
+
+
+@router.get("/my/summary", response_model=LinkSummaryResponse)
+async def get_user_summary(
+        current_user: Annotated[UserResponse, Depends(get_current_user)],
+        db: Annotated[AsyncSession, Depends(get_db)]
+) -> LinkSummaryResponse:
+    """
+    Summarize user short URLs.
+
+    Args:
+         current_user: Current user object.
+         db: Active SQLAlchemy async session.
+    Returns:
+        Totals and the most clicked links as a pydantic model.
+    Raises:
+        HTTPException(500) when unable to get the summary.
+    """
+    try:
+        summary: dict = await get_link_summary(current_user, db)
+    except exceptions.ShortUrlServiceUnavailable:
+        logger.error(f"Internal error occured while getting summary for user={current_user.username}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Service is unavailable. Try again later"
+        )
+
+    return LinkSummaryResponse(**summary)
+
+
+@router.post("/resolve", response_model=ResolveResponse, response_class=ORJSONResponse, responses={
+    200: {"content": {MsgPackResponse.media_type: {}}},
+})
+async def resolve(
+        data: ResolveRequest,
+        current_user: Annotated[UserResponse, Depends(get_current_user)],
+        db: Annotated[AsyncSession, Depends(get_db)],
+        accept: Annotated[str | None, Header()] = None
+) -> Response:
+    """
+    Resolve many short codes at once, for proxies and link preview workers.
+
+    Cached links are answered from memory, the rest with a single query. Resolving
+    doesn't count as a click. The response is msgpack encoded when the client
+    accepts application/msgpack (and msgpack is installed), JSON otherwise.
+
+    Args:
+        data: Request body.
+        current_user: Current user object.
+        db: Active SQLAlchemy async session.
+        accept: Accept header of the request.
+    Returns:
+        Destination, expiration time and status of every short code.
+    Raises:
+        HTTPException(400) when the domain is unknown.
+        HTTPException(503) when the links can't be resolved right now.
+    """
+    try:
+        links: list[dict] = await resolve_links(domain_id_of(data.domain), data.short_codes, db)
+    except exceptions.DomainNotFound:
+        logger.warning(f"Unknown domain {data.domain} (user={current_user.username})")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown domain"
+        )
+    except exceptions.ShortUrlServiceUnavailable:
+        logger.error(f"Unable to resolve {len(data.short_codes)} short codes for user={current_user.username}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is unavailable. Try again later"
+        )
+
+    if msgpack is not None and accept and MsgPackResponse.media_type in accept:
+        return MsgPackResponse({"links": links})
+    return ORJSONResponse({"links": links})
 
 
 @router.delete("/{short_code}", response_model=dict)
 async def delete_short_url(
         short_code: str,
         current_user: Annotated[UserResponse, Depends(get_current_user)],
-        db: Annotated[AsyncSession, Depends(get_db)]
+        db: Annotated[AsyncSession, Depends(get_db)],
+        domain: DomainQuery = None
 ) -> dict:
     """
     Delete a short URL.
@@ -167,12 +324,16 @@ async def delete_short_url(
         short_code: Short URL code.
         current_user: Current user object.
         db: Active SQLAlchemy async session.
+        domain: Short domain of the link.
     Returns:
         Dictionary with id of deleted short URL and result status.
     Raises:
         HTTPException(404) when short URL does not exist.
     """
-    deleted_id = await delete_short_link(db, current_user.id, short_code)
+    try:
+        deleted_id = await delete_link(domain_id_of(domain), short_code, current_user, db)
+    except exceptions.DomainNotFound:
+        deleted_id = None
     if deleted_id is None:
         logger.error(f"Error deleting short URL for user={current_user.username}")
         raise HTTPException(
@@ -181,3 +342,87 @@ async def delete_short_url(
         )
 
     return {"id": deleted_id, "result": "successfully deleted"}
+
+
+@router.post("/my/urls/delete", response_model=BulkLinksResponse)
+async def delete_short_urls(
+        data: BulkLinksRequest,
+        current_user: Annotated[UserResponse, Depends(get_current_user)],
+        db: Annotated[AsyncSession, Depends(get_db)]
+) -> BulkLinksResponse:
+    """
+    Delete many short URLs at once, selected by their short codes or by filters.
+
+    Only links of the user are deleted, short codes of other users' links are skipped.
+
+    Args:
+        data: Request body.
+        current_user: Current user object.
+        db: Active SQLAlchemy async session.
+    Returns:
+        Number and list of the deleted links.
+    Raises:
+        HTTPException(400) when the domain is unknown.
+        HTTPException(500) when the links can't be deleted.
+    """
+    try:
+        deleted = await delete_links(data, current_user, db)
+    except exceptions.DomainNotFound:
+        logger.warning(f"Unknown domain {data.domain} (user={current_user.username})")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown domain"
+        )
+    except exceptions.ShortUrlServiceUnavailable:
+        logger.error(f"Failed to delete links in bulk for user={current_user.username}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Service is unavailable. Try again later"
+        )
+
+    return BulkLinksResponse(
+        count=len(deleted),
+        links=[{"domain_id": domain_id, "short_code": code} for domain_id, code in deleted]
+    )
+
+
+@router.post("/my/urls/expiration", response_model=BulkLinksResponse)
+async def update_short_urls_expiration(
+        data: BulkExpirationRequest,
+        current_user: Annotated[UserResponse, Depends(get_current_user)],
+        db: Annotated[AsyncSession, Depends(get_db)]
+) -> BulkLinksResponse:
+    """
+    Set the expiration time of many short URLs at once, selected by their short codes or by filters.
+
+    Only links of the user are updated, short codes of other users' links are skipped.
+
+    Args:
+        data: Request body.
+        current_user: Current user object.
+        db: Active SQLAlchemy async session.
+    Returns:
+        Number and list of the updated links.
+    Raises:
+        HTTPException(400) when the domain is unknown.
+        HTTPException(500) when the links can't be updated.
+    """
+    try:
+        updated = await set_links_expiration(data, current_user, db)
+    except exceptions.DomainNotFound:
+        logger.warning(f"Unknown domain {data.domain} (user={current_user.username})")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown domain"
+        )
+    except exceptions.ShortUrlServiceUnavailable:
+        logger.error(f"Failed to update expiration of links in bulk for user={current_user.username}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Service is unavailable. Try again later"
+        )
+
+    return BulkLinksResponse(
+        count=len(updated),
+        links=[{"domain_id": domain_id, "short_code": code} for domain_id, code in updated]
+    )
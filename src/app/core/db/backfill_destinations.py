@@ -0,0 +1,152 @@
+"""
+One-shot migration of links that still carry their own long_url.
+
+Links used to store the URL they redirect to in short_urls.long_url, they now
+point to a row of the destinations table on their shard. Stop the service,
+then run on the old databases
+
+    python -m src.app.core.db.backfill_destinations [--batch-size N]
+
+before starting the new version. The tables added since are created, links
+from before short domains are moved to the default domain and get the indexes
+added since, the URLs of the links are interned in batches and the user link
+summaries are computed, then long_url is dropped. Shards already migrated are
+left as they are, so an interrupted run is simply started again.
+
+A database from before sharding is the main database alone: its links stay
+there, move them with core/db/rebalance once shards are added.
+"""
+
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy import bindparam, column, inspect, select, table, text, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.app.core.db import dialect
+from src.app.core.db.database import shard_engines, shard_sessionmakers
+from src.app.core.db.init_db import init_db
+# imported before the operations module, which it imports in turn
+import src.app.core.utils  # noqa: F401
+from src.app.crud.operations import intern_destinations, reconcile_link_summaries
+from src.app.models.models import DEFAULT_DOMAIN_ID, ShortURL
+
+logger = logging.getLogger(__name__)
+
+# short_urls as it was before the destinations table, the model doesn't know long_url anymore
+legacy_links = table("short_urls", column("id"), column("long_url"), column("destination_id"))
+
+
+async def _link_columns(engine: AsyncEngine) -> set[str]:
+    async with engine.connect() as conn:
+        columns = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_columns("short_urls"))
+    return {link_column["name"] for link_column in columns}
+
+
+async def _add_domain(engine: AsyncEngine):
+    """Links from before short domains are all under the default one, their codes unique per domain"""
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            f"ALTER TABLE short_urls ADD COLUMN domain_id INTEGER NOT NULL DEFAULT {DEFAULT_DOMAIN_ID}"
+        ))
+        await conn.execute(text("DROP INDEX IF EXISTS ix_short_urls_short_code"))
+        if dialect.is_sqlite(conn):
+            await conn.execute(text(
+                "CREATE UNIQUE INDEX uq_short_urls_domain_id_short_code ON short_urls (domain_id, short_code)"
+            ))
+        else:
+            await conn.execute(text(
+                "ALTER TABLE short_urls "
+                "ADD CONSTRAINT uq_short_urls_domain_id_short_code UNIQUE (domain_id, short_code)"
+            ))
+            # links may live on a shard without the users table
+            await conn.execute(text("ALTER TABLE short_urls DROP CONSTRAINT IF EXISTS short_urls_user_id_fkey"))
+
+
+async def _create_link_indexes(engine: AsyncEngine):
+    """Indexes of the links added since the table was created, create_all leaves existing tables alone"""
+    async with engine.begin() as conn:
+        for index in ShortURL.__table__.indexes:
+            # PostgreSQL-only ones are skipped on SQLite, as by create_all
+            await conn.run_sync(index.create, checkfirst=True)
+
+
+async def _backfill_batch(shard: int, batch_size: int) -> int:
+    """Points a batch of links to their destination, returns how many"""
+    async with shard_sessionmakers[shard]() as session:
+        result = await session.execute(
+            select(legacy_links.c.id, legacy_links.c.long_url)
+            .where(legacy_links.c.destination_id.is_(None))
+            .order_by(legacy_links.c.id)
+            .limit(batch_size)
+        )
+        rows = result.all()
+        if not rows:
+            return 0
+        destination_ids = await intern_destinations(session, {row.long_url for row in rows})
+        await session.execute(
+            update(legacy_links)
+            .where(legacy_links.c.id == bindparam("link_id"))
+            .values(destination_id=bindparam("new_destination_id")),
+            [{"link_id": row.id, "new_destination_id": destination_ids[row.long_url]} for row in rows],
+        )
+        await session.commit()
+        return len(rows)
+
+
+async def backfill(batch_size: int) -> dict[int, int]:
+    """Migrates every shard, returns the number of links pointed to their destination by shard"""
+    # creates the tables that are missing, the existing tables aren't changed
+    await init_db()
+    backfilled = {}
+    for shard, engine in enumerate(shard_engines):
+        columns = await _link_columns(engine)
+        if "long_url" not in columns:
+            logger.info(f"Shard {shard} is already migrated")
+            continue
+        if "domain_id" not in columns:
+            await _add_domain(engine)
+        if "destination_id" not in columns:
+            async with engine.begin() as conn:
+                await conn.execute(text(
+                    "ALTER TABLE short_urls ADD COLUMN destination_id INTEGER REFERENCES destinations (id)"
+                ))
+
+        backfilled[shard] = 0
+        while count := await _backfill_batch(shard, batch_size):
+            backfilled[shard] += count
+            logger.info(f"Shard {shard}: {backfilled[shard]} links backfilled")
+
+        await _create_link_indexes(engine)
+        # the summaries are new, or kept up to date by the writes already
+        async with shard_sessionmakers[shard]() as session:
+            await reconcile_link_summaries(session)
+
+        # last, a shard with long_url is not migrated yet
+        async with engine.begin() as conn:
+            if not dialect.is_sqlite(conn):
+                # SQLite can't add the constraint to an existing column, the model keeps it from being NULL
+                await conn.execute(text("ALTER TABLE short_urls ALTER COLUMN destination_id SET NOT NULL"))
+            # its trigram index goes with it
+            await conn.execute(text("ALTER TABLE short_urls DROP COLUMN long_url"))
+        logger.info(f"Shard {shard} migrated")
+    return backfilled
+
+
+async def main(batch_size: int):
+    backfilled = await backfill(batch_size)
+    for shard, count in sorted(backfilled.items()):
+        print(f"shard {shard}: {count} links backfilled")
+    if not backfilled:
+        print("all shards are migrated")
+    for shard_engine in shard_engines:
+        await shard_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args.batch_size))
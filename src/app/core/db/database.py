@@ -1,11 +1,55 @@
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from contextlib import asynccontextmanager
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine, AsyncSession, AsyncEngine
 from src.app.core.settings import settings
 
-engine = create_async_engine(settings.get_url(), echo=True)
+# WAL lets redirects read while a click is written, NORMAL sync only fsyncs at checkpoints
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    # links must not point to a pruned destination
+    "PRAGMA foreign_keys=ON",
+)
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    new_engine = create_async_engine(url, echo=True)
+    if new_engine.dialect.name == "sqlite":
+        @event.listens_for(new_engine.sync_engine, "connect")
+        def _set_pragmas(dbapi_connection, _connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in SQLITE_PRAGMAS:
+                cursor.execute(pragma)
+            cursor.close()
+    return new_engine
+
+
+engine = _create_engine(settings.get_url())
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
+# links are spread over the shard databases (see core/db/sharding), shard 0 is the main one
+shard_engines = [engine] + [_create_engine(url) for url in settings.LINK_SHARD_URLS]
+shard_sessionmakers = [SessionLocal] + [
+    async_sessionmaker(shard_engine, expire_on_commit=False) for shard_engine in shard_engines[1:]
+]
 
-async def get_db():
+
+@asynccontextmanager
+async def open_session():
+    """Main session, sessions opened on other shards along the way are closed with it"""
     async with SessionLocal() as session:
+        try:
+            yield session
+        finally:
+            shard_sessions: dict[int, AsyncSession] = session.info.pop("shard_sessions", {})
+            for shard_session in shard_sessions.values():
+                await shard_session.close()
+
+
+async def get_db():
+    async with open_session() as session:
         yield session
-    # await session.close()
@@ -0,0 +1,24 @@
+"""
+Statements that differ between the supported databases.
+
+The models and crud/operations run on PostgreSQL and on SQLite (single-node
+deployments), both support INSERT ... ON CONFLICT and RETURNING, but only
+PostgreSQL allows data-modifying statements inside a CTE.
+"""
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+
+def name(db: AsyncSession | AsyncConnection) -> str:
+    dialect = db.dialect if isinstance(db, AsyncConnection) else db.bind.dialect
+    return dialect.name
+
+
+def is_sqlite(db: AsyncSession | AsyncConnection) -> bool:
+    return name(db) == "sqlite"
+
+
+def insert(db: AsyncSession | AsyncConnection, table):
+    """INSERT supporting on_conflict_do_update/on_conflict_do_nothing on the database of db"""
+    return sqlite.insert(table) if is_sqlite(db) else postgresql.insert(table)
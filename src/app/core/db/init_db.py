@@ -1,8 +1,24 @@
-from src.app.models.models import Base, User, ShortURL
-from src.app.core.db.database import engine
+from datetime import datetime, timezone
+from sqlalchemy import text
+
+from src.app.models.models import Base, User, ShortURL, LinkExpirySweep, SHARDED_TABLES
+from src.app.core.db.database import shard_engines
+from src.app.core.db import dialect
 
 
 async def init_db():
-    async with engine.begin() as conn:
-        # await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+    for shard, engine in enumerate(shard_engines):
+        async with engine.begin() as conn:
+            # await conn.run_sync(Base.metadata.drop_all)
+            if not dialect.is_sqlite(conn):
+                # trigram operator classes used by the link search indexes
+                await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            # the main database holds everything, the other shards only the links
+            tables = None if shard == 0 else SHARDED_TABLES
+            await conn.run_sync(Base.metadata.create_all, tables=tables)
+            # the expiry sweep keeps its progress in a single row
+            await conn.execute(
+                dialect.insert(conn, LinkExpirySweep)
+                .values(id=1, swept_until=datetime.now(timezone.utc))
+                .on_conflict_do_nothing(index_elements=[LinkExpirySweep.id])
+            )
@@ -0,0 +1,110 @@
+"""
+Low-level link lookups and bulk writes on a raw asyncpg pool.
+
+The redirect and alias checks are single indexed point lookups, so they skip
+SQLAlchemy statement compilation and ORM result processing. asyncpg keeps a
+named prepared statement per query text on every connection (its statement
+cache), the pool prepares both lookups as soon as a connection is opened and
+each call after that is a single Bind/Execute round trip. Bulk writes go
+through COPY instead of multi-row INSERTs.
+
+There is one pool per link shard, lookups are routed the same way as in
+crud/operations (see core/db/sharding). The pools are PostgreSQL only, with
+the SQLite backend every lookup goes through the ORM path.
+"""
+
+import asyncio
+import asyncpg
+from datetime import datetime
+from typing import Callable
+import logging
+
+from sqlalchemy.engine import make_url
+
+from src.app.core.settings import settings
+from src.app.core.db import sharding
+
+logger = logging.getLogger(__name__)
+
+LINK_BY_CODE = (
+    "SELECT d.url, l.created_at, l.expiration_time FROM short_urls l JOIN destinations d ON d.id = l.destination_id "
+    "WHERE l.domain_id = $1 AND l.short_code = $2"
+)
+CODE_EXISTS = "SELECT 1 FROM short_urls WHERE domain_id = $1 AND short_code = $2"
+
+# errors raised by asyncpg when the database can't answer the lookup
+LOOKUP_ERRORS = (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError)
+
+# by shard, empty while the pools are closed
+_pools: list[asyncpg.Pool] = []
+# asyncpg query loggers added to every connection of the pools (see core/profiling)
+query_loggers: list[Callable] = []
+
+
+async def _prepare_statements(conn: asyncpg.Connection):
+    for query_logger in query_loggers:
+        conn.add_query_logger(query_logger)
+    # PreparedStatement objects are invalidated when a connection goes back to the pool,
+    # the statement cache is not, so the statements are warmed through it
+    await conn.fetchrow(LINK_BY_CODE, 0, "")
+    await conn.fetchval(CODE_EXISTS, 0, "")
+
+
+async def _keep_session(conn: asyncpg.Connection):
+    # the connections only run the lookups and COPY, outside of transactions, there is
+    # no session state to reset and the default reset query costs a round trip per lookup
+    pass
+
+
+def _shard_dsns() -> list[str]:
+    return [settings.get_dsn()] + [
+        make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+        for url in settings.LINK_SHARD_URLS
+    ]
+
+
+async def open_pool():
+    if _pools or settings.DATABASE_BACKEND != "postgresql":
+        return
+    for dsn in _shard_dsns():
+        _pools.append(await asyncpg.create_pool(
+            dsn,
+            min_size=settings.LOOKUP_POOL_MIN_SIZE,
+            max_size=settings.LOOKUP_POOL_MAX_SIZE,
+            init=_prepare_statements,
+            reset=_keep_session,
+        ))
+    logger.info(f"Lookup pools are ready ({len(_pools)} shards)")
+
+
+async def close_pool():
+    while _pools:
+        await _pools.pop().close()
+
+
+def is_ready() -> bool:
+    return bool(_pools)
+
+
+async def get_link(domain_id: int, short_code: str) -> tuple[str, datetime, datetime | None] | None:
+    """Returns (long_url, created_at, expiration_time) OR None"""
+    for shard in sharding.candidate_shards(short_code):
+        async with _pools[shard].acquire() as conn:
+            record = await conn.fetchrow(LINK_BY_CODE, domain_id, short_code)
+        if record is not None:
+            return tuple(record)
+    return None
+
+
+async def code_exists(domain_id: int, short_code: str) -> bool:
+    for shard in sharding.candidate_shards(short_code):
+        async with _pools[shard].acquire() as conn:
+            if await conn.fetchval(CODE_EXISTS, domain_id, short_code) is not None:
+                return True
+    return False
+
+
+async def copy_records(table: str, columns: tuple[str, ...], records: list[tuple]):
+    """COPY into a table of the main database"""
+    async with _pools[0].acquire() as conn:
+        await conn.copy_records_to_table(table, columns=list(columns), records=records)
@@ -0,0 +1,111 @@
+"""
+Online rebalancing of the links after shards were added.
+
+Deploy the new LINK_SHARD_URLS with LINK_SHARDS_PREVIOUS_COUNT set to the old
+number of shards, so links that aren't moved yet are still found, then run
+
+    python -m src.app.core.db.rebalance [--batch-size N] [--dry-run]
+
+and unset LINK_SHARDS_PREVIOUS_COUNT once it's done. Links are moved in small
+batches while the service keeps running: a batch is copied to its new shard
+before it is deleted from the old one, and reads try the new shard first.
+"""
+
+from collections import Counter, defaultdict
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy import select, delete
+
+from src.app.core.db import sharding, dialect
+from src.app.core.db.database import shard_engines, shard_sessionmakers
+# imported before the operations module, which it imports in turn
+import src.app.core.utils  # noqa: F401
+from src.app.crud.operations import reconcile_link_summaries, intern_destinations
+from src.app.models.models import ShortURL, Destination
+
+logger = logging.getLogger(__name__)
+
+# ids are allocated by every shard on its own, a moved link gets a new one
+# and points to the destination with the same URL on its new shard
+COPIED_COLUMNS = [column for column in ShortURL.__table__.c if column.key not in ("id", "destination_id")]
+
+
+async def _move_batch(source: int, after_id: int, batch_size: int, dry_run: bool, moved: Counter) -> int | None:
+    """Moves the misplaced links of one batch, returns the last id scanned or None when done"""
+    async with shard_sessionmakers[source]() as session:
+        result = await session.execute(
+            select(ShortURL.id, *COPIED_COLUMNS, Destination.url)
+            .join_from(ShortURL, Destination)
+            .where(ShortURL.id > after_id)
+            .order_by(ShortURL.id)
+            .limit(batch_size)
+            # clicks and deletes of these links wait until they are moved
+            .with_for_update(of=ShortURL)
+        )
+        rows = result.all()
+        if not rows:
+            return None
+
+        by_target = defaultdict(list)
+        for row in rows:
+            target = sharding.shard_for_code(row.short_code)
+            if target != source:
+                by_target[target].append(row)
+        for target, target_rows in by_target.items():
+            moved[source, target] += len(target_rows)
+            if dry_run:
+                continue
+            async with shard_sessionmakers[target]() as target_session:
+                destination_ids = await intern_destinations(target_session, {row.url for row in target_rows})
+                await target_session.execute(
+                    dialect.insert(target_session, ShortURL)
+                    .values([
+                        {column.key: row._mapping[column.key] for column in COPIED_COLUMNS}
+                        | {"destination_id": destination_ids[row.url]}
+                        for row in target_rows
+                    ])
+                    # a previous run may have stopped between the copy and the delete
+                    .on_conflict_do_nothing(index_elements=[ShortURL.domain_id, ShortURL.short_code])
+                )
+                await target_session.commit()
+            await session.execute(delete(ShortURL).where(ShortURL.id.in_([row.id for row in target_rows])))
+        await session.commit()
+        return rows[-1].id
+
+
+async def rebalance(batch_size: int, dry_run: bool) -> Counter:
+    """Moves every link to the shard the current ring assigns it to, returns the moves by (source, target)"""
+    moved: Counter[tuple[int, int]] = Counter()
+    for source in sharding.shard_ids():
+        after_id = 0
+        while (after_id := await _move_batch(source, after_id, batch_size, dry_run, moved)) is not None:
+            pass
+        logger.info(f"Shard {source} rebalanced")
+
+    if not dry_run and moved:
+        # the incremental summary updates don't follow links between shards
+        for shard in sharding.shard_ids():
+            async with shard_sessionmakers[shard]() as session:
+                await reconcile_link_summaries(session)
+    return moved
+
+
+async def main(batch_size: int, dry_run: bool):
+    moved = await rebalance(batch_size, dry_run)
+    for (source, target), count in sorted(moved.items()):
+        print(f"shard {source} -> shard {target}: {count} links{' (dry run)' if dry_run else ''}")
+    if not moved:
+        print("all links are on their shard")
+    for shard_engine in shard_engines:
+        await shard_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="only count the links to move")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args.batch_size, args.dry_run))
@@ -0,0 +1,97 @@
+"""
+Routing of links to the shard databases.
+
+Short codes are placed on a consistent-hash ring, so adding a shard moves only
+about 1/N of the links. User rows stay on the main database (shard 0), where
+their ids are allocated and where they are looked up by username; a user's
+links are spread over all shards, so user-wide reads fan out to every shard.
+
+While a rebalance is running (LINK_SHARDS_PREVIOUS_COUNT is set) a link that
+isn't moved yet is still found on the shard the previous ring assigned it to.
+"""
+
+from bisect import bisect
+from typing import Awaitable, Callable, Iterable, TypeVar
+import asyncio
+import hashlib
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app.core.db.database import shard_engines, shard_sessionmakers
+from src.app.core.settings import settings
+
+T = TypeVar("T")
+
+VIRTUAL_NODES = 128
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, shards: Iterable[int], virtual_nodes: int = VIRTUAL_NODES):
+        points = sorted(
+            (_hash(f"shard-{shard}-{node}"), shard)
+            for shard in shards
+            for node in range(virtual_nodes)
+        )
+        if not points:
+            raise ValueError("Hash ring needs at least one shard")
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key: str) -> int:
+        return self._shards[bisect(self._hashes, _hash(key)) % len(self._shards)]
+
+
+ring = HashRing(range(len(shard_engines)))
+previous_ring = (
+    HashRing(range(settings.LINK_SHARDS_PREVIOUS_COUNT))
+    if 0 < settings.LINK_SHARDS_PREVIOUS_COUNT < len(shard_engines)
+    else None
+)
+
+
+def shard_ids() -> range:
+    return range(len(shard_engines))
+
+
+def shard_for_code(short_code: str) -> int:
+    """Shard new links with this code are written to"""
+    return ring.shard_for(short_code)
+
+
+def candidate_shards(short_code: str) -> list[int]:
+    """Shards a link with this code can be found on, in order of preference"""
+    shard = ring.shard_for(short_code)
+    if previous_ring is not None:
+        previous = previous_ring.shard_for(short_code)
+        if previous != shard:
+            return [shard, previous]
+    return [shard]
+
+
+def session_for_shard(db: AsyncSession, shard: int) -> AsyncSession:
+    """Session on the given shard, opened lazily alongside the main session db"""
+    if shard == 0:
+        return db
+    shard_sessions = db.info.setdefault("shard_sessions", {})
+    if shard not in shard_sessions:
+        shard_sessions[shard] = shard_sessionmakers[shard]()
+    return shard_sessions[shard]
+
+
+def session_for_code(db: AsyncSession, short_code: str) -> AsyncSession:
+    return session_for_shard(db, shard_for_code(short_code))
+
+
+def is_sharded() -> bool:
+    return len(shard_engines) > 1
+
+
+async def on_every_shard(db: AsyncSession, query: Callable[[AsyncSession, int], Awaitable[T]]) -> list[T]:
+    """Run query(session, shard) on all shards concurrently, results are ordered by shard"""
+    if not is_sharded():
+        return [await query(db, 0)]
+    return list(await asyncio.gather(*(query(session_for_shard(db, shard), shard) for shard in shard_ids())))
@@ -0,0 +1,197 @@
+"""
+Local on-disk snapshot of the active links, used when the database is unreachable.
+
+File layout (little-endian):
+    header: magic (8 bytes), built_at (int64, microseconds since epoch)
+    record: key (int64: shard << SHARD_SHIFT | link id), created_at (int64 us),
+            expiration_time (int64 us, NO_EXPIRATION if none), domain id (int32),
+            short_code length (uint16), long_url length (uint16), short_code, long_url (utf-8)
+
+The file is only ever appended to or replaced as a whole, so it can be mapped into
+memory and shared by all the workers of an instance. Only an index of (domain id, short code)
+to record offset lives in the process memory, links are decoded from the mapping on use.
+
+Reading the file (scan) and writing it (SnapshotWriter) block, they are meant to run on
+a thread; only apply changes what get serves.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone, timedelta
+from typing import BinaryIO
+import mmap
+import os
+import struct
+
+MAGIC = b"MLSNAP02"
+HEADER = struct.Struct("<8sq")
+RECORD = struct.Struct("<qqqiHH")
+NO_EXPIRATION = -(2 ** 63)
+SHARD_SHIFT = 48
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _to_us(value: datetime) -> int:
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def _from_us(value: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def record_key(shard: int, link_id: int) -> int:
+    return shard << SHARD_SHIFT | link_id
+
+
+def _encode(rows: list[tuple]) -> bytes:
+    """rows are (record key, domain_id, short_code, long_url, created_at, expiration_time)"""
+    chunks = []
+    for key, domain_id, short_code, long_url, created_at, expiration_time in rows:
+        code, url = short_code.encode(), long_url.encode()
+        expiration = NO_EXPIRATION if expiration_time is None else _to_us(expiration_time)
+        chunks.append(RECORD.pack(key, _to_us(created_at), expiration, domain_id, len(code), len(url)))
+        chunks.append(code)
+        chunks.append(url)
+    return b"".join(chunks)
+
+
+def _index_records(records: mmap.mmap, offset: int) -> tuple[dict[tuple[int, str], int], dict[int, int], int]:
+    """Offsets and highest link id by shard of the complete records from offset on, and where they end"""
+    index, high_water_marks = {}, {}
+    size = len(records)
+    while offset + RECORD.size <= size:
+        key, _, _, domain_id, code_len, url_len = RECORD.unpack_from(records, offset)
+        end = offset + RECORD.size + code_len + url_len
+        if end > size:
+            break
+        code = records[offset + RECORD.size:offset + RECORD.size + code_len].decode()
+        index[domain_id, code] = offset
+        shard, link_id = key >> SHARD_SHIFT, key & ((1 << SHARD_SHIFT) - 1)
+        high_water_marks[shard] = max(high_water_marks.get(shard, 0), link_id)
+        offset = end
+    return index, high_water_marks, offset
+
+
+@dataclass
+class SnapshotChanges:
+    """What changed in the file since it was last applied"""
+    # the file was replaced, the changes aren't added to the current index but replace it
+    reset: bool
+    records: mmap.mmap | None = None
+    inode: int | None = None
+    built_at: datetime | None = None
+    index: dict[tuple[int, str], int] = field(default_factory=dict)
+    high_water_marks: dict[int, int] = field(default_factory=dict)
+    indexed_until: int = 0
+    torn: bool = False
+
+
+class SnapshotWriter:
+    """Writes links to the snapshot page by page, nothing is visible before commit()"""
+
+    def __init__(self, file: BinaryIO, replaces: str | None = None):
+        self._file = file
+        # the file is written next to the snapshot and renamed over it on commit
+        self._replaces = replaces
+
+    def write(self, rows: list[tuple]):
+        if rows:
+            self._file.write(_encode(rows))
+
+    def commit(self):
+        with self._file:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        if self._replaces is not None:
+            os.replace(self._file.name, self._replaces)
+
+    def abort(self):
+        self._file.close()
+        if self._replaces is not None:
+            os.unlink(self._file.name)
+
+
+class LinkSnapshot:
+    def __init__(self, path: str):
+        self.path = path
+        # highest link id in the file by shard
+        self.high_water_marks: dict[int, int] = {}
+        self.built_at: datetime | None = None
+        # whether the file ends with a partially written record (e.g. after a crash)
+        self.torn = False
+        self._index: dict[tuple[int, str], int] = {}
+        self._map: mmap.mmap | None = None
+        self._inode: int | None = None
+        self._indexed_until = 0
+
+    def __len__(self):
+        return len(self._index)
+
+    def load(self):
+        """(Re)map the file, only records appended since the last call are indexed"""
+        self.apply(self.scan())
+
+    def scan(self) -> SnapshotChanges | None:
+        """Maps and indexes what changed in the file since the last apply OR None, if nothing did"""
+        try:
+            file = open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+        with file:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return None
+            magic, built_at = HEADER.unpack(header)
+            if magic != MAGIC:
+                if not magic.startswith(MAGIC[:6]):
+                    raise ValueError(f"{self.path} is not a link snapshot")
+                # written by an older version, nothing to serve until it's rebuilt
+                return SnapshotChanges(reset=True)
+            inode, built_at = os.fstat(file.fileno()).st_ino, _from_us(built_at)
+            # replaced by a full rewrite, start over
+            reset = (inode, built_at) != (self._inode, self.built_at)
+            indexed_until = 0 if reset else self._indexed_until
+            if os.fstat(file.fileno()).st_size == indexed_until:
+                return None
+            records = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index, high_water_marks, indexed_until = _index_records(records, max(indexed_until, HEADER.size))
+        return SnapshotChanges(
+            reset, records, inode, built_at, index, high_water_marks, indexed_until, indexed_until != len(records)
+        )
+
+    def apply(self, changes: SnapshotChanges | None):
+        """Serve the changes found by scan"""
+        if changes is None:
+            return
+        if changes.reset:
+            self._index, self.high_water_marks = changes.index, changes.high_water_marks
+        else:
+            self._index.update(changes.index)
+            for shard, link_id in changes.high_water_marks.items():
+                self.high_water_marks[shard] = max(self.high_water_marks.get(shard, 0), link_id)
+        if self._map is not None:
+            self._map.close()
+        self._map, self._inode, self.built_at = changes.records, changes.inode, changes.built_at
+        self._indexed_until, self.torn = changes.indexed_until, changes.torn
+
+    def get(self, domain_id: int, short_code: str) -> tuple[str, datetime, datetime | None] | None:
+        """Returns (long_url, created_at, expiration_time) OR None"""
+        offset = self._index.get((domain_id, short_code))
+        if offset is None:
+            return None
+        _, created_at, expiration, _, code_len, url_len = RECORD.unpack_from(self._map, offset)
+        url_start = offset + RECORD.size + code_len
+        long_url = self._map[url_start:url_start + url_len].decode()
+        expiration_time = None if expiration == NO_EXPIRATION else _from_us(expiration)
+        return long_url, _from_us(created_at), expiration_time
+
+    def appender(self) -> SnapshotWriter:
+        """Append links after the ones already in the file, the caller holds the write lock"""
+        return SnapshotWriter(open(self.path, "ab"))
+
+    def rewriter(self) -> SnapshotWriter:
+        """Replace the whole file atomically, the caller holds the write lock"""
+        file = open(f"{self.path}.tmp", "wb")
+        file.write(HEADER.pack(MAGIC, _to_us(datetime.now(timezone.utc))))
+        return SnapshotWriter(file, replaces=self.path)
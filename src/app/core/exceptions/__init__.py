@@ -53,3 +53,11 @@ class ShortUrlServiceUnavailable(URLError):
 
 class ShortUrlExpired(URLError):
     pass
+
+
+class DomainNotFound(URLError):
+    pass
+
+
+class DomainAlreadyExists(URLError):
+    pass
@@ -0,0 +1,284 @@
+"""
+Opt-in request profiling (PROFILING_ENABLED).
+
+A fraction of the requests (PROFILING_SAMPLE_RATE), and any request carrying
+PROFILING_TOKEN in its X-Profile header, is watched by a stack sampler: a daemon
+thread that every PROFILING_INTERVAL records where the request is. That is the
+stack of the event loop thread while the request's own code runs, and the chain of
+awaits it is suspended in otherwise, so the samples add up to the wall-clock time
+of the request. Requests slower than PROFILING_SLOW_REQUEST_MS are captured as
+well, sampled or not, with their SQL statements and timings.
+
+Every capture is written to PROFILING_DIR as <id>.json (request, timings, SQL)
+and <id>.folded (collapsed stacks, the input of flamegraph.pl, speedscope and
+the like). Only the newest PROFILING_KEEP captures are kept.
+"""
+
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from uuid import uuid4
+import asyncio
+import hmac
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.app.core.settings import app_settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+# statements kept per request, the rest are only counted
+MAX_STATEMENTS = 200
+MAX_STATEMENT_LENGTH = 2000
+MAX_STACK_DEPTH = 128
+
+
+class Capture:
+    def __init__(self, method: str, path: str, reason: str | None):
+        self.started_at = datetime.now(timezone.utc)
+        # sorts by time
+        self.id = f"{self.started_at:%Y%m%dT%H%M%S%f}-{uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        # "sampled" or "requested" when the stack sampler watches the request, "slow" is set afterwards
+        self.reason = reason
+        self.status_code: int | None = None
+        self.duration_ms = 0.0
+        # collapsed stack -> number of samples
+        self.samples: Counter[str] = Counter()
+        self.statements: list[tuple[str, float]] = []
+        self.statement_count = 0
+        self.statement_ms = 0.0
+
+    def add_statement(self, statement: str, elapsed: float):
+        self.statement_count += 1
+        self.statement_ms += elapsed * 1000
+        if len(self.statements) < MAX_STATEMENTS:
+            self.statements.append((statement[:MAX_STATEMENT_LENGTH], round(elapsed * 1000, 3)))
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "started_at": self.started_at.isoformat(),
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "duration_ms": round(self.duration_ms, 3),
+            "reason": self.reason,
+            "samples": sum(self.samples.values()),
+            "sample_interval_ms": app_settings.PROFILING_INTERVAL * 1000,
+            "sql_count": self.statement_count,
+            "sql_ms": round(self.statement_ms, 3),
+        }
+
+
+# capture of the request being handled, seen by the SQL hooks
+_current: ContextVar[Capture | None] = ContextVar("profiling_capture", default=None)
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _await_stack(awaitable) -> list[str]:
+    """Frames of a suspended coroutine and of the coroutines it awaits, outermost first"""
+    labels = []
+    while awaitable is not None and len(labels) < MAX_STACK_DEPTH:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        labels.append(_label(frame))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return labels
+
+
+class StackSampler:
+    """Samples the stacks of the profiled requests from a daemon thread"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        # capture -> coroutine of the task handling the request
+        self._watched: dict[Capture, object] = {}
+        self._lock = threading.Lock()
+        self._loop_thread: int | None = None
+        self._thread: threading.Thread | None = None
+
+    def watch(self, capture: Capture, task: asyncio.Task):
+        with self._lock:
+            self._watched[capture] = task.get_coro()
+        if self._thread is None:
+            self._loop_thread = threading.get_ident()
+            self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+            self._thread.start()
+
+    def unwatch(self, capture: Capture):
+        # waits for a sample being taken, the capture isn't touched after that
+        with self._lock:
+            self._watched.pop(capture, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if self._watched:
+                    self._sample()
+
+    def _sample(self):
+        running = []
+        frame = sys._current_frames().get(self._loop_thread)
+        while frame is not None and len(running) < MAX_STACK_DEPTH:
+            running.append(frame)
+            frame = frame.f_back
+        running.reverse()
+
+        for capture, coro in self._watched.items():
+            root = getattr(coro, "cr_frame", None)
+            if root is None:
+                continue
+            for depth, frame in enumerate(running):
+                if frame is root:
+                    # the request's own code is running on the event loop
+                    stack = [_label(frame) for frame in running[depth:]]
+                    break
+            else:
+                stack = _await_stack(coro) + ["[awaiting]"]
+            capture.samples[";".join(stack)] += 1
+
+
+sampler = StackSampler(app_settings.PROFILING_INTERVAL)
+
+
+def _profile_reason(scope: Scope) -> str | None:
+    token = app_settings.PROFILING_TOKEN
+    if token:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER and hmac.compare_digest(value, token.encode()):
+                return "requested"
+    if random.random() < app_settings.PROFILING_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        capture = Capture(scope["method"], scope["path"], _profile_reason(scope))
+
+        async def send_with_status(message: Message):
+            if message["type"] == "http.response.start":
+                capture.status_code = message["status"]
+            await send(message)
+
+        token = _current.set(capture)
+        if capture.reason is not None:
+            sampler.watch(capture, asyncio.current_task())
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            capture.duration_ms = (time.perf_counter() - started) * 1000
+            sampler.unwatch(capture)
+            _current.reset(token)
+            if capture.reason is None and capture.duration_ms >= app_settings.PROFILING_SLOW_REQUEST_MS:
+                capture.reason = "slow"
+            if capture.reason is not None:
+                # the response is already sent, the files are written off the event loop
+                await asyncio.to_thread(_save, capture)
+
+
+def _before_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("profiling_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, _cursor, statement, _parameters, _context, _executemany):
+    capture = _current.get()
+    started = conn.info.get("profiling_started")
+    if capture is not None and started:
+        capture.add_statement(statement, time.perf_counter() - started.pop())
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("profiling_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def log_lookup_query(record):
+    """asyncpg query logger of the lookup pools, called in the context of the request"""
+    capture = _current.get()
+    if capture is not None:
+        capture.add_statement(record.query, record.elapsed)
+
+
+def instrument_engines(engines: list[AsyncEngine]):
+    for engine in engines:
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine.sync_engine, "handle_error", _handle_error)
+
+
+def _save(capture: Capture):
+    directory = Path(app_settings.PROFILING_DIR)
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        folded = "".join(f"{stack} {count}\n" for stack, count in capture.samples.items())
+        (directory / f"{capture.id}.folded").write_text(folded)
+        details = capture.summary() | {
+            "sql": [{"statement": statement, "duration_ms": ms} for statement, ms in capture.statements],
+        }
+        # written last, a capture is listed only once both files are there
+        (directory / f"{capture.id}.json").write_text(json.dumps(details))
+        for old in sorted(directory.glob("*.json"))[:-app_settings.PROFILING_KEEP or None]:
+            old.unlink(missing_ok=True)
+            old.with_suffix(".folded").unlink(missing_ok=True)
+    except OSError:
+        logger.exception(f"Unable to save profile {capture.id}")
+        return
+    logger.info(f"Profile {capture.id} saved ({capture.reason}, {capture.method} {capture.path}, "
+                f"{capture.duration_ms:.1f} ms)")
+
+
+def recent_captures(limit: int) -> list[dict]:
+    """Summaries of the newest captures of all workers, newest first"""
+    captures = []
+    for path in sorted(Path(app_settings.PROFILING_DIR).glob("*.json"), reverse=True)[:limit]:
+        try:
+            details = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # pruned or being written meanwhile
+            continue
+        details.pop("sql", None)
+        captures.append(details)
+    return captures
+
+
+def load_capture(capture_id: str) -> dict | None:
+    try:
+        return json.loads((Path(app_settings.PROFILING_DIR) / f"{capture_id}.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def load_folded(capture_id: str) -> str | None:
+    try:
+        return (Path(app_settings.PROFILING_DIR) / f"{capture_id}.folded").read_text()
+    except OSError:
+        return None
@@ -1,21 +1,108 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings
 
 
 class PostgresSettings(BaseSettings):
+    # "sqlite" runs single-node deployments on a local WAL-mode file (needs the sqlite extra)
+    DATABASE_BACKEND: Literal["postgresql", "sqlite"] = "postgresql"
+    SQLITE_PATH: str = "minilink.db"
     POSTGRES_USER: str = "postgres"
     POSTGRES_PASSWORD: str = "postgres"
     POSTGRES_SERVER: str = "localhost"
     POSTGRES_PORT: int = 5432
     POSTGRES_DB: str = "postgres"
+    LOOKUP_POOL_MIN_SIZE: int = 1
+    LOOKUP_POOL_MAX_SIZE: int = 10
+    # SQLAlchemy URLs of the extra link shards as a JSON list, the database above is shard 0
+    LINK_SHARD_URLS: list[str] = []
+    # number of shards before the last ones were added, set while rebalancing (0 = not rebalancing)
+    LINK_SHARDS_PREVIOUS_COUNT: int = 0
 
     class Config:
         env_file = ".env"
 
     def get_url(self):
+        if self.DATABASE_BACKEND == "sqlite":
+            return f"sqlite+aiosqlite:///{self.SQLITE_PATH}"
         return (
             f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@"
             f"{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
         )
 
+    def get_dsn(self):
+        """Plain libpq-style DSN for raw asyncpg connections"""
+        return (
+            f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@"
+            f"{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+        )
+
+
+class AppSettings(BaseSettings):
+    """Application tunables, intervals and TTLs are in seconds"""
+    # JSON list, e.g. ADMIN_USERNAMES='["alice"]'
+    ADMIN_USERNAMES: list[str] = []
+
+    SUMMARY_SWEEP_INTERVAL: int = 60
+    # 0 disables the reconcile job
+    SUMMARY_RECONCILE_INTERVAL: int = 0
+
+    # concurrent lookups of the same link or user share one query, waiting at most this long
+    SINGLE_FLIGHT_TIMEOUT: float = 5.0
+
+    LINK_CACHE_SIZE: int = 10_000
+    LINK_CACHE_TTL: int = 60
+    # ids of the destinations new links were created with, per worker
+    DESTINATION_CACHE_SIZE: int = 10_000
+    DESTINATION_CACHE_TTL: int = 3600
+    # destinations left without links are deleted this often, 0 disables the job
+    DESTINATIONS_PRUNE_INTERVAL: int = 3600
+    HOT_LINKS_CAPACITY: int = 1_000
+    # a link is cached once it was surely clicked this many times in the recent windows
+    HOT_LINKS_MIN_CLICKS: int = 5
+    HOT_LINKS_WINDOW: int = 60
+    HOT_LINKS_WARMUP: int = 500
+
+    # clicks over the queue size are dropped instead of slowing redirects down
+    CLICK_EVENTS_QUEUE_SIZE: int = 10_000
+    CLICK_EVENTS_BATCH_SIZE: int = 500
+    CLICK_EVENTS_FLUSH_INTERVAL: float = 1.0
+    CLICK_EVENTS_PARTITIONS_AHEAD: int = 3
+    CLICK_EVENTS_RETENTION_DAYS: int = 30
+    CLICK_EVENTS_MAINTENANCE_INTERVAL: int = 3600
+
+    # how soon workers see domains added by another worker
+    DOMAINS_REFRESH_INTERVAL: int = 30
+
+    # live click streams publish the counts once per tick, whatever the number of viewers
+    LIVE_CLICKS_TICK: float = 1.0
+    # seconds without changes after which the count is sent again, so proxies keep the stream open
+    LIVE_CLICKS_KEEPALIVE: float = 15.0
+    # watched counts are set from the database, for the clicks served by other workers
+    LIVE_CLICKS_RESYNC_INTERVAL: int = 10
+
+    # request profiling (see core/profiling), nothing is installed unless enabled
+    PROFILING_ENABLED: bool = False
+    # fraction of the requests watched by the stack sampler
+    PROFILING_SAMPLE_RATE: float = 0.0
+    # requests with this value in the X-Profile header are always sampled, unset disables the header
+    PROFILING_TOKEN: str | None = None
+    PROFILING_INTERVAL: float = 0.005
+    # slower requests are captured with their SQL statements, sampled or not
+    PROFILING_SLOW_REQUEST_MS: float = 500
+    PROFILING_DIR: str = "profiles"
+    PROFILING_KEEP: int = 100
+
+    # shared by all workers of an instance, 0 interval disables refreshing it
+    LINK_SNAPSHOT_PATH: str = "link_snapshot.bin"
+    LINK_SNAPSHOT_INTERVAL: int = 30
+    # the file only grows between full rewrites, which also drop deleted and expired links
+    LINK_SNAPSHOT_REBUILD_INTERVAL: int = 3600
+
+    class Config:
+        env_file = ".env"
+        extra = "ignore"
+
 
 settings = PostgresSettings()
+app_settings = AppSettings()
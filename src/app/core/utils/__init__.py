@@ -1,10 +1,11 @@
 from .security import get_password_hash, verify_password
-from .auth import create_access_token, authenticate_user, get_current_user
+from .auth import create_access_token, authenticate_user, get_current_user, get_current_admin
 
 __all__ = [
     "get_password_hash",
     "verify_password",
     "create_access_token",
     "authenticate_user",
-    "get_current_user"
+    "get_current_user",
+    "get_current_admin"
 ]
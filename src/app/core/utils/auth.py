@@ -5,6 +5,7 @@ Includes:
 - Creating an access token
 - Authentication of the user
 - Getting currently logged-in user
+- Restricting access to admins
 
 """
 
@@ -12,15 +13,16 @@ from fastapi import status, HTTPException
 from fastapi.params import Depends
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta, timezone, datetime
 from typing import Annotated
 from os import getenv
 import logging
 import jwt
 
-from src.app.core.db.database import get_db
+from src.app.core.db.database import open_session
+from src.app.core.settings import app_settings
 from src.app.crud.operations import get_existing_user
+from src.app.core.utils.single_flight import SingleFlight
 from src.app.schemas import TokenData, UserResponse
 from src.app.core import exceptions
 from src.app.core.utils import verify_password
@@ -29,6 +31,17 @@ logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/token")
 
+# every authenticated request looks its user up, concurrent requests of a user share the query
+user_lookups = SingleFlight(timeout=app_settings.SINGLE_FLIGHT_TIMEOUT)
+
+
+async def _find_user(username: str):
+    async def query():
+        # a session of its own, the request that started the lookup may give up on it
+        async with open_session() as db:
+            return await get_existing_user(db, username)
+    return await user_lookups.do(username, query)
+
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -53,11 +66,8 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-async def authenticate_user(
-        username: str, password: str,
-        db: Annotated[AsyncSession, Depends(get_db)]
-):
-    user = await get_existing_user(db, username)
+async def authenticate_user(username: str, password: str):
+    user = await _find_user(username)
     if not user:
         raise SQLAlchemyError(f"Could not find user: {username} in the database")
     if verify_password(password, user.hasshed_password):
@@ -65,10 +75,7 @@ async def authenticate_user(
     return None
 
 
-async def get_current_user(
-        token: Annotated[str, Depends(oauth2_scheme)],
-        db: Annotated[AsyncSession, Depends(get_db)]
-) -> UserResponse:
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> UserResponse:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -83,7 +90,7 @@ async def get_current_user(
     except jwt.InvalidTokenError:
         raise credentials_exception
 
-    user = await get_existing_user(db, token_data.username)
+    user = await _find_user(token_data.username)
 
     if user is None:
         raise credentials_exception
@@ -95,3 +102,15 @@ async def get_current_user(
         username=user.username,
         created_at=datetime.now(timezone.utc)
     )
+
+
+async def get_current_admin(
+        current_user: Annotated[UserResponse, Depends(get_current_user)]
+) -> UserResponse:
+    if current_user.username not in app_settings.ADMIN_USERNAMES:
+        logger.warning(f"Admin access denied for user: {current_user.username}")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin permissions required"
+        )
+    return current_user
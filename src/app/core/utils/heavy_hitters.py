@@ -0,0 +1,70 @@
+"""
+Space-Saving sketch for finding the most frequent keys of a stream.
+
+Keeps at most `capacity` counters no matter how many distinct keys are seen.
+A key that isn't tracked takes over the counter of the least frequent one and
+inherits its count as the possible overestimation (error) of its own count.
+"""
+
+import heapq
+from typing import Hashable
+
+
+class SpaceSaving:
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("Capacity must be positive")
+        self.capacity = capacity
+        self._counts: dict[Hashable, float] = {}
+        self._errors: dict[Hashable, float] = {}
+        # lazy min-heap of (count, key): entries go stale on increments and are fixed up on eviction
+        self._heap: list[tuple[float, Hashable]] = []
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, key: Hashable):
+        return key in self._counts
+
+    def add(self, key: Hashable, count: float = 1) -> float:
+        """Count key occurrences, returns the estimated count of the key"""
+        if key in self._counts:
+            self._counts[key] += count
+            return self._counts[key]
+
+        error = 0
+        if len(self._counts) >= self.capacity:
+            error = self._evict_min()
+        self._counts[key] = error + count
+        self._errors[key] = error
+        heapq.heappush(self._heap, (self._counts[key], key))
+        return self._counts[key]
+
+    def _evict_min(self) -> float:
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self._counts[key] == count:
+                del self._counts[key]
+                del self._errors[key]
+                return count
+            heapq.heappush(self._heap, (self._counts[key], key))
+
+    def estimate(self, key: Hashable) -> float:
+        """Upper bound of the key count, 0 if the key isn't tracked"""
+        return self._counts.get(key, 0)
+
+    def guaranteed(self, key: Hashable) -> float:
+        """Lower bound of the key count, 0 if the key isn't tracked"""
+        return self._counts.get(key, 0) - self._errors.get(key, 0)
+
+    def top(self, k: int) -> list[tuple[Hashable, float, float]]:
+        """k most frequent keys as (key, estimated count, max error)"""
+        keys = heapq.nlargest(k, self._counts, key=self._counts.__getitem__)
+        return [(key, self._counts[key], self._errors[key]) for key in keys]
+
+    def decay(self, factor: float = 0.5):
+        """Scale all counters down so the sketch follows the recent part of the stream"""
+        self._counts = {key: count * factor for key, count in self._counts.items()}
+        self._errors = {key: error * factor for key, error in self._errors.items()}
+        self._heap = [(count, key) for key, count in self._counts.items()]
+        heapq.heapify(self._heap)
@@ -0,0 +1,21 @@
+from typing import Any
+
+from fastapi.responses import Response
+
+try:
+    import msgpack
+except ImportError:  # optional, pip install minilink[msgpack]
+    msgpack = None
+
+
+class MsgPackResponse(Response):
+    """
+    msgpack encoded response, check that `msgpack` is not None before using it.
+
+    Datetimes (timezone aware) are encoded as the msgpack timestamp extension type.
+    """
+
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, datetime=True)
@@ -0,0 +1,37 @@
+from typing import Awaitable, Callable, Hashable, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one in-flight call.
+
+    The first caller starts the call as a task, callers arriving while it runs wait
+    for the same result, or get the same exception. Every caller waits at most
+    `timeout` seconds (asyncio.TimeoutError), a caller giving up doesn't cancel
+    the call for the others.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # retrieved even when every caller timed out, so it's never logged as unhandled
+            task.exception()
@@ -1,11 +1,19 @@
-from typing import Sequence
-from sqlalchemy import select, update, delete
+from collections import defaultdict
+from itertools import islice
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Sequence
+from sqlalchemy import (select, insert, update, delete, Row, case, and_, or_, func, ColumnElement, text,
+                        Update, Delete, Select, tuple_, union)
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta, date
+import hashlib
+import heapq
+import re
 
-from src.app.models.models import User, ShortURL
-from src.app.schemas import UserRequest, LinkFilters
+from src.app.models.models import (User, ShortURL, Destination, Domain, UserLinkSummary, LinkExpirySweep, HotLink,
+                                   ClickEvent, DEFAULT_DOMAIN_ID, LINK_DEFAULT_LIFETIME)
+from src.app.schemas import UserRequest, LinkFilters, LinkPredicate
 from src.app.core.utils import get_password_hash
+from src.app.core.db import sharding, dialect
 
 
 async def get_existing_user(db: AsyncSession, username: str) -> User | None:
@@ -27,78 +35,670 @@ async def create_user(db: AsyncSession, user_details: UserRequest) -> User | Non
     return user
 
 
-async def get_link_by_code(db: AsyncSession, link_name: str) -> ShortURL | None:
-    stmt = select(ShortURL).where(ShortURL.short_code == link_name)
+async def get_domains(db: AsyncSession) -> Sequence[Row]:
+    """(id, host, base_url) of every domain"""
+    result = await db.execute(select(Domain.id, Domain.host, Domain.base_url).order_by(Domain.id))
+    return result.all()
+
+
+async def create_domain(db: AsyncSession, host: str, base_url: str) -> Domain:
+    domain = Domain(host=host, base_url=base_url)
+    db.add(domain)
+    await db.commit()
+    return domain
+
+
+async def save_default_domain(db: AsyncSession, host: str, base_url: str) -> None:
+    stmt = dialect.insert(db, Domain).values(id=DEFAULT_DOMAIN_ID, host=host, base_url=base_url)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[Domain.id],
+        set_={"host": stmt.excluded.host, "base_url": stmt.excluded.base_url},
+    ))
+    await db.commit()
+
+
+async def _first_row(db: AsyncSession, short_code: str, stmt) -> Row | None:
+    """First row the statement returns on the shards a link with the code can be on"""
+    for shard in sharding.candidate_shards(short_code):
+        result = await sharding.session_for_shard(db, shard).execute(stmt)
+        row = result.one_or_none()
+        if row is not None:
+            return row
+    return None
+
+
+async def get_link_by_code(db: AsyncSession, domain_id: int, link_name: str) -> ShortURL | None:
+    stmt = select(ShortURL).where(ShortURL.domain_id == domain_id).where(ShortURL.short_code == link_name)
+    row = await _first_row(db, link_name, stmt)
+    return row[0] if row is not None else None
+
+
+async def get_link_target(db: AsyncSession, domain_id: int, short_code: str) -> Row | None:
+    """ORM-path equivalent of the prepared lookup in core/db/lookup"""
+    stmt = (
+        select(Destination.url, ShortURL.created_at, ShortURL.expiration_time)
+        .join_from(ShortURL, Destination)
+        .where(ShortURL.domain_id == domain_id)
+        .where(ShortURL.short_code == short_code)
+    )
+    return await _first_row(db, short_code, stmt)
+
+
+def _links_by_shard(links: list[tuple[int, str]]) -> dict[int, list[tuple[int, str]]]:
+    links_by_shard = defaultdict(list)
+    for domain_id, code in links:
+        for shard in sharding.candidate_shards(code):
+            links_by_shard[shard].append((domain_id, code))
+    return links_by_shard
+
+
+async def _select_by_codes(
+        db: AsyncSession, links: list[tuple[int, str]], *columns, with_destination: bool = False
+) -> list[Row]:
+    """
+    (domain_id, short_code, *columns) of every existing (domain_id, short_code), one query per shard.
+    with_destination joins the destinations, for columns of Destination.
+    """
+    links_by_shard = _links_by_shard(links)
+
+    async def fetch(session: AsyncSession, shard: int) -> Sequence[Row]:
+        if shard not in links_by_shard:
+            return []
+        stmt = (
+            select(ShortURL.domain_id, ShortURL.short_code, *columns)
+            .where(tuple_(ShortURL.domain_id, ShortURL.short_code).in_(links_by_shard[shard]))
+        )
+        if with_destination:
+            stmt = stmt.join_from(ShortURL, Destination)
+        result = await session.execute(stmt)
+        return result.all()
+
+    return [row for rows in await sharding.on_every_shard(db, fetch) for row in rows]
+
+
+async def get_links_by_codes(db: AsyncSession, links: list[tuple[int, str]]) -> list[Row]:
+    """(domain_id, short_code, long_url, created_at, expiration_time) of every existing (domain_id, short_code)"""
+    return await _select_by_codes(
+        db, links, Destination.url, ShortURL.created_at, ShortURL.expiration_time, with_destination=True
+    )
+
+
+async def get_clicks_by_codes(db: AsyncSession, links: list[tuple[int, str]]) -> list[Row]:
+    """(domain_id, short_code, clicks) of every existing (domain_id, short_code)"""
+    return await _select_by_codes(db, links, ShortURL.clicks)
+
+
+async def get_active_links_after(db: AsyncSession, after_id: int, limit: int) -> Sequence[Row]:
+    """(id, domain_id, short_code, long_url, created_at, expiration_time) of not expired links, ordered by id"""
+    stmt = (
+        select(ShortURL.id, ShortURL.domain_id, ShortURL.short_code, Destination.url,
+               ShortURL.created_at, ShortURL.expiration_time)
+        .join_from(ShortURL, Destination)
+        .where(ShortURL.id > after_id)
+        .where(or_(ShortURL.expiration_time.is_(None),
+                   ShortURL.expiration_time > datetime.now(timezone.utc)))
+        .order_by(ShortURL.id)
+        .limit(limit)
+    )
     result = await db.execute(stmt)
-    return result.scalar_one_or_none()
+    return result.all()
+
+
+async def get_link_stats(db: AsyncSession, domain_id: int, short_code: str) -> Row | None:
+    # only the columns needed for statistics, no ORM entity is built
+    stmt = (
+        select(Destination.url.label("long_url"), ShortURL.short_code, ShortURL.clicks, ShortURL.user_id)
+        .join_from(ShortURL, Destination)
+        .where(ShortURL.domain_id == domain_id)
+        .where(ShortURL.short_code == short_code)
+    )
+    return await _first_row(db, short_code, stmt)
+
+
+def destination_hash(url: str) -> bytes:
+    return hashlib.sha256(url.encode()).digest()
+
+
+async def intern_destinations(db: AsyncSession, urls: Iterable[str]) -> dict[str, int]:
+    """
+    Destination id of every URL on the database of the session, missing destinations are added.
+    Not committed, they are written along with the links pointing to them.
+    """
+    urls_by_hash = {destination_hash(url): url for url in urls}
+    # inserted in the same order by every transaction, so concurrent ones wait instead of deadlocking
+    hashes = sorted(urls_by_hash)
+    stmt = dialect.insert(db, Destination).values(
+        [{"url_hash": url_hash, "url": urls_by_hash[url_hash]} for url_hash in hashes]
+    )
+    result = await db.execute(
+        stmt.on_conflict_do_nothing(index_elements=[Destination.url_hash])
+        .returning(Destination.url_hash, Destination.id)
+    )
+    ids = {urls_by_hash[url_hash]: destination_id for url_hash, destination_id in result.all()}
+    if len(ids) < len(urls_by_hash):
+        # the other ones were already there (or just committed by a concurrent transaction)
+        result = await db.execute(
+            select(Destination.url_hash, Destination.id)
+            .where(Destination.url_hash.in_([url_hash for url_hash in hashes if urls_by_hash[url_hash] not in ids]))
+        )
+        ids.update((urls_by_hash[url_hash], destination_id) for url_hash, destination_id in result.all())
+    return ids
 
 
 async def create_short_link(
         db: AsyncSession, original_url: str,
-        short_code: str, owner_id: int, expiration: datetime
+        short_code: str, owner_id: int, expiration: datetime,
+        domain_id: int = DEFAULT_DOMAIN_ID, destination_id: int | None = None
 ) -> ShortURL | None:
+    """destination_id is the id of original_url on the link's shard, looked up by its hash when not given"""
+    db = sharding.session_for_code(db, short_code)
+    if destination_id is None:
+        destination_id = (await intern_destinations(db, [original_url]))[original_url]
+    now = datetime.now(timezone.utc)
     link = ShortURL(
-        long_url=original_url,
+        destination_id=destination_id,
+        domain_id=domain_id,
         short_code=short_code,
         user_id=owner_id,
-        created_at=datetime.now(timezone.utc),
+        created_at=now,
         expiration_time=expiration
     )
     db.add(link)
+
+    is_active = 1 if expiration is None or expiration > now else 0
+    summary = dialect.insert(db, UserLinkSummary).values(
+        user_id=owner_id, total_links=1, active_links=is_active, total_clicks=0
+    )
+    await db.execute(summary.on_conflict_do_update(
+        index_elements=[UserLinkSummary.user_id],
+        set_={
+            "total_links": UserLinkSummary.total_links + 1,
+            "active_links": UserLinkSummary.active_links + is_active,
+        },
+    ))
     await db.commit()
 
     return link
 
 
-async def update_short_link_clicks(db: AsyncSession, short_code: str) -> ShortURL:
-    # Operation doesn't follow an ORM-style but is atomic and guarantees the correct result
-    stmt = (
+async def update_short_link_clicks(db: AsyncSession, domain_id: int, short_code: str, count: int = 1) -> Row:
+    """Returns (id, user_id, clicks, expiration_time) of the clicked link"""
+    # Operation doesn't follow an ORM-style but is atomic and guarantees the correct result,
+    # the owner's summary is bumped along with the link
+    hit = (
         update(ShortURL)
+        .where(ShortURL.domain_id == domain_id)
         .where(ShortURL.short_code == short_code)
-        .values(clicks=ShortURL.clicks + 1)
-        .returning(ShortURL)
+        .values(clicks=ShortURL.clicks + count)
+        .returning(ShortURL.id, ShortURL.user_id, ShortURL.clicks, ShortURL.expiration_time)
     )
-    result = await db.execute(stmt)
-    await db.commit()
-    updated_url = result.scalar_one_or_none()
-    if not updated_url:
-        raise ValueError("Short URL not found")
 
+    def summary(link) -> Update:
+        return (
+            update(UserLinkSummary)
+            .where(UserLinkSummary.user_id == link.user_id)
+            .values(total_clicks=UserLinkSummary.total_clicks + count)
+        )
+
+    updated_url = await _write_on_candidate_shards(db, short_code, hit, summary)
+    if updated_url is None:
+        raise ValueError("Short URL not found")
     return updated_url
 
 
-async def delete_short_link(db: AsyncSession, user_id: int, short_code: str) -> int | None:
+async def _write_with_summary(db: AsyncSession, stmt: Update | Delete, summary: Callable[..., Update]) -> Row | None:
+    """
+    Runs an UPDATE/DELETE ... RETURNING of a single link and summary(link) on the returned row
+    in one transaction, returns the row OR None, if no link matched
+    """
+    if dialect.is_sqlite(db):
+        # no data-modifying CTEs, writers are serialized so the second statement sees the same link
+        result = await db.execute(stmt)
+        link = result.one_or_none()
+        if link is not None:
+            await db.execute(summary(link))
+    else:
+        # a single statement, one round trip
+        link_cte = stmt.cte("link")
+        result = await db.execute(select(*link_cte.c).add_cte(summary(link_cte.c).cte("summary")))
+        link = result.one_or_none()
+    await db.commit()
+    return link
+
+
+async def _write_on_candidate_shards(
+        db: AsyncSession, short_code: str, stmt: Update | Delete, summary: Callable[..., Update]
+) -> Row | None:
+    """_write_with_summary on the shards the link can be found on, until one of them matches"""
+    shards = sharding.candidate_shards(short_code)
+    if len(shards) > 1:
+        # a rebalance commits the link on its new shard before deleting it from the previous one,
+        # while the write waits for the lock there. A link gone from the previous shard is looked
+        # up again on the new one, where it is committed by then
+        shards.append(shards[0])
+    for shard in shards:
+        link = await _write_with_summary(sharding.session_for_shard(db, shard), stmt, summary)
+        if link is not None:
+            return link
+    return None
+
+
+def _counted_as_active(link, swept_until) -> ColumnElement[bool]:
+    """Whether a link is still included into its owner's active_links"""
+    # links created already expired were never counted, expired ones are removed by the sweep
+    return or_(
+        link.expiration_time.is_(None),
+        and_(link.expiration_time > link.created_at, link.expiration_time > swept_until),
+    )
+
+
+async def delete_short_link(db: AsyncSession, user_id: int, domain_id: int, short_code: str) -> int | None:
     """Returns id OR None"""
-    stmt = (
+    swept_until = select(LinkExpirySweep.swept_until).scalar_subquery()
+    gone = (
         delete(ShortURL)
+        .where(ShortURL.domain_id == domain_id)
         .where(ShortURL.short_code == short_code)
         .where(ShortURL.user_id == user_id)
-        .returning(ShortURL.id)
+        .returning(
+            ShortURL.id, ShortURL.user_id, ShortURL.clicks,
+            case((_counted_as_active(ShortURL, swept_until), 1), else_=0).label("active"),
+        )
     )
-    result = await db.execute(stmt)
+
+    def summary(link) -> Update:
+        return (
+            update(UserLinkSummary)
+            .where(UserLinkSummary.user_id == link.user_id)
+            .values(
+                total_links=UserLinkSummary.total_links - 1,
+                total_clicks=UserLinkSummary.total_clicks - link.clicks,
+                active_links=UserLinkSummary.active_links - link.active,
+            )
+        )
+
+    deleted = await _write_on_candidate_shards(db, short_code, gone, summary)
+    return deleted.id if deleted is not None else None
+
+
+BULK_CHUNK_SIZE = 1000
+
+
+async def _locked_chunks(
+        db: AsyncSession, user_id: int, links: list[tuple[int, str]] | None, filters: LinkPredicate | None
+) -> AsyncIterator[list[Row]]:
+    """
+    (id, active) of the user's links, matching either the (domain_id, short_code) pairs or the filters,
+    BULK_CHUNK_SIZE at a time. The rows stay locked until the transaction ends.
+    """
+    swept_until = select(LinkExpirySweep.swept_until).scalar_subquery()
+    query = (
+        select(ShortURL.id, case((_counted_as_active(ShortURL, swept_until), 1), else_=0).label("active"))
+        .where(ShortURL.user_id == user_id)
+        .order_by(ShortURL.id)
+        .with_for_update()
+    )
+    if links is not None:
+        for start in range(0, len(links), BULK_CHUNK_SIZE):
+            chunk = links[start:start + BULK_CHUNK_SIZE]
+            result = await db.execute(query.where(tuple_(ShortURL.domain_id, ShortURL.short_code).in_(chunk)))
+            if rows := result.all():
+                yield rows
+        return
+
+    query = _filter_links(query, filters, user_id).limit(BULK_CHUNK_SIZE)
+    after_id = 0
+    while True:
+        result = await db.execute(query.where(ShortURL.id > after_id))
+        rows = result.all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < BULK_CHUNK_SIZE:
+            return
+        after_id = rows[-1].id
+
+
+async def _bulk_write(
+        db: AsyncSession, user_id: int, links: list[tuple[int, str]] | None, filters: LinkPredicate | None,
+        write: Callable[[AsyncSession, list[Row]], Awaitable[tuple[list[Row], dict[str, int]]]]
+) -> list[Row]:
+    """
+    Runs write(session, chunk) on the locked chunks of the user's links, one transaction per shard.
+    write returns the rows it changed and the changes of the user's summary columns, which are
+    applied once per shard. Returns all the changed rows.
+    """
+    links_by_shard = _links_by_shard(links) if links is not None else None
+
+    async def on_shard(session: AsyncSession, shard: int) -> list[Row]:
+        if links_by_shard is not None and shard not in links_by_shard:
+            return []
+        changed = []
+        totals = defaultdict(int)
+        shard_links = links_by_shard[shard] if links_by_shard is not None else None
+        async for chunk in _locked_chunks(session, user_id, shard_links, filters):
+            rows, changes = await write(session, chunk)
+            changed.extend(rows)
+            for column, change in changes.items():
+                totals[column] += change
+        if any(totals.values()):
+            await session.execute(
+                update(UserLinkSummary)
+                .where(UserLinkSummary.user_id == user_id)
+                .values({column: getattr(UserLinkSummary, column) + change for column, change in totals.items()})
+            )
+        await session.commit()
+        return changed
+
+    return [row for rows in await sharding.on_every_shard(db, on_shard) for row in rows]
+
+
+async def delete_short_links(
+        db: AsyncSession, user_id: int,
+        links: list[tuple[int, str]] | None = None, filters: LinkPredicate | None = None
+) -> list[Row]:
+    """Deletes the user's links given by (domain_id, short_code) or by filters, returns their (domain_id, short_code)"""
+    async def write(session: AsyncSession, chunk: list[Row]) -> tuple[list[Row], dict[str, int]]:
+        result = await session.execute(
+            delete(ShortURL)
+            .where(ShortURL.user_id == user_id)
+            .where(ShortURL.id.in_([row.id for row in chunk]))
+            .returning(ShortURL.domain_id, ShortURL.short_code, ShortURL.clicks)
+        )
+        rows = result.all()
+        return [(row.domain_id, row.short_code) for row in rows], {
+            "total_links": -len(rows),
+            "total_clicks": -sum(row.clicks for row in rows),
+            "active_links": -sum(row.active for row in chunk),
+        }
+
+    return await _bulk_write(db, user_id, links, filters, write)
+
+
+async def update_links_expiration(
+        db: AsyncSession, user_id: int, expiration: datetime,
+        links: list[tuple[int, str]] | None = None, filters: LinkPredicate | None = None
+) -> list[Row]:
+    """Sets the expiration time of the user's links given by (domain_id, short_code) or by filters,
+    returns their (domain_id, short_code)"""
+    swept_until = select(LinkExpirySweep.swept_until).scalar_subquery()
+
+    async def write(session: AsyncSession, chunk: list[Row]) -> tuple[list[Row], dict[str, int]]:
+        result = await session.execute(
+            update(ShortURL)
+            .where(ShortURL.user_id == user_id)
+            .where(ShortURL.id.in_([row.id for row in chunk]))
+            .values(expiration_time=expiration)
+            .returning(
+                ShortURL.domain_id, ShortURL.short_code,
+                # RETURNING sees the new expiration time
+                case((_counted_as_active(ShortURL, swept_until), 1), else_=0).label("active"),
+            )
+        )
+        rows = result.all()
+        return [(row.domain_id, row.short_code) for row in rows], {
+            "active_links": sum(row.active for row in rows) - sum(row.active for row in chunk),
+        }
+
+    return await _bulk_write(db, user_id, links, filters, write)
+
+
+async def get_link_summary(db: AsyncSession, user_id: int) -> tuple[int, int, int] | None:
+    """(total_links, active_links, total_clicks) over all shards OR None, if user has no links yet"""
+    stmt = (
+        select(UserLinkSummary.total_links, UserLinkSummary.active_links, UserLinkSummary.total_clicks)
+        .where(UserLinkSummary.user_id == user_id)
+    )
+
+    async def fetch(session: AsyncSession, _shard: int) -> Row | None:
+        result = await session.execute(stmt)
+        return result.one_or_none()
+
+    rows = [row for row in await sharding.on_every_shard(db, fetch) if row is not None]
+    if not rows:
+        return None
+    return tuple(sum(column) for column in zip(*rows))
+
+
+async def get_top_links(db: AsyncSession, user_id: int, limit: int) -> list[Row]:
+    # walks the (user_id, clicks) index from the top, not the whole set of user's links
+    stmt = (
+        select(ShortURL.short_code, ShortURL.clicks)
+        .where(ShortURL.user_id == user_id)
+        .order_by(ShortURL.clicks.desc())
+        .limit(limit)
+    )
+
+    async def fetch(session: AsyncSession, _shard: int) -> Sequence[Row]:
+        result = await session.execute(stmt)
+        return result.all()
+
+    rows = [row for rows in await sharding.on_every_shard(db, fetch) for row in rows]
+    return heapq.nlargest(limit, rows, key=lambda row: row.clicks)
+
+
+async def sweep_expired_links(db: AsyncSession) -> int:
+    """
+    Move links expired since the previous sweep out of their owners' active_links.
+    Returns number of affected summaries.
+    """
+    now = datetime.now(timezone.utc)
+    # the row lock keeps concurrent workers from sweeping the same range twice
+    result = await db.execute(select(LinkExpirySweep).where(LinkExpirySweep.id == 1).with_for_update())
+    sweep = result.scalar_one()
+
+    expired = (
+        select(ShortURL.user_id, func.count().label("expired"))
+        .where(ShortURL.expiration_time > sweep.swept_until)
+        .where(ShortURL.expiration_time <= now)
+        .where(ShortURL.expiration_time > ShortURL.created_at)
+        .group_by(ShortURL.user_id)
+        .subquery()
+    )
+    result = await db.execute(
+        update(UserLinkSummary)
+        .where(UserLinkSummary.user_id == expired.c.user_id)
+        .values(active_links=UserLinkSummary.active_links - expired.c.expired)
+    )
+    sweep.swept_until = now
     await db.commit()
-    return result.scalar_one_or_none()
+    return result.rowcount
 
 
-async def get_links(db: AsyncSession, filters: LinkFilters, user_id: int) -> Sequence[ShortURL]:
-    query = select(ShortURL).where(ShortURL.user_id == user_id)
+async def reconcile_link_summaries(db: AsyncSession) -> None:
+    """Recompute every summary from short_urls, fixing any drift of the incremental updates"""
+    result = await db.execute(select(LinkExpirySweep).where(LinkExpirySweep.id == 1).with_for_update())
+    sweep = result.scalar_one()
+
+    totals = select(
+        ShortURL.user_id,
+        func.count().label("total_links"),
+        func.count().filter(_counted_as_active(ShortURL, sweep.swept_until)).label("active_links"),
+        func.coalesce(func.sum(ShortURL.clicks), 0).label("total_clicks"),
+    ).group_by(ShortURL.user_id)
+    stmt = dialect.insert(db, UserLinkSummary).from_select(
+        ["user_id", "total_links", "active_links", "total_clicks"], totals
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[UserLinkSummary.user_id],
+        set_={
+            "total_links": stmt.excluded.total_links,
+            "active_links": stmt.excluded.active_links,
+            "total_clicks": stmt.excluded.total_clicks,
+        },
+    ))
+    # users left without any links
+    await db.execute(
+        update(UserLinkSummary)
+        .where(~UserLinkSummary.user_id.in_(select(ShortURL.user_id)))
+        .values(total_links=0, active_links=0, total_clicks=0)
+    )
+    await db.commit()
 
+
+async def prune_destinations(db: AsyncSession, batch_size: int = 1000) -> int:
+    """
+    Delete the destinations no link points to anymore, in batches. Returns number of deleted destinations.
+    A link created with one of them meanwhile fails on its foreign key (see url_service.create_short_url).
+    """
+    orphans = (
+        select(Destination.id)
+        .where(~select(ShortURL.id).where(ShortURL.destination_id == Destination.id).exists())
+        .limit(batch_size)
+    )
+    pruned = 0
+    while True:
+        result = await db.execute(delete(Destination).where(Destination.id.in_(orphans)))
+        await db.commit()
+        pruned += result.rowcount
+        if result.rowcount < batch_size:
+            return pruned
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _is_active(link, now: datetime) -> ColumnElement[bool]:
+    """Whether a link still redirects at now, as url_service._is_expired decides it (never NULL)"""
+    return or_(
+        and_(link.expiration_time.is_not(None), link.expiration_time >= now),
+        and_(link.expiration_time.is_(None), link.created_at >= now - LINK_DEFAULT_LIFETIME),
+    )
+
+
+def _filter_links(query: Select, filters: LinkPredicate, user_id: int) -> Select:
+    """query of the links of user_id narrowed to those matching filters"""
     if filters.min_clicks is not None:
         query = query.where(ShortURL.clicks >= filters.min_clicks)
     if filters.max_clicks is not None:
         query = query.where(ShortURL.clicks <= filters.max_clicks)
     if filters.active is not None:
-        now = datetime.now(timezone.utc)
-        if filters.active:
-            query = query.where(ShortURL.expiration_time < now)
-        else:
-            query = query.where(ShortURL.expiration_time >= now)
+        is_active = _is_active(ShortURL, datetime.now(timezone.utc))
+        query = query.where(is_active if filters.active else ~is_active)
     if filters.created_after is not None:
-        query = query.where(ShortURL.created_at < filters.created_after)
+        query = query.where(ShortURL.created_at > filters.created_after)
     if filters.created_before is not None:
-        query = query.where(ShortURL.created_at > filters.created_before)
+        query = query.where(ShortURL.created_at < filters.created_before)
+    if filters.q is not None:
+        # a union, each side is served by its trigram index: an OR across the links and the joined
+        # destinations would be checked on every link of the user. Wildcards typed by the user are literal
+        pattern = "%" + _escape_like(filters.q) + "%"
+        query = query.where(ShortURL.id.in_(union(
+            select(ShortURL.id)
+            .join_from(ShortURL, Destination)
+            .where(ShortURL.user_id == user_id)
+            .where(Destination.url.ilike(pattern, escape="\\")),
+            select(ShortURL.id)
+            .where(ShortURL.user_id == user_id)
+            .where(ShortURL.short_code.ilike(pattern, escape="\\")),
+        )))
+    return query
+
+
+async def get_links(db: AsyncSession, filters: LinkFilters, user_id: int) -> Sequence[Row]:
+    """Newest links first, user's links on all shards are merged into one page"""
+    # column projection: listing needs only these fields, so skip ORM entity loading
+    query = _filter_links(
+        select(ShortURL.domain_id, ShortURL.short_code, ShortURL.created_at, ShortURL.expiration_time)
+        .where(ShortURL.user_id == user_id)
+        .order_by(ShortURL.created_at.desc()),
+        filters,
+        user_id,
+    )
+
+    if not sharding.is_sharded():
+        result = await db.execute(query.offset(filters.offset).limit(filters.limit))
+        return result.all()
+
+    # any shard may hold the whole page, so each one returns everything up to its end
+    query = query.limit(filters.offset + filters.limit)
+
+    async def fetch(session: AsyncSession, _shard: int) -> Sequence[Row]:
+        result = await session.execute(query)
+        return result.all()
+
+    pages = await sharding.on_every_shard(db, fetch)
+    merged = heapq.merge(*pages, key=lambda row: row.created_at, reverse=True)
+    return list(islice(merged, filters.offset, filters.offset + filters.limit))
 
-    query = query.offset(filters.offset).limit(filters.limit)
-    result = await db.execute(query)
 
-    return result.scalars().all()
+async def get_hot_links(db: AsyncSession, limit: int, fresher_than: timedelta) -> Sequence[Row]:
+    """(domain_id, short_code, estimated_clicks) of the hottest links persisted recently"""
+    stmt = (
+        select(HotLink.domain_id, HotLink.short_code, HotLink.estimated_clicks)
+        .where(HotLink.updated_at > datetime.now(timezone.utc) - fresher_than)
+        .order_by(HotLink.estimated_clicks.desc())
+        .limit(limit)
+    )
+    result = await db.execute(stmt)
+    return result.all()
+
+
+async def save_hot_links(db: AsyncSession, hot_links: list[tuple[int, str, int]], keep_for: timedelta) -> None:
+    """hot_links are (domain_id, short_code, estimated_clicks)"""
+    now = datetime.now(timezone.utc)
+    if hot_links:
+        stmt = dialect.insert(db, HotLink).values([
+            {"domain_id": domain_id, "short_code": code, "estimated_clicks": clicks, "updated_at": now}
+            for domain_id, code, clicks in hot_links
+        ])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[HotLink.domain_id, HotLink.short_code],
+            set_={"estimated_clicks": stmt.excluded.estimated_clicks, "updated_at": now},
+        ))
+    # links no worker reported for a while cooled down
+    await db.execute(delete(HotLink).where(HotLink.updated_at < now - keep_for))
+    await db.commit()
+
+
+CLICK_EVENT_COLUMNS = ("occurred_at", "domain_id", "short_code", "referrer", "user_agent_class", "client_ip_prefix")
+_CLICK_EVENT_PARTITION = re.compile(r"^click_events_(\d{8})$")
+
+
+async def insert_click_events(db: AsyncSession, events: list[tuple]) -> None:
+    """Plain INSERT of click events, ordered as CLICK_EVENT_COLUMNS"""
+    stmt = insert(ClickEvent)
+    if dialect.is_sqlite(db):
+        # ids of a composite primary key aren't generated, each row takes the next one itself
+        stmt = stmt.values(id=select(func.coalesce(func.max(ClickEvent.id), 0) + 1).scalar_subquery())
+    await db.execute(stmt, [dict(zip(CLICK_EVENT_COLUMNS, event)) for event in events])
+    await db.commit()
+
+
+async def create_click_event_partitions(db: AsyncSession, first_day: date, days: int) -> None:
+    if dialect.is_sqlite(db):
+        return
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        next_day = day + timedelta(days=1)
+        await db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS click_events_{day:%Y%m%d} PARTITION OF click_events "
+            f"FOR VALUES FROM ('{day.isoformat()} 00:00:00+00') TO ('{next_day.isoformat()} 00:00:00+00')"
+        ))
+    await db.commit()
+
+
+async def drop_click_event_partitions(db: AsyncSession, older_than: date) -> list[str]:
+    """Drop whole days of click events, returns names of the dropped partitions"""
+    if dialect.is_sqlite(db):
+        # a single table, old events are deleted row by row
+        await db.execute(delete(ClickEvent).where(
+            ClickEvent.occurred_at < datetime.combine(older_than, datetime.min.time(), timezone.utc)
+        ))
+        await db.commit()
+        return []
+    result = await db.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "WHERE parent.relname = 'click_events'"
+    ))
+    dropped = []
+    for (name,) in result.all():
+        match = _CLICK_EVENT_PARTITION.match(name)
+        if match and datetime.strptime(match.group(1), "%Y%m%d").date() < older_than:
+            await db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            dropped.append(name)
+    await db.commit()
+    return dropped
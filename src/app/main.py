@@ -2,8 +2,15 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from src.app.api.v1.convert import router as convert_router
 from src.app.api.v1.auth import router as auth_router
+from src.app.api.v1.admin import router as admin_router
 from src.app.api.public.redirect import public_router
 from src.app.core.db.init_db import init_db
+from src.app.core.db import lookup
+from src.app.core.db.database import open_session, shard_engines
+from src.app.core import profiling
+from src.app.core.settings import app_settings
+from src.app.services import maintenance, hot_links, link_snapshot, domains, live_clicks
+from src.app.services.click_events import click_events, maintain_partitions
 from src.app.core.logger import setup_logging, LOGGING_CONFIG
 from dotenv import load_dotenv
 
@@ -13,12 +20,37 @@ setup_logging(log_config=LOGGING_CONFIG)
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
     load_dotenv()
+    # redirects can be served from the local snapshot right away if the database goes down
+    link_snapshot.load()
     await init_db()
+    await lookup.open_pool()
+    async with open_session() as db:
+        # redirects resolve their host from the in-memory domains table
+        await domains.setup(db)
+        # events can't be written before today's partition exists
+        await maintain_partitions(db)
+        await hot_links.warm_up(db)
+    click_events.start()
+    live_clicks.broadcaster.start()
+    jobs = maintenance.start_jobs()
     yield
+    await maintenance.stop_jobs(jobs)
+    await live_clicks.broadcaster.stop()
+    await click_events.stop()
+    await lookup.close_pool()
+    # SQLite connections run on their own threads, which would keep the process alive
+    for engine in shard_engines:
+        await engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan, debug=True)
 
+if app_settings.PROFILING_ENABLED:
+    profiling.instrument_engines(shard_engines)
+    lookup.query_loggers.append(profiling.log_lookup_query)
+    app.add_middleware(profiling.ProfilingMiddleware)
+
 app.include_router(router=convert_router)
 app.include_router(router=auth_router)
+app.include_router(router=admin_router)
 app.include_router(router=public_router)
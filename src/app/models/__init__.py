@@ -1 +1 @@
-from .models import User, ShortURL
+from .models import User, ShortURL, Domain, UserLinkSummary, LinkExpirySweep, HotLink, ClickEvent
@@ -1,30 +1,107 @@
-from sqlalchemy import String, ForeignKey, DateTime
+from sqlalchemy import (String, DateTime, Index, BigInteger, Identity, Sequence, TypeDecorator, UniqueConstraint,
+                        ForeignKey, LargeBinary, DDL, event)
 from sqlalchemy.orm import (DeclarativeBase, mapped_column, Mapped, relationship)
-from datetime import datetime
+from datetime import datetime, timezone, timedelta
+
+
+# links created without a domain, its base URL follows SERVICE_URL
+DEFAULT_DOMAIN_ID = 1
+# links created without an expiration time redirect for this long
+LINK_DEFAULT_LIFETIME = timedelta(hours=3)
 
 
 class Base(DeclarativeBase):
     pass
 
 
+class UTCDateTime(TypeDecorator):
+    """Timezone-aware datetime on every backend, SQLite stores them as naive UTC"""
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and dialect.name == "sqlite" and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
+
+class Destination(Base):
+    """URL the links redirect to, stored once per shard however many links point to it"""
+    __tablename__ = "destinations"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # sha256 of the URL, new links find their destination through it
+    url_hash: Mapped[bytes] = mapped_column(LargeBinary(32), unique=True)
+    url: Mapped[str] = mapped_column(String(2048))
+
+    __table_args__ = (
+        # serves the URL side of the link search (requires pg_trgm)
+        Index("ix_destinations_url_trgm", "url",
+              postgresql_using="gin", postgresql_ops={"url": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+    def __repr__(self):
+        return f"Destination (id: {self.id}, url: {self.url})"
+
+
 class ShortURL(Base):
     __tablename__ = "short_urls"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    long_url: Mapped[str] = mapped_column(String(2048))
-    short_code: Mapped[str] = mapped_column(String, unique=True, index=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    # the destination is on the same shard as the link
+    destination_id: Mapped[int] = mapped_column(ForeignKey("destinations.id"))
+    short_code: Mapped[str] = mapped_column(String)
+    # no foreign keys: links may live on a shard database without the users and domains tables
+    domain_id: Mapped[int] = mapped_column(default=DEFAULT_DOMAIN_ID)
+    user_id: Mapped[int] = mapped_column()
     clicks: Mapped[int] = mapped_column(default=0)
-    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
-    expiration_time: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, default=None)
+    created_at: Mapped[datetime] = mapped_column(UTCDateTime)
+    expiration_time: Mapped[datetime | None] = mapped_column(UTCDateTime, nullable=True, default=None)
 
-    user: Mapped["User"] = relationship(back_populates="short_urls")
+    user: Mapped["User"] = relationship(
+        back_populates="short_urls", primaryjoin="User.id == foreign(ShortURL.user_id)"
+    )
+
+    __table_args__ = (
+        # short codes are unique per domain, also serves the redirect lookup
+        UniqueConstraint("domain_id", "short_code", name="uq_short_urls_domain_id_short_code"),
+        # serves per-user top links without scanning all user's links
+        Index("ix_short_urls_user_id_clicks", "user_id", "clicks"),
+        # serves user listings, newest first
+        Index("ix_short_urls_user_id_created_at", "user_id", "created_at"),
+        # serves the expiry sweep of the user summaries
+        Index("ix_short_urls_expiration_time", "expiration_time"),
+        # serves the destinations prune and its foreign key checks
+        Index("ix_short_urls_destination_id", "destination_id"),
+        # trigram index serves substring search over user's links (requires pg_trgm)
+        Index("ix_short_urls_short_code_trgm", "short_code",
+              postgresql_using="gin", postgresql_ops={"short_code": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
 
     def __repr__(self):
-        return (f"Link (id: {self.id}, long_url: {self.long_url}, "
+        return (f"Link (id: {self.id}, destination_id: {self.destination_id}, "
                 f"short_code: {self.short_code}, created_at: {self.created_at})")
 
 
+class Domain(Base):
+    """Short domain the links are served under, resolved from the Host header of redirects"""
+    __tablename__ = "domains"
+
+    # the default domain is written with its id, generated ones start after it
+    id: Mapped[int] = mapped_column(Identity(start=DEFAULT_DOMAIN_ID + 1), primary_key=True)
+    host: Mapped[str] = mapped_column(String(253), unique=True)
+    # short URLs of the domain are rendered as base_url + short_code
+    base_url: Mapped[str] = mapped_column(String(2048))
+
+    def __repr__(self):
+        return f"Domain (id: {self.id}, host: {self.host}, base_url: {self.base_url})"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -33,7 +110,76 @@ class User(Base):
     fullname: Mapped[str] = mapped_column(String)
     hasshed_password: Mapped[str] = mapped_column(String)
 
-    short_urls: Mapped[list["ShortURL"]] = relationship(back_populates="user")
+    short_urls: Mapped[list["ShortURL"]] = relationship(
+        back_populates="user", primaryjoin="User.id == foreign(ShortURL.user_id)"
+    )
 
     def __repr__(self):
         return f"Link (id: {self.id}, username: {self.username}, fullname: {self.fullname})"
+
+
+class UserLinkSummary(Base):
+    """Per-user link aggregates, maintained along with the links themselves (on every shard)"""
+    __tablename__ = "user_link_summaries"
+
+    user_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    total_links: Mapped[int] = mapped_column(default=0)
+    active_links: Mapped[int] = mapped_column(default=0)
+    total_clicks: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self):
+        return (f"Summary (user_id: {self.user_id}, total_links: {self.total_links}, "
+                f"active_links: {self.active_links}, total_clicks: {self.total_clicks})")
+
+
+class LinkExpirySweep(Base):
+    """Single row: links that expired up to swept_until are already excluded from active_links"""
+    __tablename__ = "link_expiry_sweep"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    swept_until: Mapped[datetime] = mapped_column(UTCDateTime)
+
+
+class HotLink(Base):
+    """Most clicked short codes as last seen by the workers, used to warm up new ones"""
+    __tablename__ = "hot_links"
+
+    domain_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    short_code: Mapped[str] = mapped_column(String, primary_key=True)
+    estimated_clicks: Mapped[int] = mapped_column(default=0)
+    updated_at: Mapped[datetime] = mapped_column(UTCDateTime, index=True)
+
+
+class ClickEvent(Base):
+    """
+    Append-only click log, partitioned by day so that old days are dropped as whole tables.
+    SQLite keeps it as a single table.
+    """
+    __tablename__ = "click_events"
+
+    # a partitioned table needs the partition key in its primary key. PostgreSQL takes ids from
+    # a sequence (BIGSERIAL, see below), identity columns on partitioned tables need 17+. SQLite
+    # has no sequences and doesn't generate ids for a composite primary key (see
+    # operations.insert_click_events)
+    id: Mapped[int] = mapped_column(BigInteger, Sequence("click_events_id_seq"), primary_key=True)
+    occurred_at: Mapped[datetime] = mapped_column(UTCDateTime, primary_key=True)
+    domain_id: Mapped[int] = mapped_column(default=DEFAULT_DOMAIN_ID)
+    short_code: Mapped[str] = mapped_column(String)
+    referrer: Mapped[str | None] = mapped_column(String(2048), nullable=True)
+    user_agent_class: Mapped[str] = mapped_column(String(16))
+    client_ip_prefix: Mapped[str | None] = mapped_column(String(64), nullable=True)
+
+    __table_args__ = (
+        Index("ix_click_events_short_code_occurred_at", "short_code", "occurred_at"),
+        {"postgresql_partition_by": "RANGE (occurred_at)"},
+    )
+
+
+# events COPYed by the click event writer bypass SQLAlchemy, the sequence is also the default of the column
+event.listen(ClickEvent.__table__, "after_create", DDL(
+    "ALTER TABLE click_events ALTER COLUMN id SET DEFAULT nextval('click_events_id_seq')"
+).execute_if(dialect="postgresql"))
+
+
+# tables living on every link shard, the rest stays on the main database only
+SHARDED_TABLES = [Destination.__table__, ShortURL.__table__, UserLinkSummary.__table__, LinkExpirySweep.__table__]
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, HttpUrl, Field, ConfigDict, constr
+from pydantic import BaseModel, HttpUrl, Field, ConfigDict, constr, model_validator
 from datetime import datetime
+from typing import Literal
 
 
 class ShortenRequest(BaseModel):
@@ -19,6 +20,10 @@ class ShortenRequest(BaseModel):
         description="Optional expiration time. If not set, defaults to 3 hours from creation",
         default=None
     )
+    domain: str | None = Field(
+        description="Optional short domain (host) of the link. If not set, the main one is used",
+        default=None
+    )
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -27,7 +32,8 @@ class ShortenRequest(BaseModel):
                     "original_url": "https://www.google.com",
                     "single_use": False,  # defualt value
                     "custom_alias": "search",
-                    "expiration_time": None  # default value
+                    "expiration_time": None,  # default value
+                    "domain": None  # default value
                 }
             ]
         }
@@ -76,6 +82,111 @@ class StatsResponse(BaseModel):
     clicks: int
 
 
+class TopLink(BaseModel):
+    short_code: str
+    clicks: int
+
+
+class LinkSummaryResponse(BaseModel):
+    total_links: int
+    active_links: int
+    total_clicks: int
+    top_links: list[TopLink]
+
+
+class ResolveRequest(BaseModel):
+    short_codes: list[constr(min_length=1, max_length=64)] = Field(
+        description="Short codes to resolve",
+        min_length=1,
+        max_length=1000
+    )
+    domain: str | None = Field(
+        description="Optional short domain (host) of the links. If not set, the main one is used",
+        default=None
+    )
+
+
+class ResolvedLink(BaseModel):
+    short_code: str
+    status: Literal["ok", "expired", "not_found"]
+    long_url: str | None = None
+    expiration_time: datetime | None = None
+
+
+class ResolveResponse(BaseModel):
+    links: list[ResolvedLink] = Field(description="One entry per requested short code, in the same order")
+
+
+class HotLinkResponse(BaseModel):
+    domain_id: int
+    short_code: str
+    estimated_clicks: int = Field(description="Recent clicks, may be overestimated by at most max_error")
+    max_error: int
+    clicks_per_second: float
+
+
+class HotLinksResponse(BaseModel):
+    links: list[HotLinkResponse]
+
+
+class ClickEventCountersResponse(BaseModel):
+    queued: int
+    enqueued: int
+    dropped: int = Field(description="Events dropped because the queue was full")
+    written: int
+    failed: int = Field(description="Events lost because their batch couldn't be written")
+
+
+class DomainRequest(BaseModel):
+    # regex matches a hostname: dot separated labels of alphanumeric symbols or dashes
+    host: constr(pattern=r'^[a-zA-Z0-9-]+(\.[a-zA-Z0-9-]+)*$', max_length=253) = Field(
+        description="Host the short links are served under"
+    )
+    base_url: HttpUrl | None = Field(
+        description="Base of the rendered short URLs. If not set, defaults to https://<host>/",
+        default=None
+    )
+
+
+class DomainResponse(BaseModel):
+    id: int
+    host: str
+    base_url: str
+
+
+class DomainsResponse(BaseModel):
+    domains: list[DomainResponse]
+
+
+class ProfileResponse(BaseModel):
+    id: str
+    started_at: datetime
+    method: str
+    path: str
+    status_code: int | None
+    duration_ms: float
+    reason: Literal["sampled", "requested", "slow"] = Field(
+        description="Why the request was captured, slow ones have no stack samples unless sampled as well"
+    )
+    samples: int = Field(description="Stack samples taken, one per sample_interval_ms")
+    sample_interval_ms: float
+    sql_count: int
+    sql_ms: float = Field(description="Time spent in SQL statements")
+
+
+class ProfilesResponse(BaseModel):
+    profiles: list[ProfileResponse]
+
+
+class ProfiledStatement(BaseModel):
+    statement: str
+    duration_ms: float
+
+
+class ProfileDetailsResponse(ProfileResponse):
+    sql: list[ProfiledStatement] = Field(description="SQL statements in execution order, the first 200")
+
+
 class UserBase(BaseModel):
     """Base model for user related operations"""
     username: str | None = None
@@ -107,13 +218,64 @@ class TokenData(BaseModel):
     username: str
 
 
-class LinkFilters(BaseModel):
-    """Filter model for GET endpoint"""
-    limit: int = 10
-    offset: int = 0
+class LinkPredicate(BaseModel):
+    """Which links of the user, shared by the listing and the bulk operations"""
     max_clicks: int | None = None
     min_clicks: int | None = None
     active: bool | None = None
     one_time_only: bool | None = None
     created_after: datetime | None = None
     created_before: datetime | None = None
+    # case-insensitive substring of the destination URL or the short code
+    q: constr(min_length=1, max_length=2048) | None = None
+
+
+class LinkFilters(LinkPredicate):
+    """Filter model for GET endpoint"""
+    limit: int = 10
+    offset: int = 0
+
+
+class BulkLinksRequest(BaseModel):
+    """Links of the user selected either by their short codes or by filters"""
+    short_codes: list[constr(min_length=1, max_length=64)] | None = Field(
+        description="Short codes of the links",
+        default=None,
+        min_length=1,
+        max_length=10_000
+    )
+    domain: str | None = Field(
+        description="Optional short domain (host) of short_codes. If not set, the main one is used",
+        default=None
+    )
+    filters: LinkPredicate | None = Field(
+        description="Select every link of the user matching these filters instead",
+        default=None
+    )
+
+    @model_validator(mode="after")
+    def check_selection(self):
+        if (self.short_codes is None) == (self.filters is None):
+            raise ValueError("Either short_codes or filters must be set")
+        # one_time_only is not applied by the filters, alone it would select every link too
+        if self.filters is not None and not self.filters.model_dump(exclude_none=True, exclude={"one_time_only"}):
+            raise ValueError("filters must set at least one of " + ", ".join(
+                name for name in LinkPredicate.model_fields if name != "one_time_only"
+            ))
+        return self
+
+
+class BulkExpirationRequest(BulkLinksRequest):
+    expiration_time: datetime = Field(
+        description="New expiration time of the links, a past one expires them right away"
+    )
+
+
+class LinkRef(BaseModel):
+    domain_id: int
+    short_code: str
+
+
+class BulkLinksResponse(BaseModel):
+    count: int = Field(description="Number of affected links")
+    links: list[LinkRef]
@@ -13,9 +13,9 @@ from src.app.core import exceptions
 logger = logging.getLogger(__name__)
 
 
-async def login_user(data: OAuth2PasswordRequestForm, db_conn: AsyncSession) -> dict:
+async def login_user(data: OAuth2PasswordRequestForm) -> dict:
     try:
-        user = await authenticate_user(data.username, data.password, db_conn)
+        user = await authenticate_user(data.username, data.password)
     except SQLAlchemyError as e:
         logger.error(f"Unsuccessful attempt to log in by: {data.username}")
         raise exceptions.UserNotFoundError("User not found") from e
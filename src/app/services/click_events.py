@@ -0,0 +1,170 @@
+"""
+Per-click analytics events.
+
+Redirects only put events into a bounded in-memory queue, a background
+consumer drains it and writes whole batches at once (COPY when the raw
+asyncpg pool is up). When the queue is full the event is dropped and
+counted, a redirect never waits for analytics.
+"""
+
+from datetime import datetime, timezone, timedelta
+from ipaddress import ip_network, AddressValueError, NetmaskValueError
+import asyncio
+import logging
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app.core.db import lookup
+from src.app.core.db.database import open_session
+from src.app.core.settings import app_settings
+from src.app.crud import operations
+
+logger = logging.getLogger(__name__)
+
+_BOT_MARKERS = ("bot", "crawler", "spider", "preview", "curl", "wget", "python-requests", "httpx")
+
+
+def classify_user_agent(user_agent: str | None) -> str:
+    if not user_agent:
+        return "unknown"
+    user_agent = user_agent.lower()
+    if any(marker in user_agent for marker in _BOT_MARKERS):
+        return "bot"
+    if "ipad" in user_agent or "tablet" in user_agent:
+        return "tablet"
+    if "mobi" in user_agent or "android" in user_agent or "iphone" in user_agent:
+        return "mobile"
+    if "mozilla" in user_agent:
+        return "desktop"
+    return "other"
+
+
+def client_ip_prefix(host: str | None) -> str | None:
+    """Network of the client (/24 for IPv4, /48 for IPv6), the full address is never stored"""
+    if not host:
+        return None
+    try:
+        prefix = 24 if ":" not in host else 48
+        return str(ip_network(f"{host}/{prefix}", strict=False))
+    except (ValueError, AddressValueError, NetmaskValueError):
+        return None
+
+
+def build_event(
+        domain_id: int, short_code: str, referrer: str | None, user_agent: str | None, client_host: str | None
+) -> tuple:
+    """Event tuple ordered as operations.CLICK_EVENT_COLUMNS"""
+    return (
+        datetime.now(timezone.utc),
+        domain_id,
+        short_code,
+        referrer[:2048] if referrer else None,
+        classify_user_agent(user_agent),
+        client_ip_prefix(client_host),
+    )
+
+
+class ClickEventQueue:
+    def __init__(self, maxsize: int, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue[tuple] = asyncio.Queue(maxsize=maxsize)
+        self._task: asyncio.Task | None = None
+        # events already taken from the queue but not written yet
+        self._batch: list[tuple] = []
+        self._writing: asyncio.Future | None = None
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    def enqueue(self, event: tuple) -> bool:
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def counters(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+    async def _fill_batch(self):
+        """Wait for the first event, then collect more until the batch is full or flush interval passes"""
+        self._batch.append(await self._queue.get())
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+        while len(self._batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                self._batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _write(self, batch: list[tuple]):
+        try:
+            if lookup.is_ready():
+                await lookup.copy_records("click_events", operations.CLICK_EVENT_COLUMNS, batch)
+            else:
+                async with open_session() as db:
+                    await operations.insert_click_events(db, batch)
+        except (SQLAlchemyError, *lookup.LOOKUP_ERRORS):
+            # analytics are best effort, the batch is lost but the consumer keeps going
+            self.failed += len(batch)
+            logger.exception(f"Unable to write {len(batch)} click events")
+            return
+        self.written += len(batch)
+
+    async def _consume(self):
+        while True:
+            await self._fill_batch()
+            batch, self._batch = self._batch, []
+            # stopping the consumer must not interrupt a write half way
+            self._writing = asyncio.ensure_future(self._write(batch))
+            await asyncio.shield(self._writing)
+
+    def start(self):
+        self._task = asyncio.create_task(self._consume(), name="click-events")
+
+    async def stop(self):
+        """Stop the consumer and flush whatever is still queued"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._writing is not None:
+            await self._writing
+        batch, self._batch = self._batch, []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        for start in range(0, len(batch), self.batch_size):
+            await self._write(batch[start:start + self.batch_size])
+
+
+click_events = ClickEventQueue(
+    maxsize=app_settings.CLICK_EVENTS_QUEUE_SIZE,
+    batch_size=app_settings.CLICK_EVENTS_BATCH_SIZE,
+    flush_interval=app_settings.CLICK_EVENTS_FLUSH_INTERVAL,
+)
+
+
+async def maintain_partitions(db: AsyncSession):
+    """Create partitions for the coming days and drop the ones past retention"""
+    today = datetime.now(timezone.utc).date()
+    await operations.create_click_event_partitions(
+        db, today - timedelta(days=1), app_settings.CLICK_EVENTS_PARTITIONS_AHEAD + 2
+    )
+    dropped = await operations.drop_click_event_partitions(
+        db, today - timedelta(days=app_settings.CLICK_EVENTS_RETENTION_DAYS)
+    )
+    if dropped:
+        logger.info(f"Dropped click event partitions: {', '.join(dropped)}")
@@ -0,0 +1,95 @@
+"""
+Short domains the links are served under.
+
+Redirects resolve their Host header to a domain without a database query: every
+worker keeps the (small) domains table in memory. The worker that adds a domain
+reloads it right away, the others within DOMAINS_REFRESH_INTERVAL. Hosts that
+aren't in the table are served as the default domain, which follows SERVICE_URL.
+"""
+
+from os import getenv
+from urllib.parse import urlsplit
+import logging
+
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app.core import exceptions
+from src.app.crud import operations
+from src.app.models.models import DEFAULT_DOMAIN_ID
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_host(host: str) -> str:
+    """Host header without the port, lowercase"""
+    host = host.strip().lower()
+    if host.startswith("["):
+        # IPv6 literal
+        return host.partition("]")[0] + "]"
+    return host.partition(":")[0].rstrip(".")
+
+
+class DomainTable:
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+        self._domains: dict[int, tuple[str, str]] = {}
+
+    def load(self, rows):
+        """rows are (id, host, base_url), the table is swapped as a whole"""
+        self._domains = {domain_id: (host, base_url) for domain_id, host, base_url in rows}
+        self._ids = {host: domain_id for domain_id, (host, _) in self._domains.items()}
+
+    def get_id(self, host: str) -> int | None:
+        return self._ids.get(normalize_host(host))
+
+    def resolve(self, host: str | None) -> int:
+        """Domain of a redirect by its Host header"""
+        if not host:
+            return DEFAULT_DOMAIN_ID
+        return self._ids.get(normalize_host(host), DEFAULT_DOMAIN_ID)
+
+    def base_url(self, domain_id: int) -> str:
+        domain = self._domains.get(domain_id)
+        return domain[1] if domain is not None else getenv("SERVICE_URL")
+
+    def all(self) -> list[dict]:
+        return [
+            {"id": domain_id, "host": host, "base_url": base_url}
+            for domain_id, (host, base_url) in sorted(self._domains.items())
+        ]
+
+
+domains = DomainTable()
+
+
+async def refresh(db: AsyncSession):
+    domains.load(await operations.get_domains(db))
+
+
+async def setup(db: AsyncSession):
+    """Keep the default domain in line with SERVICE_URL and load the table"""
+    service_url = getenv("SERVICE_URL")
+    try:
+        if service_url:
+            await operations.save_default_domain(db, normalize_host(urlsplit(service_url).netloc), service_url)
+        await refresh(db)
+    except SQLAlchemyError:
+        logger.exception("Unable to load the domains, links are served under SERVICE_URL only")
+
+
+async def create_domain(host: str, base_url: str | None, db: AsyncSession) -> dict:
+    host = normalize_host(host)
+    base_url = base_url or f"https://{host}/"
+    if not base_url.endswith("/"):
+        base_url += "/"
+    try:
+        domain = await operations.create_domain(db, host, base_url)
+    except IntegrityError as e:
+        raise exceptions.DomainAlreadyExists(host) from e
+    except SQLAlchemyError as e:
+        logger.exception(f"Unable to create domain {host}")
+        raise exceptions.ShortUrlServiceUnavailable() from e
+    await refresh(db)
+    logger.info(f"Domain created: {domain}")
+    return {"id": domain.id, "host": domain.host, "base_url": domain.base_url}
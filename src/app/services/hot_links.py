@@ -0,0 +1,133 @@
+"""
+Tracking of the most clicked short codes.
+
+The redirect path feeds every lookup into a bounded Space-Saving sketch.
+It decides which links are admitted into the in-process lookup cache, the
+hottest ones are persisted periodically so fresh workers warm their cache up
+on startup instead of starting cold. Cached links pointing to the same URL share
+one interned destination, the cache grows with the number of distinct URLs rather
+than with the number of links.
+"""
+
+from datetime import datetime, timedelta
+from weakref import WeakValueDictionary
+import logging
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app.core.settings import app_settings
+from src.app.core.utils.cache import TTLCache
+from src.app.core.utils.heavy_hitters import SpaceSaving
+from src.app.crud import operations
+
+logger = logging.getLogger(__name__)
+
+
+class CachedDestination:
+    __slots__ = ("url", "__weakref__")
+
+    def __init__(self, url: str):
+        self.url = url
+
+
+# (destination, created_at, expiration_time) by (domain_id, short_code)
+link_cache = TTLCache(maxsize=app_settings.LINK_CACHE_SIZE, ttl=app_settings.LINK_CACHE_TTL)
+# destinations of the cached links by URL, an entry goes away with the last link holding it
+_destinations: WeakValueDictionary[str, CachedDestination] = WeakValueDictionary()
+
+
+def cache_link(link: tuple[int, str], long_url: str, created_at: datetime, expiration_time: datetime | None):
+    destination = _destinations.get(long_url)
+    if destination is None:
+        destination = _destinations[long_url] = CachedDestination(long_url)
+    link_cache.put(link, (destination, created_at, expiration_time))
+
+
+def cached_link(link: tuple[int, str]) -> tuple[str, datetime, datetime | None] | None:
+    """(long_url, created_at, expiration_time) of (domain_id, short_code) OR None, if it's not cached"""
+    cached = link_cache.get(link)
+    if cached is None:
+        return None
+    destination, created_at, expiration_time = cached
+    return destination.url, created_at, expiration_time
+
+
+class HotLinkTracker:
+    """
+    Recent click counts of the most clicked links.
+
+    Counters are halved at the end of every window, so with a steady click rate
+    they hold about one window of history plus the current window.
+    """
+
+    def __init__(self, capacity: int, window: int, min_clicks: int):
+        self.sketch = SpaceSaving(capacity)
+        self.window = window
+        self.min_clicks = min_clicks
+        self.window_started = time.monotonic()
+
+    def record(self, link: tuple[int, str]) -> bool:
+        """Count a click of (domain_id, short_code), returns whether the link is hot enough to be cached"""
+        self.sketch.add(link)
+        return self.sketch.guaranteed(link) >= self.min_clicks
+
+    def seed(self, link: tuple[int, str], clicks: float):
+        self.sketch.add(link, clicks)
+
+    def rotate(self):
+        self.sketch.decay(0.5)
+        self.window_started = time.monotonic()
+
+    def top(self, k: int) -> list[dict]:
+        # decayed counters stand for about one window worth of clicks
+        elapsed = self.window + (time.monotonic() - self.window_started)
+        return [
+            {
+                "domain_id": domain_id,
+                "short_code": code,
+                "estimated_clicks": round(clicks),
+                "max_error": round(error),
+                "clicks_per_second": clicks / elapsed,
+            }
+            for (domain_id, code), clicks, error in self.sketch.top(k)
+        ]
+
+
+tracker = HotLinkTracker(
+    capacity=app_settings.HOT_LINKS_CAPACITY,
+    window=app_settings.HOT_LINKS_WINDOW,
+    min_clicks=app_settings.HOT_LINKS_MIN_CLICKS,
+)
+
+
+async def warm_up(db: AsyncSession):
+    """Seed the tracker and fill the cache from the persisted hot set"""
+    try:
+        hot_links = await operations.get_hot_links(
+            db, app_settings.HOT_LINKS_WARMUP, fresher_than=timedelta(seconds=10 * tracker.window)
+        )
+        if not hot_links:
+            return
+        links = await operations.get_links_by_codes(db, [(domain_id, code) for domain_id, code, _ in hot_links])
+    except SQLAlchemyError:
+        logger.exception("Unable to warm up the link cache, starting cold")
+        return
+
+    for domain_id, code, clicks in hot_links:
+        tracker.seed((domain_id, code), clicks)
+    for domain_id, code, long_url, created_at, expiration_time in links:
+        cache_link((domain_id, code), long_url, created_at, expiration_time)
+    logger.info(f"Link cache warmed up with {len(links)} hot links")
+
+
+async def persist_and_rotate(db: AsyncSession):
+    """Close the current window and persist its hottest links"""
+    hot_links = [
+        (link["domain_id"], link["short_code"], link["estimated_clicks"])
+        for link in tracker.top(app_settings.HOT_LINKS_WARMUP)
+        if link["estimated_clicks"] >= tracker.min_clicks
+    ]
+    tracker.rotate()
+    await operations.save_hot_links(db, hot_links, keep_for=timedelta(seconds=10 * tracker.window))
@@ -0,0 +1,132 @@
+"""
+Serving redirects while the database is unreachable.
+
+Every worker refreshes a local snapshot file of the active links: appending
+links newer than the high-water mark of their shard, and rewriting it from scratch now and
+then. Redirects fall back to the snapshot when the database can't be reached,
+their clicks are kept in memory and replayed once it is back.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+from typing import AsyncIterator
+import asyncio
+import fcntl
+import logging
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app.core.db import lookup, sharding
+from src.app.core.db.snapshot import LinkSnapshot, SnapshotWriter, record_key
+from src.app.core.settings import app_settings
+from src.app.crud import operations
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 10_000
+
+snapshot = LinkSnapshot(app_settings.LINK_SNAPSHOT_PATH)
+# clicks that couldn't be written, by (domain_id, short_code)
+pending_clicks: Counter[tuple[int, str]] = Counter()
+
+
+def load():
+    try:
+        snapshot.load()
+    except (OSError, ValueError):
+        logger.exception(f"Unable to load link snapshot {snapshot.path}")
+        return
+    logger.info(f"Link snapshot loaded with {len(snapshot)} links")
+
+
+def get(domain_id: int, short_code: str) -> tuple | None:
+    return snapshot.get(domain_id, short_code)
+
+
+@contextmanager
+def _write_lock():
+    """Yields whether this worker got to write the snapshot, never blocks the event loop"""
+    with open(f"{snapshot.path}.lock", "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # another worker of the instance is refreshing it right now
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+async def _active_link_pages(db: AsyncSession, high_water_marks: dict[int, int]) -> AsyncIterator[list[tuple]]:
+    """Snapshot rows of the active links above the high-water mark of their shard, PAGE_SIZE at a time"""
+    for shard in sharding.shard_ids():
+        session = sharding.session_for_shard(db, shard)
+        after_id = high_water_marks.get(shard, 0)
+        while True:
+            page = await operations.get_active_links_after(session, after_id, PAGE_SIZE)
+            yield [(record_key(shard, link_id), *rest) for link_id, *rest in page]
+            if len(page) < PAGE_SIZE:
+                break
+            after_id = page[-1].id
+
+
+async def _write(writer: SnapshotWriter, pages: AsyncIterator[list[tuple]]):
+    """Writes the pages as they are fetched, only one is held in memory and the file isn't touched on the event loop"""
+    try:
+        async for page in pages:
+            await asyncio.to_thread(writer.write, page)
+    except BaseException:
+        # closing the file doesn't wait for the disk
+        writer.abort()
+        raise
+    await asyncio.to_thread(writer.commit)
+
+
+async def _reload():
+    snapshot.apply(await asyncio.to_thread(snapshot.scan))
+
+
+async def replay_clicks(db: AsyncSession):
+    while pending_clicks:
+        (domain_id, short_code), count = pending_clicks.popitem()
+        try:
+            await operations.update_short_link_clicks(db, domain_id, short_code, count)
+        except ValueError:
+            # the link was deleted in the meantime
+            continue
+        except (SQLAlchemyError, *lookup.LOOKUP_ERRORS):
+            pending_clicks[domain_id, short_code] += count
+            raise
+    logger.info("Pending clicks replayed")
+
+
+async def refresh(db: AsyncSession):
+    try:
+        if pending_clicks:
+            await replay_clicks(db)
+        with _write_lock() as acquired:
+            # otherwise another worker of the instance is writing it, its changes are loaded below
+            if acquired:
+                # pick up what the other workers wrote
+                await _reload()
+                rebuild_due = (
+                    snapshot.built_at is None
+                    or snapshot.torn
+                    or datetime.now(timezone.utc) - snapshot.built_at
+                    > timedelta(seconds=app_settings.LINK_SNAPSHOT_REBUILD_INTERVAL)
+                )
+                if rebuild_due:
+                    await _write(await asyncio.to_thread(snapshot.rewriter), _active_link_pages(db, {}))
+                else:
+                    await _write(
+                        await asyncio.to_thread(snapshot.appender),
+                        _active_link_pages(db, snapshot.high_water_marks),
+                    )
+        # other workers' appends are picked up on the next refresh
+        await _reload()
+    except (OSError, ValueError):
+        logger.exception(f"Unable to refresh link snapshot {snapshot.path}")
@@ -0,0 +1,158 @@
+"""
+Live click counts of links for dashboards (Server-Sent Events).
+
+Every watched link has one channel shared by all of its viewers. Redirects only
+leave the count their click wrote, a ticker publishes the changed counts once per
+LIVE_CLICKS_TICK and wakes up the viewers of those links, so the cost doesn't grow
+with the number of open dashboards and none of them queries the database. Clicks
+served by other workers, and links deleted there, are picked up by a resync job:
+one query for all the links watched in this worker.
+
+Counts only ever grow and both sources carry whole counts read from the database,
+not increments, so a channel keeps the highest one it has seen: a click landing
+while the resync reads is never added twice.
+"""
+
+from typing import AsyncIterator
+import asyncio
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app.core.settings import app_settings
+from src.app.crud import operations
+
+logger = logging.getLogger(__name__)
+
+
+class _Channel:
+    __slots__ = ("clicks", "viewers", "updated", "closed", "deleted")
+
+    def __init__(self, clicks: int):
+        self.clicks = clicks
+        self.viewers = 0
+        # set (and replaced) every time the channel changes
+        self.updated = asyncio.Event()
+        self.closed = False
+        self.deleted = False
+
+    def notify(self):
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+
+class ClickBroadcaster:
+    def __init__(self, tick: float, keepalive: float):
+        self.tick = tick
+        self.keepalive = keepalive
+        # by (domain_id, short_code)
+        self._channels: dict[tuple[int, str], _Channel] = {}
+        # latest click count written by this worker, by (domain_id, short_code)
+        self._pending: dict[tuple[int, str], int] = {}
+        self._task: asyncio.Task | None = None
+
+    def __len__(self):
+        return len(self._channels)
+
+    def viewers(self) -> int:
+        return sum(channel.viewers for channel in self._channels.values())
+
+    def record(self, link: tuple[int, str], clicks: int):
+        """A click of (domain_id, short_code) set its count to clicks, nearly free when nobody watches the link"""
+        if link in self._channels and clicks > self._pending.get(link, 0):
+            self._pending[link] = clicks
+
+    async def watch(self, link: tuple[int, str], clicks: int) -> AsyncIterator[int | None]:
+        """
+        Click counts of a link: the current one, then one per tick it changed in.
+
+        The count is repeated every `keepalive` seconds without changes, so proxies
+        don't close the idle connection. Yields None and stops once the link is deleted.
+        """
+        channel = self._channels.get(link)
+        if channel is None:
+            channel = self._channels[link] = _Channel(clicks)
+        channel.viewers += 1
+        try:
+            clicks = channel.clicks
+            yield clicks
+            while True:
+                updated = channel.updated
+                try:
+                    await asyncio.wait_for(updated.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield clicks
+                    continue
+                if channel.closed:
+                    if channel.deleted:
+                        yield None
+                    return
+                if channel.clicks != clicks:
+                    clicks = channel.clicks
+                    yield clicks
+        finally:
+            channel.viewers -= 1
+            if not channel.viewers and self._channels.get(link) is channel:
+                del self._channels[link]
+                self._pending.pop(link, None)
+
+    def close(self, link: tuple[int, str], deleted: bool = True):
+        """End the streams of a link, `deleted` tells the viewers the link is gone"""
+        channel = self._channels.pop(link, None)
+        self._pending.pop(link, None)
+        if channel is not None:
+            channel.closed = True
+            channel.deleted = deleted
+            channel.notify()
+
+    def publish(self):
+        pending, self._pending = self._pending, {}
+        for link, clicks in pending.items():
+            channel = self._channels.get(link)
+            if channel is not None and clicks > channel.clicks:
+                channel.clicks = clicks
+                channel.notify()
+
+    async def resync(self, db: AsyncSession):
+        """Set the counts of the watched links to the ones in the database"""
+        if not self._channels:
+            return
+        watched = dict(self._channels)
+        rows = await operations.get_clicks_by_codes(db, list(watched))
+        clicks_by_link = {(domain_id, code): clicks for domain_id, code, clicks in rows}
+        for link, channel in watched.items():
+            if self._channels.get(link) is not channel:
+                # nobody watches it anymore
+                continue
+            clicks = clicks_by_link.get(link)
+            if clicks is None:
+                logger.info(f"Watched link {link} no longer exists, closing its streams")
+                self.close(link)
+            elif clicks > channel.clicks:
+                # a lower count was read before clicks this worker already published
+                channel.clicks = clicks
+                channel.notify()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.publish()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="live-clicks")
+
+    async def stop(self):
+        """Stop the ticker and end every open stream"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for link in list(self._channels):
+            self.close(link, deleted=False)
+
+
+broadcaster = ClickBroadcaster(tick=app_settings.LIVE_CLICKS_TICK, keepalive=app_settings.LIVE_CLICKS_KEEPALIVE)
+
+
+async def resync(db: AsyncSession):
+    await broadcaster.resync(db)
@@ -0,0 +1,71 @@
+"""
+Background jobs started from the application lifespan.
+
+Includes:
+- Expiry sweep of the user link summaries
+- Optional reconciliation of the user link summaries
+- Rotation and persistence of the hot links
+- Daily partitions of the click events
+- Local snapshot of the links
+- Reload of the domains table
+- Resync of the live click counts
+- Prune of the destinations left without links
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.app.core.db import sharding
+from src.app.core.db.database import open_session
+from src.app.core.settings import app_settings
+from src.app.crud import operations
+from src.app.services import hot_links, click_events, link_snapshot, domains, live_clicks
+
+logger = logging.getLogger(__name__)
+
+
+async def _run_periodically(name: str, interval: int, job: Callable[[AsyncSession], Awaitable]):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with open_session() as db:
+                await job(db)
+        except Exception:
+            # the next run retries, the loop must outlive any failure of a single run
+            logger.exception(f"Background job {name} failed")
+
+
+def _on_every_shard(job: Callable[[AsyncSession], Awaitable]) -> Callable[[AsyncSession], Awaitable]:
+    async def run(db: AsyncSession):
+        for shard in sharding.shard_ids():
+            await job(sharding.session_for_shard(db, shard))
+    return run
+
+
+def start_jobs() -> list[asyncio.Task]:
+    jobs = [
+        ("summary-sweep", app_settings.SUMMARY_SWEEP_INTERVAL, _on_every_shard(operations.sweep_expired_links)),
+        ("summary-reconcile", app_settings.SUMMARY_RECONCILE_INTERVAL,
+         _on_every_shard(operations.reconcile_link_summaries)),
+        ("hot-links", app_settings.HOT_LINKS_WINDOW, hot_links.persist_and_rotate),
+        ("click-event-partitions", app_settings.CLICK_EVENTS_MAINTENANCE_INTERVAL, click_events.maintain_partitions),
+        ("link-snapshot", app_settings.LINK_SNAPSHOT_INTERVAL, link_snapshot.refresh),
+        ("domains", app_settings.DOMAINS_REFRESH_INTERVAL, domains.refresh),
+        ("live-clicks-resync", app_settings.LIVE_CLICKS_RESYNC_INTERVAL, live_clicks.resync),
+        ("destinations-prune", app_settings.DESTINATIONS_PRUNE_INTERVAL,
+         _on_every_shard(operations.prune_destinations)),
+    ]
+    return [
+        asyncio.create_task(_run_periodically(name, interval, job), name=name)
+        for name, interval, job in jobs
+        if interval > 0
+    ]
+
+
+async def stop_jobs(tasks: list[asyncio.Task]):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
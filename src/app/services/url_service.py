@@ -1,23 +1,89 @@
-from sqlalchemy.exc import SQLAlchemyError
+from typing import AsyncIterator
+from sqlalchemy import Row
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import datetime, timedelta, timezone
-from os import getenv
+from datetime import datetime, timezone
 import logging
 
-from src.app.models import ShortURL
-from src.app.schemas import ShortenRequest, UserResponse, LinkFilters
+from src.app.schemas import ShortenRequest, UserResponse, LinkFilters, BulkLinksRequest, BulkExpirationRequest
 from src.app.crud import operations
+from src.app.core.db import lookup, sharding
+from src.app.core.db.database import open_session
+from src.app.core.settings import app_settings
+from src.app.core.utils.cache import TTLCache
+from src.app.core.utils.single_flight import SingleFlight
+from src.app.services.hot_links import tracker, link_cache, cache_link, cached_link
+from src.app.services import link_snapshot
+from src.app.services.live_clicks import broadcaster
+from src.app.services.domains import domains
+from src.app.models.models import ShortURL, DEFAULT_DOMAIN_ID, LINK_DEFAULT_LIFETIME
 from src.app.core.utils.url import generate_short_code
 from src.app.core import exceptions
 
 logger = logging.getLogger(__name__)
 
+TOP_LINKS_LIMIT = 5
+
+# cache misses of a popular link arrive together, they share one query
+link_lookups = SingleFlight(timeout=app_settings.SINGLE_FLIGHT_TIMEOUT)
+# destination ids by (shard, url hash), new links to a known URL skip the destination lookup
+destination_ids = TTLCache(maxsize=app_settings.DESTINATION_CACHE_SIZE, ttl=app_settings.DESTINATION_CACHE_TTL)
+
+
+async def _query_link(domain_id: int, short_code: str) -> tuple | None:
+    """(long_url, created_at, expiration_time) through the prepared lookup when its pool is up"""
+    if lookup.is_ready():
+        return await lookup.get_link(domain_id, short_code)
+    # a session of its own, the request that started the lookup may give up on it
+    async with open_session() as db:
+        return await operations.get_link_target(db, domain_id, short_code)
+
+
+async def _find_link(domain_id: int, short_code: str) -> tuple | None:
+    return await link_lookups.do((domain_id, short_code), lambda: _query_link(domain_id, short_code))
+
+
+async def _is_code_taken(domain_id: int, short_code: str, db: AsyncSession) -> bool:
+    if lookup.is_ready():
+        return await lookup.code_exists(domain_id, short_code)
+    return await operations.get_link_by_code(db, domain_id, short_code) is not None
+
+
+def domain_id_of(host: str | None) -> int:
+    """Domain a link is addressed under by the API, the default one when host is not given"""
+    if host is None:
+        return DEFAULT_DOMAIN_ID
+    domain_id = domains.get_id(host)
+    if domain_id is None:
+        raise exceptions.DomainNotFound(host)
+    return domain_id
+
+
+async def _create_link(
+        db: AsyncSession, original_url: str, short_code: str, owner_id: int, expiration: datetime, domain_id: int
+) -> ShortURL:
+    destination_key = (sharding.shard_for_code(short_code), operations.destination_hash(original_url))
+    try:
+        link = await operations.create_short_link(
+            db, original_url, short_code, owner_id, expiration, domain_id, destination_ids.get(destination_key)
+        )
+    except IntegrityError:
+        # the destination was pruned since it was looked up (see operations.prune_destinations)
+        await sharding.session_for_code(db, short_code).rollback()
+        destination_ids.invalidate(destination_key)
+        link = await operations.create_short_link(db, original_url, short_code, owner_id, expiration, domain_id)
+
+    # only once committed, a rolled back destination must not be reused
+    destination_ids.put(destination_key, link.destination_id)
+    return link
+
 
 async def create_short_url(data: ShortenRequest, current_user: UserResponse, d_conn: AsyncSession) -> dict:
-    expiration = data.expiration_time or (datetime.now(timezone.utc) + timedelta(hours=3))
+    expiration = data.expiration_time or (datetime.now(timezone.utc) + LINK_DEFAULT_LIFETIME)
+    domain_id = domain_id_of(data.domain)
 
     if data.custom_alias:
-        if await operations.get_link_by_code(d_conn, data.custom_alias):
+        if await _is_code_taken(domain_id, data.custom_alias, d_conn):
             raise exceptions.CustomAliasAlreadyExists()
         short_code = data.custom_alias
     else:
@@ -25,7 +91,7 @@ async def create_short_url(data: ShortenRequest, current_user: UserResponse, d_c
         for _ in range(20):
             candidate = generate_short_code(str(data.original_url))
             logger.debug(f"Looking for the candidate short code: {candidate} (user={current_user.username})")
-            if not await operations.get_link_by_code(d_conn, candidate):
+            if not await _is_code_taken(domain_id, candidate, d_conn):
                 short_code = candidate
                 break
         else:
@@ -33,13 +99,7 @@ async def create_short_url(data: ShortenRequest, current_user: UserResponse, d_c
             # which is highly unlikely, then service unavailable will be raised
             raise exceptions.ShortUrlServiceUnavailable()
     try:
-        link = await operations.create_short_link(
-            d_conn,
-            original_url=str(data.original_url),
-            short_code=short_code,
-            owner_id=current_user.id,
-            expiration=expiration,
-        )
+        link = await _create_link(d_conn, str(data.original_url), short_code, current_user.id, expiration, domain_id)
     except SQLAlchemyError:
         logger.exception(f"Error generating short code for link: {data.original_url} by user: {current_user.username}")
         raise exceptions.ShortUrlServiceUnavailable()
@@ -47,7 +107,7 @@ async def create_short_url(data: ShortenRequest, current_user: UserResponse, d_c
     logger.info(f"Short URL successfully created for link: {link} (user={current_user.username})")
 
     return {
-        "short_url": f"{getenv('SERVICE_URL')}{short_code}",
+        "short_url": f"{domains.base_url(domain_id)}{short_code}",
         "short_code": short_code,
         "created_at": link.created_at,
         "expiration_time": link.expiration_time,
@@ -55,42 +115,118 @@ async def create_short_url(data: ShortenRequest, current_user: UserResponse, d_c
     }
 
 
-async def get_original_url(short_code: str, db: AsyncSession) -> str:
-    try:
-        original_url = await operations.get_link_by_code(db, short_code)
-    except SQLAlchemyError as e:
-        logger.exception(f"Database error while fetching short_code={short_code}")
-        raise exceptions.ShortUrlServiceUnavailable() from e
+def _is_expired(created_at: datetime, expiration_time: datetime | None, now: datetime) -> bool:
+    if expiration_time is not None:
+        return expiration_time < now
+    return (now - created_at) > LINK_DEFAULT_LIFETIME
 
-    if original_url is None:
+
+async def get_original_url(domain_id: int, short_code: str) -> str:
+    link = cached_link((domain_id, short_code))
+    found_in_cache = link is not None
+    if link is None:
+        try:
+            link = await _find_link(domain_id, short_code)
+        except (SQLAlchemyError, *lookup.LOOKUP_ERRORS) as e:
+            link = link_snapshot.get(domain_id, short_code)
+            if link is None:
+                logger.exception(f"Database error while fetching short_code={short_code}")
+                raise exceptions.ShortUrlServiceUnavailable() from e
+            logger.warning(f"Database unavailable, short_code={short_code} served from the local snapshot")
+
+    if link is None:
         logger.warning(f"No URL found for short_code={short_code}")
         raise exceptions.ShortUrlNotFound(short_code)
-    now = datetime.now(timezone.utc)
-    if original_url.expiration_time is not None:
-        if original_url.expiration_time < now:
-            logger.warning(f"Short URL with the short_code={short_code} expired")
-            raise exceptions.ShortUrlExpired()
-    elif (now - original_url.created_at) > timedelta(hours=3):
+    long_url, created_at, expiration_time = link
+    if _is_expired(created_at, expiration_time, datetime.now(timezone.utc)):
         logger.warning(f"Short URL with the short_code={short_code} expired")
         raise exceptions.ShortUrlExpired()
 
-    return original_url.long_url
+    # only redirects count, unknown and expired codes would crowd the hot links out
+    if tracker.record((domain_id, short_code)) and not found_in_cache:
+        cache_link((domain_id, short_code), *link)
+    return long_url
+
+
+async def resolve_links(domain_id: int, short_codes: list[str], db: AsyncSession) -> list[dict]:
+    """
+    Destinations of many short codes at once, in the order of short_codes.
+
+    Cached links are answered from the lookup cache, the others with one query per shard.
+    Resolving is not a click: neither the hot link tracker nor the click counters see it.
+    """
+    links = {}
+    missing = []
+    for code in dict.fromkeys(short_codes):
+        link = cached_link((domain_id, code))
+        if link is None:
+            missing.append(code)
+        else:
+            links[code] = link
+
+    if missing:
+        try:
+            rows = await operations.get_links_by_codes(db, [(domain_id, code) for code in missing])
+        except (SQLAlchemyError, *lookup.LOOKUP_ERRORS) as e:
+            if not link_snapshot.snapshot:
+                logger.exception(f"Database error while resolving {len(missing)} short codes")
+                raise exceptions.ShortUrlServiceUnavailable() from e
+            logger.warning(f"Database unavailable, {len(missing)} short codes resolved from the local snapshot")
+            rows = [
+                (domain_id, code, *link)
+                for code in missing
+                if (link := link_snapshot.get(domain_id, code)) is not None
+            ]
+        for _, code, long_url, created_at, expiration_time in rows:
+            links[code] = (long_url, created_at, expiration_time)
+
+    now = datetime.now(timezone.utc)
+    resolved = []
+    for code in short_codes:
+        link = links.get(code)
+        if link is None:
+            resolved.append({"short_code": code, "status": "not_found", "long_url": None, "expiration_time": None})
+            continue
+        long_url, created_at, expiration_time = link
+        resolved.append({
+            "short_code": code,
+            "status": "expired" if _is_expired(created_at, expiration_time, now) else "ok",
+            "long_url": long_url,
+            "expiration_time": expiration_time,
+        })
+    return resolved
+
 
+async def collect_statistic(db: AsyncSession, domain_id: int, short_code: str):
+    """
+    Count a click of a link get_original_url has just resolved.
 
-async def collect_statistic(db: AsyncSession, short_code: str):
+    Raises ShortUrlNotFound when the link was deleted in the meantime, e.g. by another
+    worker while this one still had it cached.
+    """
     try:
-        await operations.update_short_link_clicks(db, short_code)
+        link = await operations.update_short_link_clicks(db, domain_id, short_code)
     except ValueError:
-        logger.exception(f"Error collecting statistic short_code={short_code}")
+        logger.warning(f"Short code {short_code} was deleted, dropping it from the lookup cache")
+        link_cache.invalidate((domain_id, short_code))
+        broadcaster.close((domain_id, short_code))
         raise exceptions.ShortUrlNotFound(short_code)
-    except SQLAlchemyError as e:
-        logger.exception(f"Short_code={short_code} not found for collecting statistic")
-        raise exceptions.ShortUrlNotFound(short_code) from e
+    except (SQLAlchemyError, *lookup.LOOKUP_ERRORS):
+        # the destination is already known (possibly from the snapshot), the click is replayed later
+        logger.exception(f"Unable to collect statistic for short_code={short_code}, queued for replay")
+        link_snapshot.pending_clicks[domain_id, short_code] += 1
+        return
+
+    broadcaster.record((domain_id, short_code), link.clicks)
+    cached = cached_link((domain_id, short_code))
+    if cached is not None and cached[2] != link.expiration_time:
+        # expiration changed by another worker, the next redirect looks the link up again
+        link_cache.invalidate((domain_id, short_code))
 
 
-async def get_statistic(short_code: str, current_user: UserResponse, db: AsyncSession) -> dict:
+async def get_statistic(domain_id: int, short_code: str, current_user: UserResponse, db: AsyncSession) -> dict:
     try:
-        original_url = await operations.get_link_by_code(db, short_code)
+        original_url = await operations.get_link_stats(db, domain_id, short_code)
     except SQLAlchemyError as e:
         raise exceptions.ShortUrlNotFound() from e
 
@@ -108,7 +244,15 @@ async def get_statistic(short_code: str, current_user: UserResponse, db: AsyncSe
     }
 
 
-async def get_short_links(filters: LinkFilters, db: AsyncSession, user_id: int) -> list[ShortURL]:
+async def watch_clicks(domain_id: int, short_code: str, current_user: UserResponse) -> AsyncIterator[int | None]:
+    """Live click counts of a link of the user, see services/live_clicks"""
+    # a stream stays open for hours, it must not hold on to a database connection
+    async with open_session() as db:
+        statistic = await get_statistic(domain_id, short_code, current_user, db)
+    return broadcaster.watch((domain_id, short_code), statistic["clicks"])
+
+
+async def get_short_links(filters: LinkFilters, db: AsyncSession, user_id: int) -> list[Row]:
     try:
         links = await operations.get_links(db, filters, user_id)
     except SQLAlchemyError as e:
@@ -116,3 +260,73 @@ async def get_short_links(filters: LinkFilters, db: AsyncSession, user_id: int)
         raise exceptions.ShortUrlServiceUnavailable() from e
 
     return list(links)
+
+
+async def get_link_summary(current_user: UserResponse, db: AsyncSession) -> dict:
+    try:
+        summary = await operations.get_link_summary(db, current_user.id)
+        top_links = await operations.get_top_links(db, current_user.id, TOP_LINKS_LIMIT)
+    except SQLAlchemyError as e:
+        logger.exception(f"Database error while fetching summary (user={current_user.username})")
+        raise exceptions.ShortUrlServiceUnavailable() from e
+
+    # no summary row yet means the user hasn't created any links
+    total_links, active_links, total_clicks = summary or (0, 0, 0)
+    return {
+        "total_links": total_links,
+        "active_links": active_links,
+        "total_clicks": total_clicks,
+        "top_links": [{"short_code": code, "clicks": clicks} for code, clicks in top_links],
+    }
+
+
+async def delete_link(domain_id: int, short_code: str, current_user: UserResponse, db: AsyncSession) -> int | None:
+    """Returns id of the deleted link OR None"""
+    deleted_id = await operations.delete_short_link(db, current_user.id, domain_id, short_code)
+    if deleted_id is not None:
+        link_cache.invalidate((domain_id, short_code))
+        broadcaster.close((domain_id, short_code))
+    return deleted_id
+
+
+def _bulk_links(data: BulkLinksRequest) -> list[tuple[int, str]] | None:
+    if data.short_codes is None:
+        return None
+    domain_id = domain_id_of(data.domain)
+    return [(domain_id, code) for code in dict.fromkeys(data.short_codes)]
+
+
+async def delete_links(data: BulkLinksRequest, current_user: UserResponse, db: AsyncSession) -> list[tuple[int, str]]:
+    """Deletes the user's links selected by short codes or filters, returns (domain_id, short_code) of the deleted"""
+    links = _bulk_links(data)
+    try:
+        deleted = await operations.delete_short_links(db, current_user.id, links=links, filters=data.filters)
+    except SQLAlchemyError as e:
+        logger.exception(f"Database error while deleting links in bulk (user={current_user.username})")
+        raise exceptions.ShortUrlServiceUnavailable() from e
+
+    for link in deleted:
+        link_cache.invalidate(link)
+        broadcaster.close(link)
+    logger.info(f"{len(deleted)} links deleted in bulk (user={current_user.username})")
+    return deleted
+
+
+async def set_links_expiration(
+        data: BulkExpirationRequest, current_user: UserResponse, db: AsyncSession
+) -> list[tuple[int, str]]:
+    """Sets the expiration time of the user's links selected by short codes or filters, returns the updated"""
+    links = _bulk_links(data)
+    try:
+        updated = await operations.update_links_expiration(
+            db, current_user.id, data.expiration_time, links=links, filters=data.filters
+        )
+    except SQLAlchemyError as e:
+        logger.exception(f"Database error while updating expiration of links in bulk (user={current_user.username})")
+        raise exceptions.ShortUrlServiceUnavailable() from e
+
+    # cached links carry their expiration time
+    for link in updated:
+        link_cache.invalidate(link)
+    logger.info(f"Expiration of {len(updated)} links set to {data.expiration_time} (user={current_user.username})")
+    return updated
@@ -0,0 +1,121 @@
+"""
+The tests run against throwaway PostgreSQL databases and are skipped unless
+MINILINK_TEST_DATABASE_URL points to one, e.g.
+
+    MINILINK_TEST_DATABASE_URL=postgresql://postgres@localhost/minilink_test pytest
+
+That database and two link shards next to it (<name>_s1, <name>_s2) are dropped
+and created from scratch, so the name has to end with _test: the run stops right
+away with any other one. The app is configured from that URL alone, whatever
+POSTGRES_* or .env says.
+"""
+
+from datetime import datetime, timezone
+import asyncio
+import os
+import tempfile
+
+import asyncpg
+import pytest
+from sqlalchemy.engine import URL, make_url
+
+TEST_DATABASE_URL = os.environ.get("MINILINK_TEST_DATABASE_URL")
+SHARD_SUFFIXES = ("", "_s1", "_s2")
+
+
+def _database_urls(url: URL) -> list[URL]:
+    return [url.set(database=f"{url.database}{suffix}") for suffix in SHARD_SUFFIXES]
+
+
+async def _recreate_databases(url: URL):
+    conn = await asyncpg.connect(url.set(drivername="postgresql", database="postgres").render_as_string(False))
+    try:
+        for database_url in _database_urls(url):
+            await conn.execute(f'DROP DATABASE IF EXISTS "{database_url.database}" WITH (FORCE)')
+            await conn.execute(f'CREATE DATABASE "{database_url.database}"')
+    finally:
+        await conn.close()
+
+
+def pytest_configure(config):
+    if not TEST_DATABASE_URL:
+        return
+    url = make_url(TEST_DATABASE_URL)
+    if not (url.database or "").endswith("_test"):
+        pytest.exit(
+            f"MINILINK_TEST_DATABASE_URL must name a throwaway database ending with _test, not {url.database!r}: "
+            "the tests drop and recreate it",
+            returncode=pytest.ExitCode.USAGE_ERROR,
+        )
+    asyncio.run(_recreate_databases(url))
+
+    main, *shards = _database_urls(url.set(drivername="postgresql+asyncpg"))
+    os.environ.update(
+        DATABASE_BACKEND="postgresql",
+        POSTGRES_USER=main.username or "postgres",
+        POSTGRES_PASSWORD=main.password or "",
+        POSTGRES_SERVER=main.host or "localhost",
+        POSTGRES_PORT=str(main.port or 5432),
+        POSTGRES_DB=main.database,
+        LINK_SHARD_URLS="[" + ",".join(f'"{shard.render_as_string(False)}"' for shard in shards) + "]",
+        LINK_SHARDS_PREVIOUS_COUNT="0",
+        LINK_SNAPSHOT_PATH=os.path.join(tempfile.mkdtemp(prefix="minilink-test-"), "link_snapshot.bin"),
+        PROFILING_ENABLED="false",
+        SERVICE_URL="http://minilink.test/",
+        SECRET_KEY="test-secret",
+        ALGORITHM="HS256",
+        EXPIRATION="1",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if TEST_DATABASE_URL:
+        return
+    skip = pytest.mark.skip(reason="MINILINK_TEST_DATABASE_URL is not set")
+    for item in items:
+        item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+async def schema():
+    # imported once the environment points to the test databases
+    import src.app.core.utils  # noqa: F401
+    from src.app.core.db.database import shard_engines
+    from src.app.core.db.init_db import init_db
+
+    await init_db()
+    yield
+    for engine in shard_engines:
+        await engine.dispose()
+
+
+@pytest.fixture
+async def db(schema):
+    """Main session on emptied databases, the expiry sweep row is kept"""
+    from sqlalchemy import text
+
+    from src.app.core.db import sharding
+    from src.app.core.db.database import open_session
+    from src.app.models.models import Base, LinkExpirySweep, SHARDED_TABLES
+
+    async with open_session() as session:
+        for shard in sharding.shard_ids():
+            shard_session = sharding.session_for_shard(session, shard)
+            tables = Base.metadata.sorted_tables if shard == 0 else SHARDED_TABLES
+            names = ", ".join(table.name for table in tables if table is not LinkExpirySweep.__table__)
+            await shard_session.execute(text(f"TRUNCATE {names} RESTART IDENTITY CASCADE"))
+            await shard_session.execute(
+                text("UPDATE link_expiry_sweep SET swept_until = :now"), {"now": datetime.now(timezone.utc)}
+            )
+            await shard_session.commit()
+        yield session
+
+
+@pytest.fixture
+async def user(db):
+    from src.app.models.models import User
+
+    user = User(username="alice", fullname="Alice", hasshed_password="-")
+    db.add(user)
+    await db.commit()
+    return user
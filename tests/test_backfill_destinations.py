@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, inspect, select, text
+
+NOW = datetime.now(timezone.utc)
+CODES = [f"old{number:02d}" for number in range(30)]
+
+
+def _url(number: int) -> str:
+    return f"https://example.com/{number % 4}"
+
+
+@pytest.fixture
+async def baseline_links(db, user, monkeypatch):
+    """
+    Links stored the way they were before short domains, destinations and summaries,
+    on a single database. The schema is migrated back by the test
+    """
+    from src.app.core.db import sharding
+    from src.app.core.db.database import shard_engines
+    from src.app.models.models import Base, User
+
+    monkeypatch.setattr(sharding, "ring", sharding.HashRing([0]))
+    monkeypatch.setattr(sharding, "previous_ring", None)
+    monkeypatch.setattr(sharding, "shard_ids", lambda: range(1))
+    monkeypatch.setattr(sharding, "is_sharded", lambda: False)
+    async with shard_engines[0].begin() as conn:
+        added_tables = [table for table in Base.metadata.sorted_tables if table is not User.__table__]
+        await conn.run_sync(Base.metadata.drop_all, tables=added_tables)
+        await conn.execute(text(
+            "CREATE TABLE short_urls ("
+            "id SERIAL PRIMARY KEY, long_url VARCHAR(2048) NOT NULL, short_code VARCHAR NOT NULL, "
+            "user_id INTEGER NOT NULL REFERENCES users (id), clicks INTEGER NOT NULL, "
+            "created_at TIMESTAMP WITH TIME ZONE NOT NULL, expiration_time TIMESTAMP WITH TIME ZONE)"
+        ))
+        await conn.execute(text("CREATE UNIQUE INDEX ix_short_urls_short_code ON short_urls (short_code)"))
+        for number, code in enumerate(CODES):
+            await conn.execute(
+                text(
+                    "INSERT INTO short_urls (long_url, short_code, user_id, clicks, created_at) "
+                    "VALUES (:long_url, :short_code, :user_id, :clicks, :created_at)"
+                ),
+                {"long_url": _url(number), "short_code": code, "user_id": user.id, "clicks": number,
+                 "created_at": NOW - timedelta(minutes=number)},
+            )
+    yield
+    # the connections kept statements prepared against the old schema
+    for engine in shard_engines:
+        await engine.dispose()
+
+
+async def test_backfill_migrates_links_from_before_domains_and_destinations(db, user, baseline_links):
+    from src.app.core.db import backfill_destinations
+    from src.app.core.db.database import shard_engines
+    from src.app.crud import operations
+    from src.app.models.models import Destination
+
+    user_id = user.id
+    backfilled = await backfill_destinations.backfill(batch_size=4)
+
+    assert backfilled == {0: len(CODES)}
+    stats = [await operations.get_link_stats(db, 1, code) for code in CODES]
+    assert [(row.long_url, row.clicks) for row in stats] == [(_url(number), number) for number in range(len(CODES))]
+    assert (await db.execute(select(func.count()).select_from(Destination))).scalar() == 4
+    assert tuple(await operations.get_link_summary(db, user_id)) == (len(CODES), len(CODES), sum(range(len(CODES))))
+    async with shard_engines[0].connect() as conn:
+        constraints, indexes = await conn.run_sync(lambda sync_conn: (
+            inspect(sync_conn).get_unique_constraints("short_urls"), inspect(sync_conn).get_indexes("short_urls")
+        ))
+    assert [constraint["column_names"] for constraint in constraints] == [["domain_id", "short_code"]]
+    assert "ix_short_urls_user_id_created_at" in {index["name"] for index in indexes}
+
+    # new links keep working on the migrated schema, their codes are unique per domain
+    assert await operations.create_short_link(db, _url(0), CODES[0], user_id, NOW + timedelta(days=1), domain_id=2)
+    assert await backfill_destinations.backfill(batch_size=4) == {}
@@ -0,0 +1,48 @@
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import select, text
+
+
+async def test_click_events_are_stored_in_day_partitions(db):
+    from src.app.crud import operations
+    from src.app.models.models import ClickEvent
+
+    today = date.today()
+    await operations.create_click_event_partitions(db, today - timedelta(days=1), 3)
+    now = datetime.now(timezone.utc)
+    await operations.insert_click_events(db, [
+        (now, 1, "abc", None, "browser", None),
+        (now - timedelta(days=1), 1, "abc", "https://ref.example/", "bot", "10.0.0.0/24"),
+    ])
+
+    rows = (await db.execute(select(ClickEvent.id, ClickEvent.user_agent_class).order_by(ClickEvent.id))).all()
+    assert [agent for _, agent in rows] == ["browser", "bot"]
+    assert len({event_id for event_id, _ in rows}) == 2
+
+    assert await operations.drop_click_event_partitions(db, today) == [f"click_events_{today - timedelta(days=1):%Y%m%d}"]
+    assert (await db.execute(select(ClickEvent.user_agent_class))).scalars().all() == ["browser"]
+
+
+async def test_click_events_copied_without_ids_get_one(db):
+    from src.app.crud import operations
+    from src.app.models.models import ClickEvent
+
+    await operations.create_click_event_partitions(db, date.today(), 1)
+    # as COPY does, without SQLAlchemy filling in the sequence
+    await db.execute(text(
+        "INSERT INTO click_events (occurred_at, domain_id, short_code, user_agent_class) VALUES (now(), 1, 'abc', 'bot')"
+    ))
+    await db.commit()
+
+    assert (await db.execute(select(ClickEvent.id))).scalar_one() is not None
+
+
+def test_click_event_ids_come_from_a_sequence():
+    from sqlalchemy.dialects import postgresql
+    from sqlalchemy.schema import CreateTable
+
+    from src.app.models.models import ClickEvent
+
+    ddl = str(CreateTable(ClickEvent.__table__).compile(dialect=postgresql.dialect()))
+    assert "IDENTITY" not in ddl
+    assert ClickEvent.__table__.c.id.default.name == "click_events_id_seq"
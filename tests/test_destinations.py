@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+NOW = datetime.now(timezone.utc)
+URL = "https://example.com/"
+
+
+async def _destination_urls(db) -> list[str]:
+    from src.app.core.db import sharding
+    from src.app.models.models import Destination
+
+    urls = []
+    for shard in sharding.shard_ids():
+        session = sharding.session_for_shard(db, shard)
+        urls.extend((await session.execute(select(Destination.url))).scalars())
+        await session.rollback()
+    return sorted(urls)
+
+
+async def _prune(db) -> int:
+    from src.app.core.db import sharding
+    from src.app.crud import operations
+
+    return sum([
+        await operations.prune_destinations(sharding.session_for_shard(db, shard), batch_size=2)
+        for shard in sharding.shard_ids()
+    ])
+
+
+async def test_prune_keeps_destinations_of_links(db, user):
+    from src.app.crud import operations
+
+    for number in range(6):
+        await operations.create_short_link(
+            db, f"https://example.com/{number}", f"link{number}", user.id, NOW + timedelta(days=1)
+        )
+    await operations.create_short_link(db, "https://example.com/0", "same0", user.id, NOW + timedelta(days=1))
+    for number in range(5):
+        await operations.delete_short_link(db, user.id, 1, f"link{number}")
+    destinations = await _destination_urls(db)
+
+    pruned = await _prune(db)
+
+    assert await _destination_urls(db) == ["https://example.com/0", "https://example.com/5"]
+    assert pruned == len(destinations) - 2
+    assert (await operations.get_link_stats(db, 1, "same0")).long_url == "https://example.com/0"
+    assert await _prune(db) == 0
+
+
+async def test_link_to_a_pruned_cached_destination_is_created(db, user):
+    from src.app.core.db import sharding
+    from src.app.crud import operations
+    from src.app.schemas import ShortenRequest, UserResponse
+    from src.app.services import url_service
+
+    owner = UserResponse(id=user.id, username=user.username, fullname=user.fullname, created_at=NOW)
+    url_service.destination_ids.clear()
+    await url_service.create_short_url(ShortenRequest(original_url=URL, custom_alias="first"), owner, db)
+    await operations.delete_short_link(db, user.id, 1, "first")
+    await _prune(db)
+
+    # on the shard the destination id of the first link was cached for
+    code = next(code for code in (f"again{number}" for number in range(100))
+                if sharding.shard_for_code(code) == sharding.shard_for_code("first"))
+    await url_service.create_short_url(ShortenRequest(original_url=URL, custom_alias=code), owner, db)
+
+    assert (await operations.get_link_stats(db, 1, code)).long_url == URL
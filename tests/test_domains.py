@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+NOW = datetime.now(timezone.utc)
+
+
+@pytest.fixture
+async def branded(db, user):
+    """go.example added next to the default domain, a link with the same code on both"""
+    from src.app.crud import operations
+    from src.app.services import domains, hot_links
+
+    domain = await domains.create_domain("Go.Example", None, db)
+    await operations.create_short_link(db, "https://example.com/default", "promo", user.id, NOW + timedelta(days=1))
+    await operations.create_short_link(
+        db, "https://example.com/branded", "promo", user.id, NOW + timedelta(days=1), domain_id=domain["id"]
+    )
+    await operations.create_short_link(
+        db, "https://example.com/only", "only-go", user.id, NOW + timedelta(days=1), domain_id=domain["id"]
+    )
+    yield domain
+    domains.domains.load([])
+    hot_links.link_cache.clear()
+
+
+async def _redirect(short_code: str, host: str | None) -> httpx.Response:
+    from src.app.main import app
+
+    headers = {"Host": host} if host is not None else {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://minilink.test") as client:
+        return await client.get(f"/{short_code}", headers=headers)
+
+
+@pytest.mark.parametrize("host, location", [
+    ("go.example", "https://example.com/branded"),
+    ("GO.example:8443", "https://example.com/branded"),
+    ("minilink.test", "https://example.com/default"),
+    # hosts that aren't in the domains table are served as the default domain
+    ("unknown.example", "https://example.com/default"),
+])
+async def test_redirect_follows_the_host(branded, host, location):
+    response = await _redirect("promo", host)
+
+    assert response.status_code == 307
+    assert response.headers["location"] == location
+
+
+async def test_code_of_another_domain_is_not_found(branded):
+    assert (await _redirect("only-go", "go.example")).status_code == 307
+    assert (await _redirect("only-go", "minilink.test")).status_code == 404
+
+
+async def test_links_are_created_and_counted_per_domain(db, user, branded):
+    from src.app.core.utils.auth import create_access_token
+    from src.app.crud import operations
+    from src.app.main import app
+
+    token = create_access_token({"sub": user.username})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://minilink.test") as client:
+        response = await client.post(
+            "/api/v1/shorten",
+            json={"original_url": "https://example.com/new", "custom_alias": "fresh", "domain": "go.example"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        unknown = await client.post(
+            "/api/v1/shorten",
+            json={"original_url": "https://example.com/new", "domain": "nowhere.example"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+    await _redirect("promo", "go.example")
+
+    assert response.status_code == 200
+    assert response.json()["short_url"] == "https://go.example/fresh"
+    assert unknown.status_code == 400
+    assert (await operations.get_link_stats(db, branded["id"], "promo")).clicks == 1
+    assert (await operations.get_link_stats(db, 1, "promo")).clicks == 0
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+NOW = datetime.now(timezone.utc)
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    from src.app.services import hot_links, url_service
+
+    tracker = hot_links.HotLinkTracker(capacity=100, window=60, min_clicks=3)
+    monkeypatch.setattr(url_service, "tracker", tracker)
+    hot_links.link_cache.clear()
+    yield tracker
+    hot_links.link_cache.clear()
+
+
+async def test_only_redirects_are_tracked(db, user, tracker):
+    from src.app.core import exceptions
+    from src.app.crud import operations
+    from src.app.services import hot_links, url_service
+
+    await operations.create_short_link(db, "https://example.com/", "live", user.id, NOW + timedelta(days=1))
+    await operations.create_short_link(db, "https://example.com/", "expired", user.id, NOW - timedelta(days=1))
+
+    for _ in range(5):
+        assert await url_service.get_original_url(1, "live") == "https://example.com/"
+        with pytest.raises(exceptions.ShortUrlNotFound):
+            await url_service.get_original_url(1, "unknown")
+        with pytest.raises(exceptions.ShortUrlExpired):
+            await url_service.get_original_url(1, "expired")
+
+    assert [link["short_code"] for link in tracker.top(10)] == ["live"]
+    assert hot_links.cached_link((1, "live")) is not None
+
+
+async def _redirect(short_code: str) -> int:
+    import httpx
+
+    from src.app.main import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://minilink.test") as client:
+        return (await client.get(f"/{short_code}")).status_code
+
+
+async def test_cached_link_deleted_by_another_worker_is_not_found(db, user, tracker):
+    from src.app.crud import operations
+    from src.app.services import hot_links
+
+    await operations.create_short_link(db, "https://example.com/", "gone", user.id, NOW + timedelta(days=1))
+    for _ in range(5):
+        assert await _redirect("gone") == 307
+    assert hot_links.cached_link((1, "gone")) is not None
+
+    # the other worker's cache is the one it invalidates
+    await operations.delete_short_link(db, user.id, 1, "gone")
+
+    assert await _redirect("gone") == 404
+    assert hot_links.cached_link((1, "gone")) is None
+    assert await _redirect("gone") == 404
+
+
+async def test_cached_link_expired_by_another_worker_is_looked_up_again(db, user, tracker):
+    from src.app.core import exceptions
+    from src.app.crud import operations
+    from src.app.services import hot_links, url_service
+
+    await operations.create_short_link(db, "https://example.com/", "ending", user.id, NOW + timedelta(days=1))
+    for _ in range(5):
+        assert await _redirect("ending") == 307
+
+    await operations.update_links_expiration(db, user.id, NOW - timedelta(minutes=1), links=[(1, "ending")])
+
+    # answered from the cache, the click finds the new expiration time
+    assert await _redirect("ending") == 307
+    assert hot_links.cached_link((1, "ending")) is None
+    with pytest.raises(exceptions.ShortUrlExpired):
+        await url_service.get_original_url(1, "ending")
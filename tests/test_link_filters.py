@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from sqlalchemy import update
+
+NOW = datetime.now(timezone.utc)
+
+# short code -> (destination, created_at, expiration_time, clicks)
+LINKS = {
+    "fresh-active": ("https://site-a.example/1", NOW - timedelta(hours=1), NOW + timedelta(days=1), 0),
+    "old-active": ("https://site-a.example/2", NOW - timedelta(days=10), NOW + timedelta(days=1), 5),
+    "old-expired": ("https://site-b.example/1", NOW - timedelta(days=10), NOW - timedelta(days=1), 10),
+    "fresh-expired": ("https://site-b.example/2", NOW - timedelta(hours=1), NOW - timedelta(minutes=1), 1),
+    # no expiration time: active for LINK_DEFAULT_LIFETIME after creation
+    "fresh-unset": ("https://site-a.example/3", NOW - timedelta(hours=1), None, 0),
+    "old-unset": ("https://site-b.example/3", NOW - timedelta(days=10), None, 0),
+}
+
+# filters -> short codes they select
+SELECTIONS = [
+    ({"active": True}, {"fresh-active", "old-active", "fresh-unset"}),
+    ({"active": False}, {"old-expired", "fresh-expired", "old-unset"}),
+    ({"created_after": NOW - timedelta(days=2)}, {"fresh-active", "fresh-expired", "fresh-unset"}),
+    ({"created_before": NOW - timedelta(days=2)}, {"old-active", "old-expired", "old-unset"}),
+    ({"min_clicks": 5}, {"old-active", "old-expired"}),
+    ({"max_clicks": 0}, {"fresh-active", "fresh-unset", "old-unset"}),
+    ({"q": "site-a"}, {"fresh-active", "old-active", "fresh-unset"}),
+    ({"q": "FRESH"}, {"fresh-active", "fresh-expired", "fresh-unset"}),
+    ({"q": "%"}, set()),
+    ({"q": "site-b", "min_clicks": 1}, {"old-expired", "fresh-expired"}),
+    ({"active": False, "created_before": NOW - timedelta(days=2)}, {"old-expired", "old-unset"}),
+]
+
+
+@pytest.fixture
+async def links(db, user):
+    from src.app.core.db import sharding
+    from src.app.crud import operations
+    from src.app.models.models import ShortURL
+
+    for code, (url, created_at, expiration_time, clicks) in LINKS.items():
+        await operations.create_short_link(db, url, code, user.id, expiration_time)
+        session = sharding.session_for_code(db, code)
+        await session.execute(
+            update(ShortURL).where(ShortURL.short_code == code).values(created_at=created_at, clicks=clicks)
+        )
+        await session.commit()
+    # the summaries did not see the updates above
+    for shard in sharding.shard_ids():
+        await operations.reconcile_link_summaries(sharding.session_for_shard(db, shard))
+    return user
+
+
+async def _remaining_codes(db, user_id: int) -> set[str]:
+    from src.app.crud import operations
+    from src.app.schemas import LinkFilters
+
+    return {row.short_code for row in await operations.get_links(db, LinkFilters(limit=100), user_id)}
+
+
+@pytest.mark.parametrize("filters, selected", SELECTIONS)
+async def test_listing_selects_matching_links(db, links, filters, selected):
+    from src.app.crud import operations
+    from src.app.schemas import LinkFilters
+
+    rows = await operations.get_links(db, LinkFilters(limit=100, **filters), links.id)
+
+    assert {row.short_code for row in rows} == selected
+
+
+@pytest.mark.parametrize("filters, selected", SELECTIONS)
+async def test_bulk_delete_keeps_links_not_matching(db, links, filters, selected):
+    from src.app.crud import operations
+    from src.app.schemas import LinkPredicate
+
+    deleted = await operations.delete_short_links(db, links.id, filters=LinkPredicate(**filters))
+
+    assert {code for _, code in deleted} == selected
+    assert await _remaining_codes(db, links.id) == set(LINKS) - selected
+
+
+@pytest.mark.parametrize("filters, selected", SELECTIONS)
+async def test_bulk_expiration_changes_matching_links_only(db, links, filters, selected):
+    from src.app.crud import operations
+    from src.app.schemas import LinkFilters, LinkPredicate
+
+    expiration = NOW + timedelta(days=30)
+    changed = await operations.update_links_expiration(db, links.id, expiration, filters=LinkPredicate(**filters))
+
+    assert {code for _, code in changed} == selected
+    rows = await operations.get_links(db, LinkFilters(limit=100), links.id)
+    assert {row.short_code for row in rows if row.expiration_time == expiration} == selected
+
+
+async def test_bulk_delete_keeps_summary_in_line(db, links):
+    from src.app.core.db import sharding
+    from src.app.crud import operations
+    from src.app.schemas import LinkPredicate
+
+    await operations.delete_short_links(db, links.id, filters=LinkPredicate(active=False))
+
+    summary = await operations.get_link_summary(db, links.id)
+    for shard in sharding.shard_ids():
+        await operations.reconcile_link_summaries(sharding.session_for_shard(db, shard))
+
+    assert summary == await operations.get_link_summary(db, links.id)
+
+
+@pytest.mark.parametrize("filters", [{}, {"one_time_only": True}, {"q": None}])
+async def test_bulk_requests_reject_empty_filters(db, user, filters):
+    from src.app.core.utils.auth import create_access_token
+    from src.app.main import app
+
+    token = create_access_token({"sub": user.username})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://minilink.test") as client:
+        response = await client.post(
+            "/api/v1/my/urls/delete", json={"filters": filters}, headers={"Authorization": f"Bearer {token}"}
+        )
+
+    assert response.status_code == 422
+
+
+async def test_search_is_limited_to_the_users_links(db, links):
+    from src.app.crud import operations
+    from src.app.models.models import User
+    from src.app.schemas import LinkFilters
+
+    other = User(username="bob", fullname="Bob", hasshed_password="-")
+    db.add(other)
+    await db.commit()
+    # the same destinations as the links of the first user
+    await operations.create_short_link(db, "https://site-a.example/1", "bobs-link", other.id, NOW + timedelta(days=1))
+
+    rows = await operations.get_links(db, LinkFilters(limit=100, q="site-a"), links.id)
+    assert {row.short_code for row in rows} == {"fresh-active", "old-active", "fresh-unset"}
+    rows = await operations.get_links(db, LinkFilters(limit=100, q="site-a"), other.id)
+    assert {row.short_code for row in rows} == {"bobs-link"}
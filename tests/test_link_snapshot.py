@@ -0,0 +1,80 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import fcntl
+
+import asyncpg
+import pytest
+
+NOW = datetime.now(timezone.utc)
+
+
+@pytest.fixture
+def snapshot(monkeypatch, tmp_path):
+    from src.app.core.db.snapshot import LinkSnapshot
+    from src.app.services import link_snapshot
+
+    monkeypatch.setattr(link_snapshot, "snapshot", LinkSnapshot(str(tmp_path / "link_snapshot.bin")))
+    # several pages per shard
+    monkeypatch.setattr(link_snapshot, "PAGE_SIZE", 3)
+    return link_snapshot.snapshot
+
+
+async def _create_links(db, user, codes):
+    from src.app.crud import operations
+
+    for code in codes:
+        await operations.create_short_link(db, f"https://example.com/{code}", code, user.id, NOW + timedelta(days=1))
+
+
+async def test_refresh_rewrites_then_appends(db, user, snapshot):
+    from src.app.services import link_snapshot
+
+    await _create_links(db, user, [f"first{number}" for number in range(10)])
+    await link_snapshot.refresh(db)
+    built_at = snapshot.built_at
+    await _create_links(db, user, [f"second{number}" for number in range(10)])
+    await link_snapshot.refresh(db)
+
+    assert snapshot.built_at == built_at
+    assert len(snapshot) == 20
+    assert snapshot.get(1, "second7")[0] == "https://example.com/second7"
+    assert snapshot.get(1, "missing") is None
+
+
+async def test_refresh_loads_the_file_while_another_worker_writes_it(db, user, snapshot):
+    from src.app.core.db.snapshot import LinkSnapshot
+    from src.app.services import link_snapshot
+
+    await _create_links(db, user, ["shared"])
+    other_worker = LinkSnapshot(snapshot.path)
+    writer = other_worker.rewriter()
+    writer.write([(1, 1, "shared", "https://example.com/shared", NOW, None)])
+    writer.commit()
+
+    with open(f"{snapshot.path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        await link_snapshot.refresh(db)
+
+    assert snapshot.get(1, "shared") == ("https://example.com/shared", NOW, None)
+
+
+async def _lose_connection(*args, **kwargs):
+    raise asyncpg.InterfaceError("connection is closed")
+
+
+async def test_lost_database_falls_back_to_the_snapshot(db, user, snapshot, monkeypatch):
+    from src.app.crud import operations
+    from src.app.services import hot_links, link_snapshot, url_service
+
+    await _create_links(db, user, ["kept"])
+    await link_snapshot.refresh(db)
+    hot_links.link_cache.clear()
+    monkeypatch.setattr(link_snapshot, "pending_clicks", Counter())
+    monkeypatch.setattr(operations, "update_short_link_clicks", _lose_connection)
+    monkeypatch.setattr(operations, "get_links_by_codes", _lose_connection)
+
+    await url_service.collect_statistic(db, 1, "kept")
+    resolved = await url_service.resolve_links(1, ["kept", "missing"], db)
+
+    assert link_snapshot.pending_clicks == {(1, "kept"): 1}
+    assert [link["status"] for link in resolved] == ["ok", "not_found"]
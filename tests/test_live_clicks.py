@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+import asyncio
+
+import pytest
+
+NOW = datetime.now(timezone.utc)
+LINK = (1, "watched")
+
+
+def _next_count(clicks) -> asyncio.Task:
+    """The next count of the stream, which has to be waiting for it before the channel changes"""
+    return asyncio.create_task(asyncio.wait_for(anext(clicks), 5))
+
+
+@pytest.fixture
+async def stream(db, user):
+    from src.app.crud import operations
+    from src.app.services.live_clicks import ClickBroadcaster
+
+    await operations.create_short_link(db, "https://example.com/", LINK[1], user.id, NOW + timedelta(days=1))
+    broadcaster = ClickBroadcaster(tick=60, keepalive=60)
+    clicks = broadcaster.watch(LINK, 0)
+    assert await anext(clicks) == 0
+    yield broadcaster, clicks
+    await broadcaster.stop()
+    await clicks.aclose()
+
+
+async def test_click_written_while_resyncing_is_counted_once(db, stream):
+    from src.app.crud import operations
+
+    broadcaster, _ = stream
+    # written before the resync reads the count, reported by the redirect only after it
+    click = await operations.update_short_link_clicks(db, *LINK)
+    await broadcaster.resync(db)
+    broadcaster.record(LINK, click.clicks)
+    broadcaster.publish()
+
+    # a new viewer starts from the count of the channel
+    viewer = broadcaster.watch(LINK, 0)
+    assert await anext(viewer) == 1
+    await viewer.aclose()
+
+
+async def test_resync_picks_up_clicks_of_other_workers(db, stream):
+    from src.app.crud import operations
+
+    broadcaster, clicks = stream
+    next_count = _next_count(clicks)
+    broadcaster.record(LINK, (await operations.update_short_link_clicks(db, *LINK)).clicks)
+    broadcaster.publish()
+    assert await next_count == 1
+    next_count = _next_count(clicks)
+    # another worker's clicks
+    await operations.update_short_link_clicks(db, *LINK, count=2)
+    await broadcaster.resync(db)
+
+    assert await next_count == 3
@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+
+
+async def test_jobs_keep_running_after_failures(schema):
+    from src.app.services import maintenance
+
+    runs = 0
+    done = asyncio.Event()
+
+    async def job(db):
+        nonlocal runs
+        runs += 1
+        if runs == 1:
+            raise RuntimeError("bug in the job")
+        if runs == 2:
+            raise asyncio.TimeoutError()
+        done.set()
+
+    task = asyncio.create_task(maintenance._run_periodically("flaky", 0, job))
+    await asyncio.wait_for(done.wait(), 5)
+    task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert runs == 3
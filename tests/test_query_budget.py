@@ -0,0 +1,235 @@
+"""
+Database round trips per endpoint, checked against a declared budget.
+
+Every scenario sends one request to the app in-process and counts the SQL
+statements and transactions it issued: statements through SQLAlchemy on every
+link shard engine, and lookups on the raw asyncpg pools. Work the request
+leaves to background jobs (click events, summaries sweep, ...) isn't counted.
+
+A test fails when its endpoint goes over budget, so hidden round trips added to
+crud/operations are caught before they ship. Lower a budget when an endpoint gets
+cheaper. The budgets are those of a single PostgreSQL database, every link stays on
+the main test database while they are checked. To run only them:
+
+    MINILINK_TEST_DATABASE_URL=postgresql://postgres@localhost/minilink_test pytest -m query_budget
+"""
+
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+from uuid import uuid4
+import asyncio
+
+import httpx
+import pytest
+from sqlalchemy import event
+
+pytestmark = pytest.mark.query_budget
+
+
+class Recording:
+    def __init__(self):
+        self.statements: list[str] = []
+        self.transactions = 0
+
+
+_recording: ContextVar[Recording | None] = ContextVar("query_budget_recording", default=None)
+
+
+def _on_statement(_conn, _cursor, statement, _parameters, _context, _executemany):
+    recording = _recording.get()
+    if recording is not None:
+        recording.statements.append(statement)
+
+
+def _on_begin(_conn):
+    recording = _recording.get()
+    if recording is not None:
+        recording.transactions += 1
+
+
+def _on_lookup_query(record):
+    recording = _recording.get()
+    if recording is not None:
+        recording.statements.append(record.query)
+
+
+class Context:
+    """State the scenarios share, they run in the order they are declared"""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.username = f"budget-{uuid4().hex[:8]}"
+        self.headers: dict[str, str] = {}
+        self.destination = f"https://example.com/{uuid4().hex}"
+        self.codes: list[str] = []
+
+
+Scenario = Callable[[Context], Awaitable[httpx.Response]]
+SCENARIOS: list[tuple[str, int, int, Scenario]] = []
+
+
+def budget(endpoint: str, statements: int, transactions: int):
+    def declare(scenario: Scenario) -> Scenario:
+        SCENARIOS.append((endpoint, statements, transactions, scenario))
+        return scenario
+    return declare
+
+
+@budget("POST /api/v1/register", statements=2, transactions=1)
+async def register(ctx: Context) -> httpx.Response:
+    return await ctx.client.post(
+        "/api/v1/register", json={"username": ctx.username, "fullname": "budget", "password": "budget"}
+    )
+
+
+@budget("POST /api/v1/token", statements=1, transactions=1)
+async def token(ctx: Context) -> httpx.Response:
+    response = await ctx.client.post("/api/v1/token", data={"username": ctx.username, "password": "budget"})
+    ctx.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return response
+
+
+@budget("POST /api/v1/shorten", statements=5, transactions=2)
+async def shorten(ctx: Context) -> httpx.Response:
+    # a new destination is inserted along with the link
+    response = await ctx.client.post("/api/v1/shorten", json={"original_url": ctx.destination}, headers=ctx.headers)
+    ctx.codes.append(response.json()["short_code"])
+    return response
+
+
+@budget("POST /api/v1/shorten (alias)", statements=4, transactions=2)
+async def shorten_alias(ctx: Context) -> httpx.Response:
+    # the id of the destination is known by now
+    response = await ctx.client.post(
+        "/api/v1/shorten",
+        json={"original_url": ctx.destination, "custom_alias": f"budget-{uuid4().hex[:8]}"},
+        headers=ctx.headers,
+    )
+    ctx.codes.append(response.json()["short_code"])
+    return response
+
+
+@budget("GET /{short_code}", statements=2, transactions=1)
+async def redirect(ctx: Context) -> httpx.Response:
+    return await ctx.client.get(f"/{ctx.codes[0]}")
+
+
+@budget("GET /api/v1/stats/{short_code}", statements=2, transactions=2)
+async def stats(ctx: Context) -> httpx.Response:
+    return await ctx.client.get(f"/api/v1/stats/{ctx.codes[0]}", headers=ctx.headers)
+
+
+@budget("GET /api/v1/my/urls", statements=2, transactions=2)
+async def my_urls(ctx: Context) -> httpx.Response:
+    return await ctx.client.get("/api/v1/my/urls", headers=ctx.headers)
+
+
+@budget("GET /api/v1/my/summary", statements=3, transactions=2)
+async def my_summary(ctx: Context) -> httpx.Response:
+    return await ctx.client.get("/api/v1/my/summary", headers=ctx.headers)
+
+
+@budget("POST /api/v1/resolve", statements=2, transactions=2)
+async def resolve(ctx: Context) -> httpx.Response:
+    return await ctx.client.post(
+        "/api/v1/resolve", json={"short_codes": ctx.codes + ["no-such-code"]}, headers=ctx.headers
+    )
+
+
+@budget("POST /api/v1/my/urls/expiration", statements=3, transactions=2)
+async def bulk_expiration(ctx: Context) -> httpx.Response:
+    expiration = datetime.now(timezone.utc) + timedelta(days=1)
+    return await ctx.client.post(
+        "/api/v1/my/urls/expiration",
+        json={"short_codes": ctx.codes, "expiration_time": expiration.isoformat()},
+        headers=ctx.headers,
+    )
+
+
+@budget("DELETE /api/v1/{short_code}", statements=2, transactions=2)
+async def delete_one(ctx: Context) -> httpx.Response:
+    return await ctx.client.delete(f"/api/v1/{ctx.codes.pop()}", headers=ctx.headers)
+
+
+@budget("POST /api/v1/my/urls/delete", statements=4, transactions=2)
+async def bulk_delete(ctx: Context) -> httpx.Response:
+    return await ctx.client.post(
+        "/api/v1/my/urls/delete", json={"filters": {"q": ctx.destination}}, headers=ctx.headers
+    )
+
+
+@budget("GET /api/v1/admin/domains", statements=1, transactions=1)
+async def admin_domains(ctx: Context) -> httpx.Response:
+    return await ctx.client.get("/api/v1/admin/domains", headers=ctx.headers)
+
+
+async def _record(scenario: Scenario, ctx: Context) -> tuple[httpx.Response, Recording]:
+    recording = Recording()
+    token = _recording.set(recording)
+    try:
+        response = await scenario(ctx)
+    finally:
+        _recording.reset(token)
+    # asyncpg query loggers are called soon after the query, not during it
+    for _ in range(3):
+        await asyncio.sleep(0)
+    return response, recording
+
+
+@pytest.fixture(scope="module")
+def single_database():
+    """Every link on the main database, as the budgets are declared for"""
+    from src.app.core.db import sharding
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(sharding, "ring", sharding.HashRing([0]))
+        patch.setattr(sharding, "previous_ring", None)
+        patch.setattr(sharding, "shard_ids", lambda: range(1))
+        patch.setattr(sharding, "is_sharded", lambda: False)
+        yield
+
+
+@pytest.fixture(scope="module")
+def counted_queries():
+    from src.app.core.db import lookup
+    from src.app.core.db.database import shard_engines
+
+    for engine in shard_engines:
+        event.listen(engine.sync_engine, "before_cursor_execute", _on_statement)
+        event.listen(engine.sync_engine, "begin", _on_begin)
+    lookup.query_loggers.append(_on_lookup_query)
+    yield
+    lookup.query_loggers.remove(_on_lookup_query)
+    for engine in shard_engines:
+        event.remove(engine.sync_engine, "before_cursor_execute", _on_statement)
+        event.remove(engine.sync_engine, "begin", _on_begin)
+
+
+@pytest.fixture(scope="module")
+async def recordings(schema, single_database, counted_queries) -> dict[str, tuple[httpx.Response, Recording]]:
+    """Response and recording of every scenario by endpoint"""
+    from src.app.core.settings import app_settings
+    from src.app.main import app
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://budget") as client:
+            ctx = Context(client)
+            app_settings.ADMIN_USERNAMES.append(ctx.username)
+            try:
+                for endpoint, _, _, scenario in SCENARIOS:
+                    results[endpoint] = await _record(scenario, ctx)
+            finally:
+                app_settings.ADMIN_USERNAMES.remove(ctx.username)
+    return results
+
+
+@pytest.mark.parametrize("endpoint, statements, transactions", [scenario[:3] for scenario in SCENARIOS])
+async def test_endpoint_stays_within_budget(recordings, endpoint, statements, transactions):
+    response, recording = recordings[endpoint]
+    assert response.status_code < 400, response.text
+    issued = "\n".join(" ".join(statement.split())[:160] for statement in recording.statements)
+    assert len(recording.statements) <= statements, f"{len(recording.statements)} statements:\n{issued}"
+    assert recording.transactions <= transactions, f"{recording.transactions} transactions:\n{issued}"
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+NOW = datetime.now(timezone.utc)
+EXPIRATION = (NOW + timedelta(days=1)).replace(microsecond=0)
+ENDED = (NOW - timedelta(days=1)).replace(microsecond=0)
+CODES = ["alive", "nothing", "ended", "alive"]
+
+
+@pytest.fixture
+async def resolve(db, user):
+    """Posts a resolve request of CODES, returns the response"""
+    from src.app.core.utils.auth import create_access_token
+    from src.app.crud import operations
+    from src.app.main import app
+    from src.app.services import hot_links
+
+    hot_links.link_cache.clear()
+    await operations.create_short_link(db, "https://example.com/alive", "alive", user.id, EXPIRATION)
+    await operations.create_short_link(db, "https://example.com/ended", "ended", user.id, ENDED)
+    token = create_access_token({"sub": user.username})
+
+    async def post(accept: str | None = None, **body) -> httpx.Response:
+        headers = {"Authorization": f"Bearer {token}"}
+        if accept is not None:
+            headers["Accept"] = accept
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://minilink.test") as client:
+            return await client.post("/api/v1/resolve", json={"short_codes": CODES, **body}, headers=headers)
+    return post
+
+
+def _expected(render=lambda expiration_time: expiration_time) -> list[dict]:
+    alive = {"short_code": "alive", "status": "ok", "long_url": "https://example.com/alive",
+             "expiration_time": render(EXPIRATION)}
+    return [
+        alive,
+        {"short_code": "nothing", "status": "not_found", "long_url": None, "expiration_time": None},
+        {"short_code": "ended", "status": "expired", "long_url": "https://example.com/ended",
+         "expiration_time": render(ENDED)},
+        alive,
+    ]
+
+
+async def test_resolve_answers_json_in_the_requested_order(db, resolve):
+    from src.app.crud import operations
+
+    response = await resolve()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json()["links"] == _expected(datetime.isoformat)
+    # resolving is not a click
+    assert (await operations.get_link_stats(db, 1, "alive")).clicks == 0
+
+
+async def test_resolve_answers_msgpack_when_accepted(resolve):
+    msgpack = pytest.importorskip("msgpack")
+
+    response = await resolve(accept="application/msgpack")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content, timestamp=3)["links"] == _expected()
+
+
+async def test_resolve_rejects_an_unknown_domain(resolve):
+    response = await resolve(domain="nowhere.example")
+
+    assert response.status_code == 400
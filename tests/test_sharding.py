@@ -0,0 +1,163 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete, select, text, update
+
+NOW = datetime.now(timezone.utc)
+CODES = [f"link{number:02d}" for number in range(40)]
+
+
+class GrowingShards:
+    """Links are created while there is only the main database, until grow() adds the other shards"""
+
+    def __init__(self, monkeypatch):
+        from src.app.core.db import sharding
+
+        self._monkeypatch = monkeypatch
+        self.ring = sharding.ring
+        monkeypatch.setattr(sharding, "ring", sharding.HashRing([0]))
+
+    def grow(self):
+        from src.app.core.db import sharding
+
+        self._monkeypatch.setattr(sharding, "previous_ring", sharding.HashRing([0]))
+        self._monkeypatch.setattr(sharding, "ring", self.ring)
+
+
+@pytest.fixture
+def growing_shards(monkeypatch):
+    return GrowingShards(monkeypatch)
+
+
+async def _create_links(db, user, codes=CODES):
+    from src.app.crud import operations
+
+    for number, code in enumerate(codes):
+        await operations.create_short_link(db, f"https://example.com/{number % 7}", code, user.id, NOW + timedelta(days=1))
+
+
+async def _shards_holding(db, code: str) -> list[int]:
+    from src.app.core.db import sharding
+    from src.app.models.models import ShortURL
+
+    shards = []
+    for shard in sharding.shard_ids():
+        session = sharding.session_for_shard(db, shard)
+        if (await session.execute(select(ShortURL.id).where(ShortURL.short_code == code))).first():
+            shards.append(shard)
+        await session.rollback()
+    return shards
+
+
+async def test_links_are_placed_on_their_ring_shard(db, user):
+    from src.app.core.db import sharding
+
+    await _create_links(db, user)
+
+    placement = {code: await _shards_holding(db, code) for code in CODES}
+    assert placement == {code: [sharding.shard_for_code(code)] for code in CODES}
+    # the codes are spread over every shard
+    assert {shard for shards in placement.values() for shard in shards} == set(sharding.shard_ids())
+
+
+async def test_listing_merges_shards_newest_first(db, user):
+    from src.app.core.db import sharding
+    from src.app.crud import operations
+    from src.app.models.models import ShortURL
+    from src.app.schemas import LinkFilters
+
+    await _create_links(db, user)
+    for number, code in enumerate(CODES):
+        session = sharding.session_for_code(db, code)
+        # interleaved over the shards
+        await session.execute(
+            update(ShortURL).where(ShortURL.short_code == code).values(created_at=NOW - timedelta(minutes=number))
+        )
+        await session.commit()
+
+    pages = [
+        [row.short_code for row in await operations.get_links(db, LinkFilters(offset=offset, limit=7), user.id)]
+        for offset in range(0, len(CODES), 7)
+    ]
+
+    assert pages == [CODES[offset:offset + 7] for offset in range(0, len(CODES), 7)]
+
+
+async def test_rebalance_moves_links_to_the_new_shards(db, user, growing_shards):
+    from src.app.core.db import rebalance, sharding
+    from src.app.crud import operations
+
+    await _create_links(db, user)
+    user_id = user.id
+    growing_shards.grow()
+    # links not moved yet are still found on the previous shard
+    for code in CODES[:5]:
+        await operations.update_short_link_clicks(db, 1, code, 3)
+    summary = await operations.get_link_summary(db, user_id)
+
+    moved = await rebalance.rebalance(batch_size=7, dry_run=False)
+
+    misplaced = [code for code in CODES if sharding.shard_for_code(code) != 0]
+    assert sum(moved.values()) == len(misplaced) > 0
+    assert {source for source, _ in moved} == {0}
+    for code in CODES:
+        assert await _shards_holding(db, code) == [sharding.shard_for_code(code)]
+    stats = [await operations.get_link_stats(db, 1, code) for code in CODES]
+    assert [row.clicks for row in stats] == [3] * 5 + [0] * (len(CODES) - 5)
+    assert [row.long_url for row in stats] == [f"https://example.com/{number % 7}" for number in range(len(CODES))]
+    assert await operations.get_link_summary(db, user_id) == summary
+    # nothing left to move
+    assert not await rebalance.rebalance(batch_size=7, dry_run=False)
+
+
+async def _wait_for_lock_waiter(session):
+    for _ in range(500):
+        waiting = await session.execute(text("SELECT count(*) FROM pg_locks WHERE NOT granted"))
+        if waiting.scalar():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("nothing waits for the lock")
+
+
+@pytest.mark.parametrize("write", ["click", "delete"])
+async def test_writes_follow_a_link_moved_while_waiting_for_it(db, user, growing_shards, write):
+    """The write misses the new shard, then waits for the lock the rebalance holds on the previous one"""
+    from src.app.core.db import rebalance, sharding
+    from src.app.core.db.database import shard_sessionmakers
+    from src.app.crud import operations
+    from src.app.models.models import Destination, ShortURL
+
+    code = next(code for code in CODES if growing_shards.ring.shard_for(code) != 0)
+    await _create_links(db, user, [code])
+    growing_shards.grow()
+    target = sharding.shard_for_code(code)
+
+    async with shard_sessionmakers[0]() as source, shard_sessionmakers[0]() as monitor:
+        link = (await source.execute(
+            select(*rebalance.COPIED_COLUMNS, Destination.url)
+            .join_from(ShortURL, Destination)
+            .where(ShortURL.short_code == code)
+            .with_for_update(of=ShortURL)
+        )).one()
+        if write == "click":
+            written = asyncio.create_task(operations.update_short_link_clicks(db, 1, code))
+        else:
+            written = asyncio.create_task(operations.delete_short_link(db, user.id, 1, code))
+        await _wait_for_lock_waiter(monitor)
+
+        async with shard_sessionmakers[target]() as target_session:
+            destination_ids = await operations.intern_destinations(target_session, [link.url])
+            target_session.add(ShortURL(
+                **{column.key: link._mapping[column.key] for column in rebalance.COPIED_COLUMNS},
+                destination_id=destination_ids[link.url],
+            ))
+            await target_session.commit()
+        await source.execute(delete(ShortURL).where(ShortURL.short_code == code))
+        await source.commit()
+
+    assert await written is not None
+    if write == "click":
+        assert (await operations.get_link_stats(db, 1, code)).clicks == 1
+    else:
+        assert await _shards_holding(db, code) == []
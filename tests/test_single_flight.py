@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+
+class Call:
+    """A call held until release(), counting how many times it was started"""
+
+    def __init__(self, result=None, error: Exception | None = None):
+        self.result = result
+        self.error = error
+        self.started = 0
+        self._released = asyncio.Event()
+
+    def release(self):
+        self._released.set()
+
+    async def __call__(self):
+        self.started += 1
+        await self._released.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def _waiting(flight, key, call: Call, callers: int) -> list[asyncio.Task]:
+    tasks = [asyncio.create_task(flight.do(key, call)) for _ in range(callers)]
+    # every caller is waiting for the call
+    await asyncio.sleep(0)
+    return tasks
+
+
+async def test_concurrent_callers_share_one_call():
+    from src.app.core.utils.single_flight import SingleFlight
+
+    flight = SingleFlight(timeout=5)
+    call = Call(result="link")
+
+    tasks = await _waiting(flight, "code", call, 5)
+    other = Call(result="other")
+    other.release()
+    # other keys don't wait for it
+    assert await flight.do("other", other) == "other"
+    call.release()
+
+    assert await asyncio.gather(*tasks) == ["link"] * 5
+    assert call.started == 1
+
+
+async def test_error_reaches_every_waiter():
+    from src.app.core.utils.single_flight import SingleFlight
+
+    flight = SingleFlight(timeout=5)
+    call = Call(error=LookupError("database is gone"))
+
+    tasks = await _waiting(flight, "code", call, 3)
+    call.release()
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert [type(result) for result in results] == [LookupError] * 3
+    assert call.started == 1
+    assert len(flight) == 0
+
+
+async def test_timed_out_callers_leave_the_call_running():
+    from src.app.core.utils.single_flight import SingleFlight
+
+    flight = SingleFlight(timeout=0.01)
+    call = Call(result="link")
+
+    with pytest.raises(asyncio.TimeoutError):
+        await flight.do("code", call)
+    # a caller arriving later joins the call still in flight
+    flight.timeout = 5
+    late = asyncio.create_task(flight.do("code", call))
+    await asyncio.sleep(0)
+    call.release()
+
+    assert await late == "link"
+    assert call.started == 1
+
+
+async def test_key_is_forgotten_once_the_call_completes():
+    from src.app.core.utils.single_flight import SingleFlight
+
+    flight = SingleFlight(timeout=5)
+    first = Call(result=1)
+
+    tasks = await _waiting(flight, "code", first, 2)
+    assert len(flight) == 1
+    first.release()
+    await asyncio.gather(*tasks)
+    await asyncio.sleep(0)
+
+    assert len(flight) == 0
+    second = Call(result=2)
+    second.release()
+    assert await flight.do("code", second) == 2
+    assert second.started == 1